@@ -34,6 +34,12 @@ setup(
         "dev": [
             'wsgidav',
             'flake8'
+        ],
+        "bench": [
+            'pyftpdlib',
+            'wsgidav',
+            'cheroot',
+            'paramiko'
         ]
     },
 )
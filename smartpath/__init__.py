@@ -1 +1,7 @@
 from .uripath import UriPath as SmartPath  # noqa: disable=F401
+from .transfer import (copy, download_dir, download_many,  # noqa: disable=F401
+                       TransferStats, upload_dir, upload_many)
+from .cache import CachingAccessor, ContentCache  # noqa: disable=F401
+from .aio import AsyncPath  # noqa: disable=F401
+from .sync import sync  # noqa: disable=F401
+from .profiler import profile  # noqa: disable=F401
@@ -0,0 +1,228 @@
+'''Glob matching and concurrent directory expansion for remote paths'''
+import re
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_WORKERS = 8  # directories listed concurrently
+
+_MAGIC = re.compile('[*?[]')
+
+
+def has_magic(segment):
+    return _MAGIC.search(segment) is not None
+
+
+def translate(segment):
+    '''Regex for a single path segment, so wildcards never cross a "/"'''
+    return re.compile('(?s:{})\\Z'.format(_translate(segment)))
+
+
+def _translate(segment):
+    i, n, regex = 0, len(segment), []
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and segment[j] == '!':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:
+                regex.append('\\[')
+            else:
+                chars = segment[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if chars[0] == '!':
+                    chars = '^/' + chars[1:]
+                elif chars[0] == '^':
+                    chars = '\\' + chars
+                regex.append('[{}]'.format(chars))
+        else:
+            regex.append(re.escape(c))
+    return ''.join(regex)
+
+
+def split(pattern):
+    '''Splits a glob pattern into its segments'''
+    parts = [part for part in pattern.split('/') if part not in ('', '.')]
+    if not parts:
+        raise ValueError('Unacceptable pattern: {!r}'.format(pattern))
+    return parts
+
+
+def match(path, pattern):
+    '''Whether `path` matches `pattern` like `pathlib.PurePath.match()`:
+    relative patterns match from the right, absolute ones the whole path'''
+    parts = [part for part in path.split('/') if part]
+    patterns = split(pattern)
+    if pattern.startswith('/') and len(parts) != len(patterns):
+        return False
+    if len(patterns) > len(parts):
+        return False
+    return all(translate(pat).match(part)
+               for part, pat in zip(reversed(parts), reversed(patterns)))
+
+
+def parallel(frontier, expand, max_workers=DEFAULT_WORKERS):
+    '''Expands items concurrently, yielding results as they arrive
+
+    `expand(item)` returns ``(results, items)``, the new items joining the
+    frontier. At most `max_workers` expansions run at once and the frontier
+    is expanded last in, first out (depth first), which bounds its size.
+    '''
+    frontier = list(frontier)
+    running = set()
+    with ThreadPoolExecutor(max_workers) as executor:
+        while frontier or running:
+            while frontier and len(running) < max_workers:
+                running.add(executor.submit(expand, frontier.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results, items = future.result()
+                frontier.extend(items)
+                for result in results:
+                    yield result
+
+
+def glob(path, pattern, max_workers=DEFAULT_WORKERS):
+    '''Yields the paths below `path` matching `pattern`, see `BasePath.glob`
+
+    Leading literal segments are joined without listing, so only the
+    matching subtree is visited. Patterns with ``**`` are answered from a
+    single flat listing of that subtree on clients with the `scantree`
+    capability (object stores), and otherwise by listing directories
+    concurrently with up to `max_workers` threads. Sessions which are not
+    pooled are assumed not to be thread-safe and are listed serially.
+    '''
+    if pattern.startswith('/'):
+        raise NotImplementedError('Non-relative patterns are unsupported')
+    segments = split(pattern)
+    while len(segments) > 1 and segments[0] != '**' and \
+            not has_magic(segments[0]):
+        path = path.joinpath(segments.pop(0))
+    if '**' in segments and _capable(path, 'scantree'):
+        matches = _glob_flat(path, segments)
+    else:
+        matches = _glob_tree(path, segments, workers(path, max_workers))
+    if segments.count('**') > 1:
+        matches = _unique(matches)
+    return matches
+
+
+def workers(path, max_workers):
+    '''Threads which may use the session of `path` concurrently'''
+    if getattr(path.session, 'pool_key', None) is None:
+        return 1  # a single connection, e.g. an FTP control channel
+    return max_workers
+
+
+def _capable(path, capability):
+    capabilities = getattr(path.session, 'CAPABILITIES', None)
+    return bool(getattr(capabilities, capability, False))
+
+
+def _unique(paths):
+    seen = set()
+    for path in paths:
+        if path.path not in seen:
+            seen.add(path.path)
+            yield path
+
+
+def _glob_tree(top, segments, max_workers):
+    last = len(segments) - 1
+    regexes = [None if s == '**' else translate(s) for s in segments]
+
+    def expand(item):
+        directory, states, verified = item
+        matches, children = [], {}
+
+        def descend(child, k):
+            children.setdefault(child.path, (child, set()))[1].add(k)
+
+        # '**' also matches no directory at all
+        states, stack = set(), list(states)
+        while stack:
+            k = stack.pop()
+            if k not in states:
+                states.add(k)
+                if segments[k] == '**':
+                    if k == last:
+                        matches.append(directory)
+                    else:
+                        stack.append(k + 1)
+        listed = set()
+        for k in states:
+            if segments[k] == '**' or has_magic(segments[k]) or k == last:
+                listed.add(k)
+            else:  # a literal directory is joined rather than listed
+                descend(directory.joinpath(segments[k]), k + 1)
+        frontier = [(child, ks, False) for child, ks in children.values()]
+        children.clear()
+        if listed:
+            try:
+                for child in directory.iterdir():
+                    for k in listed:
+                        if segments[k] == '**':
+                            if child.is_dir():
+                                descend(child, k)
+                        elif regexes[k].match(child.name):
+                            if k == last:
+                                matches.append(child)
+                            elif child.is_dir():
+                                descend(child, k + 1)
+            except OSError:
+                pass  # like pathlib, unreadable directories are skipped
+            except Exception:
+                if verified:
+                    raise
+                return [], []  # the literal directory does not exist
+        frontier.extend((child, ks, True) for child, ks in children.values())
+        return matches, frontier
+
+    return parallel([(top, {0}, True)], expand, max_workers)
+
+
+def _translate_path(segments):
+    '''Regex for paths relative to the top directory of a glob'''
+    regex = ''
+    for i, segment in enumerate(segments):
+        if segment != '**':
+            regex += _translate(segment) + '/'
+        elif i < len(segments) - 1:
+            regex += '(?:[^/]+/)*'
+        elif regex:  # trailing '**' matches the directory itself too
+            regex = regex[:-1] + '(?:/[^/]+)*/'
+        else:
+            regex = '(?:[^/]+(?:/[^/]+)*)?/'
+    return re.compile('(?s:{})\\Z'.format(regex[:-1]))
+
+
+def _glob_flat(top, segments):
+    regex = _translate_path(segments)
+    if segments[-1] == '**' and regex.match(''):
+        yield top
+    base = top.path.rstrip('/') + '/'
+    directories = set()
+    for entry in top.session.scantree(top.path):
+        relative = entry.path[len(base):]
+        # virtual directories only show up as part of the blob names
+        parts = relative.split('/')
+        for i in range(1, len(parts)):
+            directory = '/'.join(parts[:i])
+            if directory not in directories:
+                directories.add(directory)
+                if regex.match(directory):
+                    child = top._target(base + directory)
+                    yield child
+        if segments[-1] != '**' and regex.match(relative):
+            child = top._target(entry.path)
+            child._dir_entry = entry
+            yield child
@@ -0,0 +1,97 @@
+'''Concurrent directory tree walking for remote paths'''
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ._glob import DEFAULT_WORKERS, workers
+
+
+def walk(top, top_down=True, on_error=None, max_workers=DEFAULT_WORKERS):
+    '''Yields ``(dirpath, dirnames, filenames)`` below `top`, see
+    `BasePath.walk`
+
+    Up to `max_workers` directories are listed at a time (one at a time if
+    the session is not pooled) while the caller consumes the results. The
+    directories still to be listed are kept last in, first out, so the
+    walk is depth first and only a listing per in-flight directory is held
+    in memory, never the whole tree.
+    '''
+    max_workers = workers(top, max_workers)
+    if top_down:
+        return _top_down(top, on_error, max_workers)
+    return _bottom_up(top, on_error, max_workers)
+
+
+def _scan(directory):
+    dirs, files = [], []
+    for child in directory.iterdir():  # types come from the listing
+        (dirs if child.is_dir() else files).append(child)
+    return directory, dirs, files
+
+
+def _top_down(top, on_error, max_workers):
+    frontier, running = [top], set()
+    with ThreadPoolExecutor(max_workers) as executor:
+        while frontier or running:
+            while frontier and len(running) < max_workers:
+                running.add(executor.submit(_scan, frontier.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    directory, dirs, files = future.result()
+                except OSError as err:
+                    if on_error is not None:
+                        on_error(err)
+                    continue
+                dirnames = [child.name for child in dirs]
+                yield directory, dirnames, [child.name for child in files]
+                # only descend into what the caller left in dirnames
+                children = dict(zip(dirnames, dirs))
+                frontier.extend(children.get(name) or directory.joinpath(name)
+                                for name in reversed(dirnames))
+
+
+class _Pending(object):
+    '''Listed directory waiting for its subdirectories to be walked'''
+    __slots__ = ('path', 'dirnames', 'filenames', 'parent', 'remaining')
+
+    def __init__(self, path, dirnames, filenames, parent):
+        self.path = path
+        self.dirnames = dirnames
+        self.filenames = filenames
+        self.parent = parent
+        self.remaining = len(dirnames)
+
+
+def _finished(node):
+    # yields the node and each ancestor which has no subdirectories left
+    while node is not None and node.remaining == 0:
+        yield node.path, node.dirnames, node.filenames
+        node = node.parent
+        if node is not None:
+            node.remaining -= 1
+
+
+def _bottom_up(top, on_error, max_workers):
+    frontier, running = [(top, None)], {}
+    with ThreadPoolExecutor(max_workers) as executor:
+        while frontier or running:
+            while frontier and len(running) < max_workers:
+                directory, parent = frontier.pop()
+                running[executor.submit(_scan, directory)] = parent
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent = running.pop(future)
+                try:
+                    directory, dirs, files = future.result()
+                except OSError as err:
+                    if on_error is not None:
+                        on_error(err)
+                    if parent is not None:
+                        parent.remaining -= 1
+                        for result in _finished(parent):
+                            yield result
+                    continue
+                node = _Pending(directory, [child.name for child in dirs],
+                                [child.name for child in files], parent)
+                frontier.extend((child, node) for child in reversed(dirs))
+                for result in _finished(node):
+                    yield result
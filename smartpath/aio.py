@@ -0,0 +1,252 @@
+'''asyncio interface to remote paths
+
+The blocking client libraries run on a bounded, process-wide thread pool,
+so an event loop can have thousands of remote operations outstanding while
+only ``max_workers`` of them hold a thread (and a pooled connection) at a
+time. Path classes with native coroutines can provide them as
+``<method>_async``, e.g. ``async def read_bytes_async(self)``, which are
+awaited directly instead.
+'''
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .transfer import _path
+
+DEFAULT_MAX_WORKERS = 64  # threads running blocking calls
+ITERDIR_BATCH = 256  # directory entries fetched per thread hop
+
+_DEFAULT_EXECUTOR = None
+_DEFAULT_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor():
+    '''Returns the process-wide executor for blocking calls, creating it if
+    needed'''
+    global _DEFAULT_EXECUTOR
+    if _DEFAULT_EXECUTOR is None:
+        with _DEFAULT_EXECUTOR_LOCK:
+            if _DEFAULT_EXECUTOR is None:
+                _DEFAULT_EXECUTOR = ThreadPoolExecutor(
+                    DEFAULT_MAX_WORKERS, thread_name_prefix='smartpath-aio')
+    return _DEFAULT_EXECUTOR
+
+
+def set_executor(executor):
+    '''Replaces the process-wide executor, shutting down the old one'''
+    global _DEFAULT_EXECUTOR
+    with _DEFAULT_EXECUTOR_LOCK:
+        old, _DEFAULT_EXECUTOR = _DEFAULT_EXECUTOR, executor
+    if old is not None and old is not executor:
+        old.shutdown(wait=False)
+    return executor
+
+
+class AsyncPath(object):
+    '''Awaitable counterpart of a path, e.g.::
+
+        path = AsyncPath('sftp://host/data/file.csv')
+        data = await path.read_bytes()
+        async for child in path.parent.iterdir():
+            print(child, (await child.stat()).st_size)
+
+    Arguments
+    ---------
+    path: path object or URI to wrap
+    executor: executor for blocking calls, defaults to `get_executor()`
+    '''
+    def __init__(self, path, executor=None):
+        self.path = _path(path.path if isinstance(path, AsyncPath) else path)
+        self._executor = executor
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def __eq__(self, other):
+        if isinstance(other, AsyncPath):
+            other = other.path
+        return self.path == other
+
+    def __hash__(self):
+        return hash(str(self.path))
+
+    def __truediv__(self, other):
+        return self.joinpath(other)
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def parent(self):
+        return self._wrap(self.path.parent)
+
+    def joinpath(self, *args):
+        return self._wrap(self.path.joinpath(*args))
+
+    def _wrap(self, path):
+        return self.__class__(path, self._executor)
+
+    async def _run(self, name, *args, **kwargs):
+        native = getattr(self.path, name + '_async', None)
+        if native is not None:
+            return await native(*args, **kwargs)
+        return await _run_blocking(self._executor,
+                                   getattr(self.path, name), *args, **kwargs)
+
+    async def exists(self):
+        return await self._run('exists')
+
+    async def is_dir(self):
+        return await self._run('is_dir')
+
+    async def is_file(self):
+        return await self._run('is_file')
+
+    async def stat(self):
+        return await self._run('stat')
+
+    async def read_bytes(self):
+        return await self._run('read_bytes')
+
+    async def read_text(self):
+        return await self._run('read_text')
+
+    async def write_bytes(self, data):
+        return await self._run('write_bytes', data)
+
+    async def write_text(self, text):
+        return await self._run('write_text', text)
+
+    async def mkdir(self, *args, **kwargs):
+        return await self._run('mkdir', *args, **kwargs)
+
+    async def unlink(self):
+        return await self._run('unlink')
+
+    async def iterdir(self):
+        '''Asynchronously yields the paths in this directory, fetching the
+        listing in batches so that large directories stream'''
+        native = getattr(self.path, 'iterdir_async', None)
+        if native is not None:
+            async for child in native():
+                yield self._wrap(child)
+            return
+        children = iter(self.path.iterdir())
+        try:
+            while True:
+                batch = await _run_blocking(self._executor, _take, children,
+                                            ITERDIR_BATCH)
+                for child in batch:
+                    yield self._wrap(child)
+                if len(batch) < ITERDIR_BATCH:
+                    break
+        finally:
+            close = getattr(children, 'close', None)
+            if close is not None:
+                close()  # returns a pooled connection held by the listing
+
+    def open(self, mode='r', *args, **kwargs):
+        '''Async context manager for an `AsyncFile`::
+
+            async with path.open('rb') as f:
+                header = await f.read(512)
+        '''
+        return _AsyncOpen(self, mode, args, kwargs)
+
+    async def copy(self, target, **kwargs):
+        '''Copy this file to `target` (a path or URI on any backend), see
+        `BasePath.copy_to`. Returns the target as an `AsyncPath`.'''
+        target = AsyncPath(target, self._executor)
+        native = getattr(self.path, 'copy_to_async', None)
+        if native is not None:
+            await native(target.path, **kwargs)
+        else:
+            await _run_blocking(self._executor, self.path.copy_to,
+                                target.path, **kwargs)
+        return target
+
+
+class _AsyncOpen(object):
+    '''Enters and exits the context of ``path.open()`` off the event loop,
+    as some clients return a context manager rather than a file'''
+    def __init__(self, path, mode, args, kwargs):
+        self._executor = path._executor
+        self._open = partial(path.path.open, mode, *args, **kwargs)
+        self._context = None
+
+    async def __aenter__(self):
+        def enter():
+            self._context = self._open()
+            return self._context.__enter__()
+        return AsyncFile(await _run_blocking(self._executor, enter),
+                         self._executor)
+
+    async def __aexit__(self, *exc_info):
+        # with the error, so writers which support it discard the upload
+        return await _run_blocking(self._executor, self._context.__exit__,
+                                   *exc_info)
+
+
+class AsyncFile(object):
+    '''Awaitable wrapper of a file object opened by `AsyncPath.open()`'''
+    def __init__(self, f, executor=None):
+        self._file = f
+        self._executor = executor
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self._file)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
+
+    async def _run(self, name, *args):
+        return await _run_blocking(self._executor, getattr(self._file, name),
+                                   *args)
+
+    async def read(self, size=-1):
+        return await self._run('read', size)
+
+    async def readline(self, size=-1):
+        return await self._run('readline', size)
+
+    async def write(self, data):
+        return await self._run('write', data)
+
+    async def seek(self, offset, whence=0):
+        return await self._run('seek', offset, whence)
+
+    async def tell(self):
+        return await self._run('tell')
+
+    async def flush(self):
+        return await self._run('flush')
+
+    async def close(self):
+        return await self._run('close')
+
+
+def _take(iterator, n):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) == n:
+            break
+    return batch
+
+
+async def _run_blocking(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_executor(),
+                                      partial(func, *args, **kwargs))
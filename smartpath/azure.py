@@ -1,45 +1,109 @@
 '''Module for handling Azure Blob and File Storage'''
+from azure.common import AzureHttpError
 from azure.storage.blob import BlockBlobService
+from azure.storage.blob.models import BlobBlock
 from azure.storage.file import FileService
+from azure.storage.file.models import Directory
+from base64 import b64encode
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from functools import partial
+from itertools import islice
 from urllib.parse import urlencode
 
+import io
 import os
 import datetime
+import time
 
-from .base import (BaseClient, BasePath,
-                   NamedBytesIO, NamedStringIO)
+try:
+    from azure.storage.blob.models import BatchDeleteSubRequest
+except ImportError:  # SDKs before the blob batch API
+    BatchDeleteSubRequest = None
+
+from .base import (BaseClient, BasePath, Capabilities, DirEntry,
+                   NamedBytesIO, NamedStringIO, invalidate_content_cache,
+                   make_stat, use_content_cache)
+from .cache import TTLCache
+from .streams import (DEFAULT_BLOCK_SIZE, DEFAULT_READAHEAD, BlockWriter,
+                      RangedReader, open_reader)
 
 
 class AzureStorageBaseClient(BaseClient):
     '''Connect to Azure storage account'''
     ENV_PREFIX = 'AZURE_'
+    SERVICE_KWARGS = ('account_name', 'account_key', 'sas_token',
+                      'is_emulated', 'protocol', 'custom_domain',
+                      'endpoint_suffix', 'socket_timeout', 'request_session',
+                      'connection_string')
+    CAPABILITIES = Capabilities(rename=True, copy=True)
+    KNOWN_TTL = 300  # seconds before existing containers are checked again
+    COPY_POLL_INTERVAL = 0.5  # seconds between checks of pending copies
     _factory = None
 
-    def __init__(self, host, port=0, auth=None,
+    def __init__(self, host=None, port=0, auth=None,
                  username=None, password=None, use_env=True, **kwargs):
         if use_env:
             username = username or os.environ.get(self.ENV_PREFIX + 'USERNAME')
             password = password or os.environ.get(self.ENV_PREFIX + 'PASSWORD')
             auth = auth or os.environ.get(self.ENV_PREFIX + 'AUTH')
         if self._factory and callable(self._factory):
-            self._service = self._factory(
-                account_name=None, account_key=None, sas_token=None,
-                is_emulated=False, protocol='https', custom_domain=None,
-                endpoint_suffix='core.windows.net', socket_timeout=None,
-                request_session=None, connection_string=None)
+            options = dict(account_name=username, account_key=password)
+            options.update([(k, v) for k, v in kwargs.items()
+                            if k in self.SERVICE_KWARGS and v is not None])
+            self._service = self._factory(**options)
         else:
             self._service = None
+        # (container, directory) pairs known to exist, '' for the container
+        self._known = TTLCache(ttl=self.KNOWN_TTL)
+        self.scheme = kwargs.get('protocol') or 'https'  # metrics labels
+        self.hostname = host
 
     @staticmethod
     def _splitAzurePath(path):
         if not path:
             raise ValueError('Container/Share must be specified in URI - '
                              'so cannot handle empty paths')
-        container = path.split(path[1:] if path.startswith('/') else path, '/')
+        container = (path[1:] if path.startswith('/') else path).split('/')
         return container[0], '/'.join(container[1:])
 
+    @staticmethod
+    def _ranged(get, offset, length):
+        '''Calls `get` for an inclusive byte range, returning no data for
+        ranges starting beyond the end of the blob/file'''
+        if length <= 0:
+            return b''
+        try:
+            return get(start_range=offset,
+                       end_range=offset + length - 1).content
+        except AzureHttpError as err:
+            if getattr(err, 'status_code', None) == 416:  # range not satisfiable
+                return b''
+            raise
+
+    def _wait_for_copy(self, copy, get_properties):
+        '''Waits for a server-side copy, which may complete asynchronously,
+        given its initial copy properties and a callable returning the
+        destination's properties'''
+        while copy.status == 'pending':
+            time.sleep(self.COPY_POLL_INTERVAL)
+            copy = get_properties().properties.copy
+        if copy.status != 'success':
+            raise IOError('Copy {} {}: {}'.format(
+                copy.id, copy.status, copy.status_description))
+        return copy
+
+    def _forget(self, container, subpath=''):
+        '''Drops the cached existence of `container`, or of the `subpath`
+        directory and everything below it, after deleting it'''
+        subpath = subpath.strip('/')
+
+        def below(key):
+            return key[0] == container and (
+                not subpath or key[1] == subpath or
+                key[1].startswith(subpath + '/'))
+        self._known.invalidate(below)
+
     @property
     def containers(self):
         return (c.name for c in
@@ -58,12 +122,33 @@ class AzureFileStorageClient(AzureStorageBaseClient):
                 exists(os.path.dirname(subpath), os.path.basename(subpath)))
 
     def read_bytes(self, path):
-        container, subpath = self._splitAzurePath(path)
-        return self._service.get_blob_to_bytes(container, subpath).content
+        share, subpath = self._splitAzurePath(path)
+        return self._service.get_file_to_bytes(
+            share, os.path.dirname(subpath) or None,
+            os.path.basename(subpath)).content
 
     def read_text(self, path):
-        container, subpath = self._splitAzurePath(path)
-        return self._service.get_blob_to_text(container, subpath).content
+        share, subpath = self._splitAzurePath(path)
+        return self._service.get_file_to_text(
+            share, os.path.dirname(subpath) or None,
+            os.path.basename(subpath)).content
+
+    def read_range(self, path, offset, length):
+        return self._read_range(path, offset, length)
+
+    def _read_range(self, path, offset, length):
+        # unmetered, for the reads of open() which are counted there
+        share, subpath = self._splitAzurePath(path)
+        return self._ranged(partial(self._service.get_file_to_bytes, share,
+                                    os.path.dirname(subpath) or None,
+                                    os.path.basename(subpath)),
+                            offset, length)
+
+    def _size(self, path):
+        share, subpath = self._splitAzurePath(path)
+        return self._service.get_file_properties(
+            share, os.path.dirname(subpath) or None,
+            os.path.basename(subpath)).properties.content_length
 
     def write_bytes(self, path, _bytes):
         container, subpath = self._splitAzurePath(path)
@@ -79,20 +164,19 @@ class AzureFileStorageClient(AzureStorageBaseClient):
                                                    os.path.basename(subpath),
                                                    text)
 
+    def open(self, path, mode='r', readahead=DEFAULT_READAHEAD, **kwargs):
+        if mode in ('r', 'rb'):
+            raw = RangedReader(partial(self._read_range, path),
+                               size=partial(self._size, path),
+                               name=self._splitAzurePath(path)[1],
+                               chunk_size=readahead)
+            return open_reader(raw, mode, buffer_size=readahead, **kwargs)
+        return self._open_write(path, mode)
+
     @contextmanager
-    def open(self, path, mode='r'):
+    def _open_write(self, path, mode):
         container, subpath = self._splitAzurePath(path)
-        if mode == 'r':
-            _file = self._service.get_file_to_text(container,
-                                                   os.dirname(subpath),
-                                                   os.basename(subpath))
-            stream = NamedStringIO(_file.content, name=_file.name)
-        elif mode == 'rb':
-            _file = self._service.get_file_to_bytes(container,
-                                                    os.dirname(subpath),
-                                                    os.basename(subpath))
-            stream = NamedBytesIO(_file.content, name=_file.name)
-        elif mode == 'w':
+        if mode == 'w':
             stream = NamedStringIO(name=subpath)
         elif mode == 'wb':
             stream = NamedBytesIO(name=subpath)
@@ -103,11 +187,9 @@ class AzureFileStorageClient(AzureStorageBaseClient):
         finally:
             if mode == 'w':
                 file_write = self._service.create_file_from_text
-            elif mode == 'wb':
-                file_write = self._service.create_file_from_bytes
             else:
-                return
-            self.makedirs(os.dirname(path))
+                file_write = self._service.create_file_from_bytes
+            self.makedirs(os.path.dirname(path))
             file_write(container, os.path.dirname(subpath),
                        os.path.basename(subpath), stream.getvalue())
 
@@ -119,41 +201,69 @@ class AzureFileStorageClient(AzureStorageBaseClient):
             return False
 
     def listdir(self, path=''):
-        return list(self.scandir(path))
+        return [entry.name for entry in self.scandir(path)]
 
     def scandir(self, *args):
-        container, subpath = self._splitAzurePath('/'.join(args))
-        files = self._service.list_directories_and_files(container, subpath)
-        return (f.name for f in files)
+        '''Yields a `DirEntry` for each file and directory in a directory,
+        with the size given by the listing'''
+        path = '/'.join(args)
+        share, subpath = self._splitAzurePath(path)
+        items = self._service.list_directories_and_files(share,
+                                                         subpath or None)
+        for item in items:
+            is_dir = isinstance(item, Directory)
+            properties = getattr(item, 'properties', None)
+            yield DirEntry(item.name, path.rstrip('/') + '/' + item.name,
+                           is_dir, make_stat(
+                               getattr(properties, 'content_length', 0),
+                               getattr(properties, 'last_modified', None),
+                               is_dir))
+
+    def copy(self, src, dst):
+        '''Server-side copy of a file, which returns once it has completed'''
+        src_share, src_name = self._splitAzurePath(src)
+        src_url = self._service.make_file_url(
+            src_share, os.path.dirname(src_name) or None,
+            os.path.basename(src_name),
+            sas_token=getattr(self._service, 'sas_token', None))
+        share, name = self._splitAzurePath(dst)
+        directory = os.path.dirname(name) or None
+        copy = self._service.copy_file(share, directory,
+                                       os.path.basename(name), src_url)
+        return self._wait_for_copy(copy, partial(
+            self._service.get_file_properties, share, directory,
+            os.path.basename(name)))
 
     def rename(self, src, dst):
-        src_container, src_name = self._splitAzurePath(src)
-        src_file_url = self._service.make_file_url(src_container,
-                                                   os.path.dirname(src_name),
-                                                   os.path.basename(src_name))
-        dst_container, dst = self._splitAzurePath(dst)
-        c = self._service.copy_file(dst_container, os.path.dirname(dst),
-                                    os.path.basename(dst), src_file_url)
-        self._service.delete_file(src_container, os.path.dirname(src_name),
-                                  os.path.basename(src_name))
-        return c
+        copy = self.copy(src, dst)
+        share, name = self._splitAzurePath(src)
+        self._service.delete_file(share, os.path.dirname(name) or None,
+                                  os.path.basename(name))
+        return copy
 
     def replace(self, path, new_path):
         return self.rename(path, new_path)
 
     def rmdir(self, path, **kwargs):
-        return self.delete_directory(*self._splitAzurePath(path))
+        share, subpath = self._splitAzurePath(path)
+        self._forget(share, subpath)
+        return self._service.delete_directory(share, subpath)
 
     def rmtree(self, path, **kwargs):
         return self.rmdir(path)
 
     def mkdir(self, path, **kwargs):
         share, subpath = self._splitAzurePath(path)
-        if share not in self.containers:
-            self._service.create_share(share)
-        dirs = subpath.split('/')
-        for i in range(1, len(dirs)):
-            self._service.create_directory(share, '/'.join(dirs[:i]))
+        if (share, '') not in self._known:
+            self._service.create_share(share, fail_on_exist=False)
+            self._known.add((share, ''))
+        dirs = subpath.strip('/').split('/') if subpath.strip('/') else []
+        for i in range(1, len(dirs) + 1):
+            directory = '/'.join(dirs[:i])
+            if (share, directory) not in self._known:
+                self._service.create_directory(share, directory,
+                                               fail_on_exist=False)
+                self._known.add((share, directory))
 
     def makedirs(self, path, **kwargs):
         return self.mkdir(path, **kwargs)
@@ -161,18 +271,24 @@ class AzureFileStorageClient(AzureStorageBaseClient):
     def unlink(self, path):
         share, subpath = self._splitAzurePath(path)
         if not subpath:
-            if not self.scandir(path):
+            if next(self.scandir(path), None) is None:
                 # only delete when share is empty
+                self._forget(share)
                 return self._service.delete_share(share)
             raise PermissionError('Share not empty & no file or dir to delete')
         if self.is_dir(path):
+            self._forget(share, subpath)
             self._service.delete_directory(share, subpath)
         else:
-            self._service.delete_blob(share, subpath)
+            self._service.delete_file(share, os.path.dirname(subpath) or None,
+                                      os.path.basename(subpath))
 
 
 class AzureBlobStorageClient(AzureStorageBaseClient):
     ENV_PREFIX = 'AZURE_BLOB_'
+    CAPABILITIES = Capabilities(rename=True, copy=True, scantree=True)
+    LIST_PAGE_SIZE = 5000  # service maximum per listing request
+    BATCH_SIZE = 256  # service maximum of sub-requests per batch
     _factory = BlockBlobService
 
     def __enter__(self):
@@ -198,16 +314,16 @@ class AzureBlobStorageClient(AzureStorageBaseClient):
         container = container or self.default_container
 
         blob = AzurePath(dst, service=self.service, container=container)
-        self.service.create_container(container, fail_on_exist=False)
+        self._ensure_container(container)
         if hasattr(src, 'read') and callable(src.read):
             create_blob = self.service.create_blob_from_stream
         elif os.path.exists(src):
             if blob.exists():
                 stat = os.stat(src)
-                last_modified = datetime.datetime.fromtimestamp(stat.mtime)
+                last_modified = datetime.datetime.fromtimestamp(stat.st_mtime)
                 newer = last_modified > blob.last_modified  # pylint: disable=W0612,F841
                 older = last_modified < blob.last_modified  # pylint: disable=W0612,F841
-                larger = blob.size > stat.st_size  # pylint: disable=W0612,F841
+                larger = stat.st_size > blob.size  # pylint: disable=W0612,F841
                 if upload_if is not None and not eval(str(upload_if)):
                     return
             create_blob = self.service.create_blob_from_path
@@ -218,10 +334,24 @@ class AzureBlobStorageClient(AzureStorageBaseClient):
         timeout = kwargs.pop('timeout', 10)
         return create_blob(container, dst, src, timeout=timeout, **kwargs)
 
+    def _ensure_container(self, container):
+        if (container, '') not in self._known:
+            self._service.create_container(container, fail_on_exist=False)
+            self._known.add((container, ''))
+
     def exists(self, path):
         container, subpath = self._splitAzurePath(path)
-        exists = self._service.exists(container, subpath)
-        return exists or bool(self.listdir(path))
+        return self._service.exists(container, subpath) or self.is_dir(path)
+
+    def is_dir(self, path):
+        '''Whether `path` is a container or a virtual directory, i.e. there
+        is at least one blob below it'''
+        container, subpath = self._splitAzurePath(path)
+        if not subpath.strip('/'):
+            return self._service.exists(container)
+        blobs = self._iter_blobs(container, self._dir_prefix(subpath),
+                                 page_size=1)
+        return next(blobs, None) is not None
 
     def read_bytes(self, path):
         container, subpath = self._splitAzurePath(path)
@@ -231,6 +361,20 @@ class AzureBlobStorageClient(AzureStorageBaseClient):
         container, subpath = self._splitAzurePath(path)
         return self._service.get_blob_to_text(container, subpath).content
 
+    def read_range(self, path, offset, length):
+        return self._read_range(path, offset, length)
+
+    def _read_range(self, path, offset, length):
+        # unmetered, for the reads of open() which are counted there
+        container, subpath = self._splitAzurePath(path)
+        return self._ranged(partial(self._service.get_blob_to_bytes,
+                                    container, subpath), offset, length)
+
+    def _size(self, path):
+        container, subpath = self._splitAzurePath(path)
+        return self._service.get_blob_properties(
+            container, subpath).properties.content_length
+
     def write_bytes(self, path, bytes):
         container, blobpath = self._splitAzurePath(path)
         self._service.create_blob_from_bytes(container, blobpath, bytes)
@@ -239,58 +383,185 @@ class AzureBlobStorageClient(AzureStorageBaseClient):
         container, subpath = self._splitAzurePath(path)
         self._service.create_blob_from_text(container, subpath, text)
 
+    def open(self, path, mode='r', readahead=DEFAULT_READAHEAD,
+             block_size=DEFAULT_BLOCK_SIZE, max_workers=4, **kwargs):
+        '''Open a blob for reading or writing
+
+        Reads fetch `readahead` sized ranges on demand. Writes are cut into
+        blocks of `block_size` bytes which are uploaded by up to
+        `max_workers` threads while the caller is still writing, and only
+        committed once the stream is closed without an error.
+        '''
+        if mode in ('r', 'rb'):
+            raw = RangedReader(partial(self._read_range, path),
+                               size=partial(self._size, path),
+                               name=self._splitAzurePath(path)[1],
+                               chunk_size=readahead)
+            return open_reader(raw, mode, buffer_size=readahead, **kwargs)
+        return self._open_write(path, mode, block_size, max_workers, **kwargs)
+
     @contextmanager
-    def open(self, path, mode='r'):
+    def _open_write(self, path, mode, block_size=DEFAULT_BLOCK_SIZE,
+                    max_workers=4, encoding=None, errors=None, newline=None):
         container, subpath = self._splitAzurePath(path)
-        if mode == 'r':
-            blob = self._service.get_blob_to_text(container, subpath)
-            stream = NamedStringIO(blob.content, name=blob.name)
-        elif mode == 'rb':
-            blob = self._service.get_blob_to_bytes(container, subpath)
-            stream = NamedBytesIO(blob.content, name=blob.name)
-        elif mode in ['w', 'wb']:
-            named_io_class = NamedBytesIO if mode is 'wb' else NamedStringIO
-            stream = named_io_class(name=subpath)
-        else:
+        if mode not in ('w', 'wb'):
             raise NotImplementedError(mode + ' is not supported')
+        self._ensure_container(container)
+
+        def put_block(block_id, data):
+            self._service.put_block(container, subpath, data, block_id)
+
+        def commit(block_ids):
+            self._service.put_block_list(container, subpath,
+                                         [BlobBlock(id=i) for i in block_ids])
+
+        writer = BlockWriter(put_block, commit, block_size=block_size,
+                             max_workers=max_workers, block_id=self._block_id,
+                             name=subpath)
+        if mode == 'wb':
+            stream = writer
+        else:
+            stream = io.TextIOWrapper(io.BufferedWriter(writer),
+                                      encoding=encoding or 'utf8',
+                                      errors=errors, newline=newline)
         try:
             yield stream
-        finally:
-            if mode == 'w':
-                blob_write = self._service.create_blob_from_text
-            elif mode == 'wb':
-                blob_write = self._service.create_blob_from_bytes
-            else:
-                return
-            self._service.create_container(container, fail_if_exist=False)
-            blob_write(container, subpath, stream.getvalue())
+        except BaseException:
+            writer.abort()  # uncommitted blocks are discarded by the service
+            raise
+        stream.close()
+
+    @staticmethod
+    def _block_id(index):
+        # block ids must be base64 encoded and of equal length within a blob
+        return b64encode('{:08d}'.format(index).encode()).decode()
 
     def listdir(self, path=''):
-        return list(self.scandir(path))
+        return [entry.name for entry in self.scandir(path)]
 
     def scandir(self, *args):
-        container, subpath = self._splitAzurePath('/'.join(args))
-        blobs = self._service.list_blobs(container)
-        return (blob.name for blob in blobs if blob.name.startswith(subpath))
+        '''Lazily yields a `DirEntry` for each blob and virtual directory
+        immediately below a path, listing only that "directory" and taking
+        the size and times from the blob properties in the listing'''
+        path = '/'.join(args)
+        container, subpath = self._splitAzurePath(path)
+        prefix = self._dir_prefix(subpath)
+        for item in self._iter_blobs(container, prefix, delimiter='/'):
+            name = item.name.rstrip('/').rsplit('/', 1)[-1]
+            yield self._entry(path.rstrip('/') + '/' + name, item)
+
+    def scantree(self, path):
+        '''Lazily yields a `DirEntry` for every blob below a path, at any
+        depth, from a single flat listing by prefix'''
+        container, subpath = self._splitAzurePath(path)
+        prefix = self._dir_prefix(subpath)
+        for item in self._iter_blobs(container, prefix):
+            yield self._entry(path.rstrip('/') + '/' +
+                              item.name[len(prefix or ''):], item)
 
-    def rename(self, src, dst):
-        src_container, src_blob_name = self._splitAzurePath(src)
-        src_blob_url = self._service.make_blob_url(src_container,
-                                                   src_blob_name)
+    @staticmethod
+    def _entry(path, item):
+        is_dir = item.name.endswith('/')  # virtual directories
+        properties = getattr(item, 'properties', None)
+        return DirEntry(path.rstrip('/').rsplit('/', 1)[-1], path.rstrip('/'),
+                        is_dir,
+                        make_stat(getattr(properties, 'content_length', 0),
+                                  getattr(properties, 'last_modified', None),
+                                  is_dir,
+                                  ctime=getattr(properties, 'creation_time',
+                                                None)))
+
+    @staticmethod
+    def _dir_prefix(subpath):
+        # listing prefix of a virtual directory, None for the container
+        subpath = subpath.strip('/')
+        return subpath + '/' if subpath else None
+
+    def _iter_blobs(self, container, prefix=None, delimiter=None,
+                    page_size=None):
+        '''Pages through the listing below `prefix` one request at a time,
+        following continuation markers. With a `delimiter` only immediate
+        children are listed, virtual directories as `BlobPrefix` items.'''
+        marker = None
+        while True:
+            page = self._service.list_blobs(container, prefix=prefix,
+                                            num_results=(page_size or
+                                                         self.LIST_PAGE_SIZE),
+                                            delimiter=delimiter,
+                                            marker=marker)
+            for item in page:
+                yield item
+            marker = page.next_marker
+            if not marker:
+                return
+
+    def copy(self, src, dst):
+        '''Server-side copy of a blob, which returns once it has completed'''
+        src_container, src_blob = self._splitAzurePath(src)
+        src_url = self._service.make_blob_url(
+            src_container, src_blob,
+            sas_token=getattr(self._service, 'sas_token', None))
+        container, blob = self._splitAzurePath(dst)
+        self._ensure_container(container)
+        copy = self._service.copy_blob(container, blob, src_url)
+        return self._wait_for_copy(copy, partial(
+            self._service.get_blob_properties, container, blob))
 
-        dst_container, dst_blob_name = self._splitAzurePath(dst)
-        c = self._service.copy_blob(dst_container, dst_blob_name, src_blob_url)
-        self._service.delete_blob(src_container, src_blob_name)
-        return c
+    def rename(self, src, dst):
+        copy = self.copy(src, dst)
+        self._service.delete_blob(*self._splitAzurePath(src))
+        return copy
 
     def rmdir(self, dirpath):
         pass
 
-    def rmtree(self, dirpath):
-        dirs = self.listdir(dirpath)
-        for d in dirs:
-            self.unlink(d)
-        return dirs
+    def rmtree(self, dirpath, max_workers=8, progress=None):
+        '''Deletes every blob below `dirpath` and returns how many were
+        deleted
+
+        The listing is streamed into batches of up to `BATCH_SIZE` deletes
+        which are sent by up to `max_workers` threads, using a single blob
+        batch request per batch where the service supports it. `progress`
+        is called with the running total after each batch.
+        '''
+        container, subpath = self._splitAzurePath(dirpath)
+        names = (blob.name for blob in
+                 self._iter_blobs(container, self._dir_prefix(subpath)))
+        deleted = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers) as executor:
+            while True:
+                batch = list(islice(names, self.BATCH_SIZE))
+                if batch:
+                    pending.add(executor.submit(self._delete_batch,
+                                                container, batch))
+                # bound the listing to a couple of batches per worker
+                while pending and (not batch or
+                                   len(pending) >= 2 * max_workers):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        deleted += future.result()
+                        if progress is not None:
+                            progress(deleted)
+                if not batch:
+                    return deleted
+
+    def _delete_batch(self, container, names):
+        batch_delete = getattr(self._service, 'batch_delete_blobs', None)
+        if batch_delete is None or BatchDeleteSubRequest is None or \
+                len(names) == 1:
+            for name in names:
+                self._service.delete_blob(container, name)
+            return len(names)
+        responses = batch_delete([BatchDeleteSubRequest(container, name)
+                                  for name in names])
+        failed = [r for r in responses if not r.is_successful and
+                  getattr(r.http_response, 'status', None) != 404]
+        if failed:
+            raise AzureHttpError('Failed to delete {} of {} blobs in {}'
+                                 .format(len(failed), len(names), container),
+                                 failed[0].http_response.status)
+        return len(names)
 
     def replace(self, path, new_path):
         return self.rename(path, new_path)
@@ -305,40 +576,52 @@ class AzureBlobStorageClient(AzureStorageBaseClient):
         container, blobpath = self._splitAzurePath(path)
         if blobpath:
             self._service.delete_blob(container, blobpath)
-        elif len(self.scandir(path)):
+        elif next(self.scandir(path), None) is not None:
             raise PermissionError('Blob container not empty')
 
 
 class AzurePath(BasePath):
     '''An Azure Storage Path'''
-    SESSION_FACTORY = AzureBlobStorageClient  # default client
+    __slots__ = ()
+    CLIENTS = {'blob': AzureBlobStorageClient, 'file': AzureFileStorageClient}
 
     def __init__(self, uri, session=None, **kwargs):
-        if session is 'blob' or isinstance(session, AzureBlobStorageClient):
-            self.SESSION_FACTORY = AzureBlobStorageClient
-        elif session is 'file' or isinstance(session, AzureFileStorageClient):
-            self.SESSION_FACTORY = AzureFileStorageClient
-        super().__init__(self, uri, session, **kwargs)
-        if self.session is None:
-            self.session = self.SESSION_FACTORY(
-                account_name=kwargs.pop('account_name', self.account_name),
-                account_key=kwargs.pop('account_key', self.password),
-                sas_token=kwargs.pop('sas_token',
-                                     self.query.get('sas_token',
-                                                    self.constructSASToken())),
-                is_emulated=kwargs.pop('is_emulated',
-                                       self.query.get('is_emulated', False)),
-                protocol=self.scheme,
-                custom_domain=kwargs.get('custom_domain',
-                                         self.query.get('custom_domain') or
-                                         self.custom_domain),
-                endpoint_suffix=kwargs.get('endpoint_suffix',
-                                           self.query.get('endpoint_suffix',
-                                                          'core.windows.net')),
-                socket_timeout=kwargs.pop('socket_timeout',
-                                          self.query.get('socket_timeout')),
-                request_session=kwargs.pop('request_session'),
-                connection_string=kwargs.pop('connection_string'))
+        if session == 'file' or isinstance(session, AzureFileStorageClient):
+            # a keyword argument, which derived paths share
+            kwargs['client'] = 'file'
+        if session in ('blob', 'file'):
+            session = None  # only selects the client type
+        BasePath.__init__(self, uri, session, **kwargs)
+
+    @property
+    def SESSION_FACTORY(self):
+        '''The client class, for blob storage unless the file share client
+        was selected with ``session='file'`` or ``client='file'``'''
+        return self.CLIENTS[self._kwargs.get('client', 'blob')]
+
+    def _create_session(self):
+        kwargs = self._session_kwargs()
+        kwargs.pop('client', None)
+        query = self._query_value
+        return self.SESSION_FACTORY(
+            host=self.hostname,
+            username=kwargs.pop('account_name', self.account_name),
+            password=kwargs.pop('account_key', self.password),
+            sas_token=kwargs.pop('sas_token',
+                                 query('sas_token', self.constructSASToken())),
+            is_emulated=kwargs.pop('is_emulated',
+                                   query('is_emulated', False)),
+            protocol=self.scheme or 'https',
+            custom_domain=kwargs.pop('custom_domain',
+                                     query('custom_domain', self.custom_domain)),
+            endpoint_suffix=kwargs.pop('endpoint_suffix',
+                                       query('endpoint_suffix',
+                                             'core.windows.net')),
+            socket_timeout=kwargs.pop('socket_timeout',
+                                      query('socket_timeout')),
+            request_session=kwargs.pop('request_session', None),
+            connection_string=kwargs.pop('connection_string', None),
+            **kwargs)
 
     @property
     def custom_domain(self):
@@ -359,50 +642,42 @@ class AzurePath(BasePath):
         return account
 
     def constructSASToken(self):
-        return urlencode([(k, v) for k, v in ('sv', 'ss', 'srt', 'sp',
-                                              'se', 'st', 'spr', 'sig')
-                          if k in self.__dict__])
+        return urlencode([(k, self._query_value(k)) for k in
+                          ('sv', 'ss', 'srt', 'sp', 'se', 'st', 'spr', 'sig')
+                          if self._query_value(k)]) or None
 
     @property
     def anchor(self):
         '''The concatenation of the drive and root, or ''.'''
-        return self.session._splitAzurePath(self.path)[0]
+        return AzureStorageBaseClient._splitAzurePath(self.path)[0]
 
     def cwd(self):
         '''Return a new path pointing to the current working directory
         as given by remote session or None if not supported.'''
         return None
 
+    @use_content_cache
     def open(self, *args, **kwargs):
         '''Open the file pointed by this path and return a file object, as
         the built-in open() function does.'''
         return self.session.open(self.path, *args, **kwargs)
 
+    @use_content_cache
     def read_bytes(self):
         '''Open the file in bytes mode, read it, and close the file.'''
         return self.session.read_bytes(self.path)
 
+    @use_content_cache
     def read_text(self):
         '''Open the file in text mode, read it, and close the file.'''
         return self.session.read_text(self.path)
 
-    def replace(self, target):
-        '''Rename this path to the given path, clobbering the existing
-        destination if it exists.'''
-        new_uri = self.uri.replace(self.path, target)
-        self.__class__(new_uri).write_bytes(self.read_bytes())
-        self.unlink()
-
     def relative_to(self, *other):
         '''Return the relative path to another path identified by the passed
         arguments.  If the operation is not possible (because this is not
         a subpath of the other path), raise ValueError.'''
         raise ValueError('Not Supported')
 
-    def rename(self, target):
-        '''Rename this path to the given path.'''
-        self.replace(target)
-
     def rmdir(self):
         '''Remove this directory.  The directory must be empty.'''
         self.session.rmdir(self.path)
@@ -420,10 +695,12 @@ class AzurePath(BasePath):
         '''A list of the final component's suffixes, if any.'''
         return ['.' + seg for seg in self.name.split('.')[1:]]
 
+    @invalidate_content_cache
     def touch(self, mode=438, exist_ok=True):
         '''Create this file with the given access mode, if it doesn't exist.'''
         return self.session.open(self.path, 'wb')
 
+    @invalidate_content_cache
     def unlink(self):
         '''Remove this file or link.
         If the path is a directory, use rmdir() instead.'''
@@ -431,8 +708,8 @@ class AzurePath(BasePath):
 
     def with_name(self, name):
         '''Return a new path with the file name changed.'''
-        new_path = self.path.replace(self.name, name)
-        return self.__class__(self.uri.replace(self.path, new_path))
+        new_path = os.path.join(os.path.dirname(self.path), name)
+        return self._derive(new_path)
 
     def with_suffix(self, suffix):
         '''Return a new path with the file suffix changed
@@ -440,12 +717,14 @@ class AzurePath(BasePath):
         if not suffix.startswith('.'):
             ValueError('Invalid suffix {}'.format(repr(suffix)))
         new_path = os.path.splitext(self.path)[0] + suffix
-        return self.__class__(self.uri.replace(self.path, new_path))
+        return self._derive(new_path)
 
+    @invalidate_content_cache
     def write_bytes(self, data):
         '''Open the file in bytes mode, write to it, and close the file.'''
         return self.session.write_bytes(self.path, data)
 
+    @invalidate_content_cache
     def write_text(self, text):
         '''Open the file in text mode, write to it, and close the file.'''
         return self.session.write_text(self.path, text)
@@ -1,15 +1,24 @@
+import datetime
+import mmap
 import os
-import re
+import stat as _stat
+import tempfile
 
 from abc import ABCMeta
 from contextlib import contextmanager
-from collections import defaultdict
+from functools import partial, wraps
+from collections import defaultdict, namedtuple
 from io import BytesIO, StringIO
 
 try:
-    from urlparse import urlparse, parse_qs
+    from urlparse import urlparse, urlunparse, parse_qs
 except ImportError:
-    from urllib.parse import urlparse, parse_qs
+    from urllib.parse import urlparse, urlunparse, parse_qs
+
+try:
+    from sys import intern
+except ImportError:
+    pass  # python 2 builtin
 
 try:
     import pathlib
@@ -18,11 +27,25 @@ except ImportError:
     pathlib = None
     _Accessor = object
 
+from . import _glob, _walk
+from .metrics import get_registry, instrument
+from .pool import get_pool
+from .transfer import DEFAULT_BLOCK_SIZE, copy, fetch_ranges
+
 
 class SessionError(object):
     pass
 
 
+Capabilities = namedtuple('Capabilities', ['rename', 'copy', 'scantree'])
+Capabilities.__new__.__defaults__ = (False,)  # scantree
+Capabilities.__doc__ = '''Server-side operations a client supports natively,
+i.e. without sending the file contents through this process, and whether it
+can list a whole subtree at once (`scantree`, e.g. an object store listing
+by prefix)'''
+NO_CAPABILITIES = Capabilities(rename=False, copy=False)
+
+
 class NamedBytesIO(BytesIO):
     '''Allows BytesIO instance to be named'''
     def __init__(self, initial_bytes=b'', name=None):
@@ -43,6 +66,121 @@ class NamedStringIO(StringIO):
         return self.name or super(StringIO, self).__str__()
 
 
+def _timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value or 0)
+
+
+def make_stat(size=0, mtime=None, is_dir=False, mode=None, atime=None,
+              ctime=None, uid=0, gid=0):
+    '''Builds an `os.stat_result` from the metadata returned by a listing.
+    Times may be datetimes or timestamps.'''
+    if mode is None:
+        mode = _stat.S_IFDIR | 0o755 if is_dir else _stat.S_IFREG | 0o644
+    mtime = _timestamp(mtime)
+    return os.stat_result((mode, 0, 0, 1, uid or 0, gid or 0, size or 0,
+                           _timestamp(atime) or mtime, mtime,
+                           _timestamp(ctime) or mtime))
+
+
+class DirEntry(object):
+    '''Directory entry like `os.DirEntry`, yielded by client ``scandir()``
+    methods, carrying the metadata returned by the listing itself
+
+    Arguments
+    ---------
+    name: name of the entry within its directory
+    path: full path of the entry
+    is_dir: whether the entry is a directory, or None to take it from
+        its stat result
+    stat: `os.stat_result` of the entry, or a callable returning it for
+        clients whose listings contain no metadata
+    '''
+    __slots__ = ('name', 'path', '_is_dir', '_stat')
+
+    def __init__(self, name, path, is_dir=False, stat=None):
+        self.name = name
+        self.path = path
+        self._is_dir = is_dir
+        self._stat = stat
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.name)
+
+    def __fspath__(self):
+        return self.path
+
+    def is_dir(self, follow_symlinks=True):
+        if self._is_dir is None:
+            self._is_dir = _stat.S_ISDIR(self.stat().st_mode)
+        return self._is_dir
+
+    def is_file(self, follow_symlinks=True):
+        return not self.is_dir()
+
+    def is_symlink(self):
+        return _stat.S_ISLNK(self.stat().st_mode)
+
+    def stat(self, follow_symlinks=True):
+        if self._stat is None:
+            self._stat = make_stat(is_dir=bool(self._is_dir))
+        elif callable(self._stat):
+            self._stat = self._stat()
+        return self._stat
+
+    def inode(self):
+        return self.stat().st_ino
+
+
+def use_dir_entry(func):
+    '''Answers from the listing which yielded the path, if any, rather than
+    asking the session'''
+    @wraps(func)
+    def wrapper(self):
+        entry = self._dir_entry
+        if entry is not None:
+            return getattr(entry, func.__name__)()
+        return func(self)
+    return wrapper
+
+
+def use_content_cache(func):
+    '''Reads through `self.content_cache`, if one is set, and drops the
+    cached copy when the file is opened for writing'''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        cache = self.content_cache
+        if cache is None:
+            return func(self, *args, **kwargs)
+        if func.__name__ == 'open':
+            mode = args[0] if args else kwargs.get('mode', 'r')
+            if set(mode) & set('wax+'):
+                cache.invalidate(self)
+                return func(self, *args, **kwargs)
+        return getattr(cache, func.__name__)(self, *args, **kwargs)
+    return wrapper
+
+
+def invalidate_content_cache(func):
+    '''Drops the cached copy of the path once `func` has changed or removed
+    it, and that of the target of ``rename()``, ``replace()`` and
+    ``copy_to()``'''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        paths = [self]
+        if func.__name__ in ('rename', 'replace', 'copy_to'):
+            paths.append(self._target(args[0] if args else kwargs['target']))
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            # also after failures, which may have written part of a file
+            for path in paths:
+                if path.content_cache is not None:
+                    path.content_cache.invalidate(path)
+    return wrapper
+
+
 def not_implemented(func):
     '''Wrapper for functions without implementations,
     but unlink `abstractmethod`, are not required for class'''
@@ -53,6 +191,7 @@ def not_implemented(func):
 
 def attempt_path_session_bind(func):
     '''Attempts to determine best way to execute function within current session'''
+    @wraps(func)
     def wrapper(self):
         try:
             return getattr(self.session, func.__name__)(self.path)
@@ -62,6 +201,8 @@ def attempt_path_session_bind(func):
 
 
 class UriProperties(object):
+    __slots__ = ()
+
     @property
     def query(self):
         return defaultdict(lambda: None,
@@ -80,9 +221,119 @@ class UriProperties(object):
     def params(self, params_string):
         self._params = params_string
 
+    def _query_value(self, key, default=None):
+        '''Returns the first value given for `key` in the query string'''
+        values = self.query[key]
+        return values[0] if values else default
+
+
+class QueryDict(dict):
+    '''A parsed query string, mapping names to lists of values; missing
+    names give None. It is shared by all the paths with the same query
+    string, so should not be modified.'''
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return None
+
+
+class _Authority(namedtuple('_Authority', ['scheme', 'netloc', 'hostname',
+                                           'port', 'username',
+                                           'password'])):
+    '''Parsed scheme and netloc of a URI, shared by all paths on a host'''
+    __slots__ = ()
+
+
+_AUTHORITIES = {}  # (scheme, netloc) -> _Authority
+MAX_AUTHORITIES = 4096  # also the number of query strings kept
+
+
+def _authority(uri):
+    '''Returns the shared `_Authority` of the parsed `uri`'''
+    key = (uri.scheme, uri.netloc)
+    authority = _AUTHORITIES.get(key)
+    if authority is None:
+        authority = _Authority(intern(uri.scheme), intern(uri.netloc),
+                               uri.hostname and intern(uri.hostname),
+                               uri.port or None, uri.username or None,
+                               uri.password or None)
+        if len(_AUTHORITIES) >= MAX_AUTHORITIES:
+            _AUTHORITIES.clear()
+        _AUTHORITIES[key] = authority
+    return authority
+
+
+class _UriTail(object):
+    '''Params, query and fragment of a URI, parsed once on first use'''
+    __slots__ = ('params', 'query', 'fragment', '_parsed_params',
+                 '_parsed_query')
+
+    def __init__(self, params=None, query=None, fragment=None):
+        self.params = params or None
+        self.query = query or None
+        self.fragment = fragment or None
+        self._parsed_params = self._parsed_query = None
+
+    def parsed_query(self):
+        if self._parsed_query is None:
+            self._parsed_query = QueryDict(parse_qs(self.query))
+        return self._parsed_query
+
+    def parsed_params(self):
+        if self._parsed_params is None:
+            self._parsed_params = QueryDict(parse_qs(self.params))
+        return self._parsed_params
+
+
+_NO_TAIL = _UriTail()
+_TAILS = {}  # (params, query, fragment) -> _UriTail
+_NO_KWARGS = {}
+
+
+def _kwargs_key(kwargs):
+    '''Hashable form of keyword arguments, taking unhashable values (e.g.
+    pysftp's ``cnopts``) by identity'''
+    key = []
+    for name in sorted(kwargs):
+        value = kwargs[name]
+        try:
+            hash(value)
+        except TypeError:
+            value = ('id', id(value))
+        key.append((name, value))
+    return tuple(key)
+
+
+def _tail(uri):
+    '''Returns the shared `_UriTail` of the parsed `uri`'''
+    if not (uri.params or uri.query or uri.fragment):
+        return _NO_TAIL
+    key = (uri.params, uri.query, uri.fragment)
+    tail = _TAILS.get(key)
+    if tail is None:
+        tail = _UriTail(*key)
+        if len(_TAILS) >= MAX_AUTHORITIES:
+            _TAILS.clear()
+        _TAILS[key] = tail
+    return tail
+
 
 class BasePath(UriProperties):
+    '''A path on a remote file system, addressed by URI
+
+    Paths are compact: the scheme and netloc are parsed into a tuple
+    shared by all the paths on the same host, and the params, query and
+    fragment into an object shared by all the paths with the same ones,
+    which parses the query string once, when first used. Derived paths,
+    e.g. from joinpath() or parent, share these and the session, and only
+    store their own path.
+    '''
+    # '__dict__' is only allocated for paths given instance attributes,
+    # e.g. a per-path content_cache
+    __slots__ = ('_uri', '_authority', 'path', '_tail', '_kwargs',
+                 '_session', '_accessor', '_dir_entry', '__dict__')
     SESSION_FACTORY = pathlib.PosixPath
+    content_cache = None  # e.g. a cache.ContentCache, to reuse downloads
 
     def __init__(self, uri=None, session=None, **kwargs):
         '''
@@ -97,39 +348,146 @@ class BasePath(UriProperties):
             - open(path, *args, **kwargs)
 
         '''
-        self.uri = uri or ''
+        self._uri = uri or ''
         uri = urlparse(uri or 'file://')
 
-        self.scheme = self._drv = uri.scheme  # _drv for compatibility with pathlib
-        self.netloc = self._root = uri.netloc  # _root for compatibility with pathlib
-        self.hostname = uri.hostname or kwargs.get('hostname', kwargs.get('server'))
-        self.port = uri.port or None
+        self._authority = _authority(uri)
+        if not uri.hostname and kwargs.get('hostname', kwargs.get('server')):
+            self._authority = self._authority._replace(
+                hostname=kwargs.get('hostname', kwargs.get('server')))
         self.path = uri.path or None
-        self.query = uri.query or None
-        self.params = uri.params or None
-
-        self.username = uri.username or None
-        self.password = uri.password or None
+        self._tail = _tail(uri)
+        self._kwargs = kwargs or _NO_KWARGS
+        self._session = self._accessor = self._dir_entry = None
 
         self.session = session
+        if self.session is None and callable(self.SESSION_FACTORY):
+            # sessions are shared via the process-wide connection pool
+            self.session = get_pool().session(self._pool_key(),
+                                              self._create_session)
+        elif self.session is None:
+            self.session = self.SESSION_FACTORY
+
+    def _derive(self, path):
+        '''A path of the same class at `path` which shares the parsed URI
+        parts, keyword arguments and session of this path, e.g. for
+        joinpath() or parent; nothing is parsed and no session is made'''
+        derived = object.__new__(self.__class__)
+        derived._uri = None  # built when first needed
+        derived._authority = self._authority
+        derived.path = path
+        derived._tail = self._tail
+        derived._kwargs = self._kwargs
+        derived._session = self._session
+        derived._accessor = self._accessor
+        derived._dir_entry = None
+        return derived
+
+    @property
+    def uri(self):
+        uri = self._uri
+        if uri is None:
+            authority, tail = self._authority, self._tail
+            uri = self._uri = urlunparse((
+                authority.scheme, authority.netloc, self.path or '',
+                tail.params or '', tail.query or '', tail.fragment or ''))
+        return uri
+
+    @property
+    def scheme(self):
+        return self._authority.scheme
+
+    _drv = scheme  # for compatibility with pathlib
+
+    @property
+    def netloc(self):
+        return self._authority.netloc
+
+    _root = netloc  # for compatibility with pathlib
+
+    @property
+    def hostname(self):
+        return self._authority.hostname
+
+    @property
+    def port(self):
+        return self._authority.port
+
+    @property
+    def username(self):
+        return self._authority.username
+
+    @property
+    def password(self):
+        return self._authority.password
+
+    @property
+    def query(self):
+        '''The parsed query string, as a `QueryDict`'''
+        return self._tail.parsed_query()
+
+    @query.setter
+    def query(self, query_string):
+        tail = self._tail
+        self._tail = _UriTail(tail.params, query_string, tail.fragment)
+
+    @property
+    def params(self):
+        '''The parsed params of the last path segment, as a `QueryDict`'''
+        return self._tail.parsed_params()
+
+    @params.setter
+    def params(self, params_string):
+        tail = self._tail
+        self._tail = _UriTail(params_string, tail.query, tail.fragment)
+
+    @property
+    def _query(self):
+        return self._tail.query
 
-        uri_dict = dict([(k, getattr(uri, k, None)) for k in
-                         ('scheme', 'netloc', 'hostname', 'port', 'path', 'query')])
-        kwargs.update(dict([(k, v) for k, v in uri_dict.items() if uri_dict[k]]))
-        self._init_dict_ = kwargs
+    @property
+    def _params(self):
+        return self._tail.params
+
+    @property
+    def _init_dict_(self):
+        '''Keyword arguments given to the constructor, updated with the
+        parts of the URI'''
+        kwargs = dict(self._kwargs)
+        fallback = kwargs.get('hostname', kwargs.get('server'))
+        parts = (('scheme', self.scheme), ('netloc', self.netloc),
+                 ('hostname', self.hostname if self.hostname != fallback
+                  else None),
+                 ('port', self.port), ('path', self.path),
+                 ('query', self._query))
+        kwargs.update((k, v) for k, v in parts if v)
+        return kwargs
+
+    def _pool_key(self):
+        '''Key identifying the connections this path can share, i.e. those
+        of the same server, login and keyword arguments (which may hold
+        credentials, e.g. an ``account_key`` or ``private_key``)'''
+        return (self.SESSION_FACTORY, self.scheme, self.hostname, self.port,
+                self.username, self.password, self._query,
+                _kwargs_key(self._session_kwargs()) if self._kwargs else ())
+
+    def _session_kwargs(self):
+        '''Keyword arguments given to the constructor, excluding those
+        parsed from the URI'''
+        return dict([(k, v) for (k, v) in self._kwargs.items() if k not in
+                     ('scheme', 'netloc', 'hostname', 'port', 'path', 'query')])
+
+    def _create_session(self):
+        '''Create a new session using SESSION_FACTORY. This is only called
+        when the path is first used, never at construction time.'''
+        kwargs = self._init_dict_
         try:
-            if self.session is None and callable(self.SESSION_FACTORY):
-                try:
-                    self.session = self.SESSION_FACTORY(**kwargs)
-                except ValueError:
-                    # remove unwanted entries
-                    kw = dict([(k, v) for (k, v) in kwargs.items() if k not in
-                               ('scheme', 'netloc', 'path', 'query')])
-                    self.session = self.SESSION_FACTORY(**kw)
-            elif self.session is None and not callable(self.SESSION_FACTORY):
-                self.session = self.SESSION_FACTORY
-        except Exception:
-            pass
+            return self.SESSION_FACTORY(**kwargs)
+        except ValueError:
+            # remove unwanted entries
+            kw = dict([(k, v) for (k, v) in kwargs.items() if k not in
+                       ('scheme', 'netloc', 'path', 'query')])
+            return self.SESSION_FACTORY(**kw)
 
     def __str__(self):
         return self.uri
@@ -138,13 +496,11 @@ class BasePath(UriProperties):
         return '{}({})'.format(self.__class__.__name__, repr(self.uri))
 
     def __div__(self, other):
-        return self.__class__(self.uri.replace(self.path,
-                              self.path + '/' + str(other)))
+        return self._derive(self.path + '/' + str(other))
 
     def __add__(self, other):
         new_path = self.path + '/' + str(getattr(other, 'path', other))
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        return self._derive(new_path)
 
     def __eq__(self, other):
         return str(self) == str(other)
@@ -157,12 +513,10 @@ class BasePath(UriProperties):
 
     @property
     def session(self):
-        return getattr(self, '_session', None)
+        return self._session
 
     @session.setter
     def session(self, new_session):
-        if not hasattr(self, '_accessor'):
-            self._accessor = None
         if new_session is not None:
             self._session = self._accessor = new_session
 
@@ -194,8 +548,7 @@ class BasePath(UriProperties):
         as given by remote session or None if not supported.'''
         cwd = self.session.cwd
         cwd = cwd() if callable(cwd) else cwd
-        return self.__class__(self.uri.replace(self.path, cwd),
-                              session=self.session)
+        return self._derive(cwd)
 
     @property
     def drive(self):
@@ -210,15 +563,17 @@ class BasePath(UriProperties):
         '''Return a new path with expanded ~ and ~user constructs
         (as returned by os.path.expanduser)'''
         new_path = os.path.expanduser(self.path)
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        return self._derive(new_path)
 
-    def glob(self, pattern):
+    def glob(self, pattern, max_workers=_glob.DEFAULT_WORKERS):
         '''Iterate over this subtree and yield all existing files (of any
-        kind, including directories) matching the given pattern.'''
-        return (self.__class__(self.uri.replace(self.path, p), self.session)
-                for p in self.session.listdir(self.path)
-                if re.match(pattern.replace('*', '.*'), self.path))
+        kind, including directories) matching the given pattern.
+
+        Like pathlib, ``*`` and ``?`` match within a path segment and ``**``
+        matches this directory and all subdirectories, recursively. Only the
+        subtrees which can match are listed, up to `max_workers` directories
+        at a time, and results are yielded in no particular order.'''
+        return _glob.glob(self, pattern, max_workers)
 
     def group(self):
         '''Return the group name of the file gid or `None`.'''
@@ -249,10 +604,20 @@ class BasePath(UriProperties):
         '''Whether this path is a character device.'''
         return self.session.is_char_device(self.path)
 
+    @use_dir_entry
     @attempt_path_session_bind
     def is_dir(self):
+        '''Whether this path is a directory.'''
         return self.session.is_dir(self.path)
 
+    @use_dir_entry
+    def is_file(self):
+        '''Whether this path is a regular file.'''
+        is_file = getattr(self.session, 'is_file', None)
+        if callable(is_file):
+            return is_file(self.path)
+        return self.exists() and not self.is_dir()
+
     @attempt_path_session_bind
     def is_fifo(self):
         '''Whether this path is a FIFO.'''
@@ -274,11 +639,26 @@ class BasePath(UriProperties):
 
     def iterdir(self):
         '''Iterate over the files in this directory.  Does not yield any
-        result for the special paths '.' and '..'.'''
-        if self.session.is_dir(self.path):
-            return (p for p in self.session.listdir(self.path)
-                    if p not in ['.', '..'])
-        raise SessionError('{} is not a directory'.format(repr(self.path)))
+        result for the special paths '.' and '..'.
+
+        Where the client's ``scandir()`` yields entries with metadata, the
+        child paths keep their entry, so calling ``stat()``, ``is_dir()``
+        or ``is_file()`` on them needs no further requests.'''
+        try:
+            entries = self.session.scandir(self.path)
+        except NotImplementedError:
+            if not self.session.is_dir(self.path):
+                raise NotADirectoryError(
+                    '{} is not a directory'.format(repr(self.path)))
+            entries = self.session.listdir(self.path)
+        for entry in entries:
+            name = getattr(entry, 'name', entry)
+            if name in ('.', '..'):
+                continue
+            child = self.joinpath(name)
+            if isinstance(entry, (DirEntry, os.DirEntry)):
+                child._dir_entry = entry
+            yield child
 
     def joinpath(self, *args):
         '''Combine this path with one or several arguments, and return a
@@ -286,8 +666,7 @@ class BasePath(UriProperties):
         paths) or a totally different path (if one of the arguments is
         anchored).'''
         new_path = self.path + '/' + '/'.join(args)
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        return self._derive(new_path)
 
     @not_implemented
     def lchmod(self, mode):
@@ -301,22 +680,56 @@ class BasePath(UriProperties):
         status information is returned, rather than its target's.'''
         pass
 
+    def metrics(self):
+        '''Metrics of the client operations on this path's host, as a
+        dictionary by operation (see `smartpath.metrics`)'''
+        snapshot = get_registry().snapshot(self.scheme, self.hostname or '')
+        return dict((key[2], value) for key, value in snapshot.items())
+
     def match(self, pattern):
         '''Return True if this path matches the given pattern.'''
-        return bool(re.match(pattern.replace('*', '.*'), self.path))
+        return _glob.match(self.path, pattern)
 
     def mkdir(self, mode=511, parents=False, exist_ok=False):
         '''Create a new directory at this given path.'''
         return self.session.mkdir(self.path, mode, parents, exist_ok)
 
+    def mmap(self, block_size=DEFAULT_BLOCK_SIZE, max_workers=None):
+        '''Map the file read-only into memory and return the `mmap.mmap`,
+        e.g. for ``numpy.frombuffer()`` without copying the contents.
+
+        The file is downloaded with up to `max_workers` (by default the
+        connection pool's ``max_size``) concurrent ranged reads of
+        `block_size` bytes into a local file: the cached copy if a
+        `content_cache` is set, otherwise a sparse temporary file which is
+        removed once it is unmapped. Empty files, which cannot be mapped,
+        give an empty bytes object.'''
+        cache = self.content_cache
+        filename = cache.filename(self) if cache is not None else None
+        if filename is not None:
+            with open(filename, 'rb') as f:
+                if not os.fstat(f.fileno()).st_size:
+                    return b''
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = self.stat().st_size
+        if not size:
+            return b''
+        with tempfile.TemporaryFile() as f:
+            fetch_ranges(partial(self.session.read_range, self.path), f,
+                         size, block_size, max_workers)
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     @property
     def name(self):
         '''Returns the basename of path'''
         return os.path.basename(self.path)
 
+    @use_content_cache
     def open(self, *args, **kwargs):
         '''Open the file pointed by this path and return a file object, as
-        the built-in open() function does.'''
+        the built-in open() function does. Where supported, files opened for
+        reading are seekable and fetch byte ranges on demand, with the
+        `readahead` keyword setting the bytes fetched per request.'''
         return self.session.open(self.path, *args, **kwargs)
 
     def owner(self):
@@ -327,16 +740,14 @@ class BasePath(UriProperties):
     def parent(self):
         '''The logical parent of the path.'''
         new_path = os.path.dirname(self.path)
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        return self._derive(new_path)
 
     @property
     def parents(self):
         path = self.path
         while path != '/':
             path = os.path.dirname(path)
-            yield self.__class__(self.uri.replace(self.path, path),
-                                 session=self.session)
+            yield self._derive(path)
 
     @property
     def parts(self):
@@ -344,24 +755,32 @@ class BasePath(UriProperties):
         components in the filesystem path.'''
         return [p or '/' for p in self.path.split('/')]
 
+    @use_content_cache
     def read_bytes(self):
         '''Open the file in bytes mode, read it, and close the file.'''
         with self.session.open(self.path, 'rb') as f:
             _bytes = f.read()
         return _bytes
 
+    @use_content_cache
+    def read_range(self, offset, length):
+        '''Read up to `length` bytes starting at `offset` without fetching
+        the rest of the file.'''
+        return self.session.read_range(self.path, offset, length)
+
+    @use_content_cache
     def read_text(self):
         '''Open the file in text mode, read it, and close the file.'''
         with self.session.open(self.path, 'r') as f:
             text = f.read()
         return text
 
+    @invalidate_content_cache
     def replace(self, target):
         '''Rename this path to the given path, clobbering the existing
-        destination if it exists.'''
-        new_uri = self.uri.replace(self.path, target)
-        self.__class__(new_uri).write_bytes(self.read_bytes())
-        self.unlink()
+        destination if it exists. A server-side move is used where the
+        client supports one, otherwise the file is copied and deleted.'''
+        return self._move(target, 'replace')
 
     @not_implemented
     def relative_to(self, *other):
@@ -370,9 +789,50 @@ class BasePath(UriProperties):
         a subpath of the other path), raise ValueError.'''
         pass
 
+    @invalidate_content_cache
     def rename(self, target):
         '''Rename this path to the given path.'''
-        self.replace(target)
+        return self._move(target, 'rename')
+
+    @invalidate_content_cache
+    def copy_to(self, target, **kwargs):
+        '''Copy this file to the given path or path object, using a
+        server-side copy where the client supports one and only streaming
+        the contents through this process otherwise. Keyword arguments
+        are passed to `smartpath.transfer.copy()` when streaming.'''
+        target = self._target(target)
+        if self._is_native(target, 'copy'):
+            self.session.copy(self.path, target.path)
+        else:
+            copy(self, target, **kwargs)
+        return target
+
+    def _move(self, target, operation):
+        target = self._target(target)
+        if self._is_native(target, 'rename'):
+            getattr(self.session, operation)(self.path, target.path)
+        else:
+            self.copy_to(target)
+            self.unlink()
+        return target
+
+    def _target(self, target):
+        '''Path object for `target`, which may be a path on this server'''
+        if isinstance(target, BasePath):
+            return target
+        return self._derive(str(target))
+
+    def _is_native(self, target, capability):
+        '''Whether `target` can be reached by the server-side `capability`
+        of this path's session, i.e. both are on the same server'''
+        if type(target) is not type(self):
+            return False
+        if target.session is not self.session:
+            key = getattr(self.session, 'pool_key', None)
+            if key is None or key != getattr(target.session, 'pool_key', None):
+                return False
+        capabilities = getattr(self.session, 'CAPABILITIES', NO_CAPABILITIES)
+        return getattr(capabilities, capability, False)
 
     def resolve(self):
         '''Make the path absolute, resolving all symlinks on the way and also
@@ -387,16 +847,26 @@ class BasePath(UriProperties):
                 parts.pop(index - 1)
             except ValueError:
                 break
-        return self.__class__(self.uri.replace(self.path, '/'.join(parts)),
-                              session=self.session)
+        return self._derive('/'.join(parts))
+
+    def rglob(self, pattern, max_workers=_glob.DEFAULT_WORKERS):
+        '''Like glob(), with "**/" added in front of the given relative
+        pattern. To only search below a known directory, e.g. ``2026/10``,
+        use ``glob('2026/10/**/*.parquet')``.'''
+        return self.glob('**/' + pattern, max_workers)
+
+    def rwalk(self, on_error=None, max_workers=_glob.DEFAULT_WORKERS):
+        '''Like walk(top_down=False): each directory is yielded after all
+        of its subdirectories, e.g. to remove a tree.'''
+        return self.walk(False, on_error, max_workers)
 
     def rmdir(self):
         '''Remove this directory.  The directory must be empty.'''
         self.session.rmdir(self.path)
 
-    def rmtree(self):
+    def rmtree(self, **kwargs):
         '''Remove entire directory tree.'''
-        return self.session.rmtree(self.path)
+        return self.session.rmtree(self.path, **kwargs)
 
     @property
     def root(self):
@@ -408,6 +878,7 @@ class BasePath(UriProperties):
         '''Return whether other_path is the same or not as this file'''
         pass
 
+    @use_dir_entry
     def stat(self):
         '''Return the result of the stat() system call on this path, like
         os.stat() does.'''
@@ -424,20 +895,34 @@ class BasePath(UriProperties):
         of os.symlink's.'''
         pass
 
+    @invalidate_content_cache
     def touch(self, mode=438, exist_ok=True):
         '''Create this file with the given access mode, if it doesn't exist.'''
         return self.session.open(self.path, 'wb')
 
+    @invalidate_content_cache
     def unlink(self):
         '''Remove this file or link.
         If the path is a directory, use rmdir() instead.'''
         return self.session.unlink(self.path)
 
+    def walk(self, top_down=True, on_error=None,
+             max_workers=_glob.DEFAULT_WORKERS):
+        '''Walk the directory tree from this directory, yielding a
+        (dirpath, dirnames, filenames) tuple for each directory, like
+        os.walk() but with dirpath a path object.
+
+        Up to `max_workers` directories are listed concurrently over pooled
+        connections and results are yielded as they arrive, so siblings may
+        come in any order. When walking top down, subdirectories removed
+        from dirnames by the caller are not walked. Errors listing a
+        directory are passed to `on_error`, or ignored.'''
+        return _walk.walk(self, top_down, on_error, max_workers)
+
     def with_name(self, name):
         '''Return a new path with the file name changed.'''
-        new_path = self.path.replace(self.name, name)
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        new_path = os.path.join(os.path.dirname(self.path), name)
+        return self._derive(new_path)
 
     def with_suffix(self, suffix):
         '''Return a new path with the file suffix changed
@@ -445,14 +930,15 @@ class BasePath(UriProperties):
         if not suffix.startswith('.'):
             ValueError('Invalid suffix {}'.format(repr(suffix)))
         new_path = os.path.splitext(self.path)[0] + suffix
-        return self.__class__(self.uri.replace(self.path, new_path),
-                              session=self.session)
+        return self._derive(new_path)
 
+    @invalidate_content_cache
     def write_bytes(self, data):
         '''Open the file in bytes mode, write to it, and close the file.'''
         with self.session.open(self.path, 'wb') as f:
             f.write(data)
 
+    @invalidate_content_cache
     def write_text(self, text):
         '''Open the file in text mode, write to it, and close the file.'''
         with self.session.open(self.path, 'w') as f:
@@ -463,6 +949,12 @@ class BaseClient(_Accessor, UriProperties):
     '''A base client to act as a mixin'''
     __metaclass__ = ABCMeta
     __pathclass__ = BasePath
+    CAPABILITIES = NO_CAPABILITIES
+
+    def __init_subclass__(cls, **kwargs):
+        # record the calls of every client (see smartpath.metrics)
+        super().__init_subclass__(**kwargs)
+        instrument(cls)
 
     def __init__(self, uri, **kwargs):
         # initialise object dictionary with kwargs
@@ -520,6 +1012,13 @@ class BaseClient(_Accessor, UriProperties):
     def open(self, path, mode='r'):
         yield open(path, mode)
 
+    def read_range(self, path, offset, length):
+        '''Returns up to `length` bytes of `path` from `offset`. Clients
+        should override this with a native ranged request.'''
+        with self.open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
     @not_implemented
     def listdir(self, path=''):
         pass
@@ -540,6 +1039,10 @@ class BaseClient(_Accessor, UriProperties):
     def rename(self, src, dst):
         pass
 
+    @not_implemented
+    def copy(self, src, dst):
+        pass
+
     @not_implemented
     def symlink(a, b, target_is_directory):
         pass
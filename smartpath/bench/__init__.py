@@ -0,0 +1,10 @@
+'''Benchmarks of each backend against local stand-in servers
+
+Run ``python -m smartpath.bench --help`` for the options. The stand-ins
+need the ``bench`` extra (pyftpdlib, wsgidav, cheroot and paramiko) as well
+as the client libraries of the backends being measured; backends whose
+libraries are missing are reported as skipped.
+
+The pure path operations, which need no server, are timed by
+``python -m smartpath.bench.micro`` (see `smartpath.bench.micro`).
+'''
@@ -0,0 +1,147 @@
+'''In-memory stand-in for the Azure blob storage SDK'''
+import datetime
+import threading
+import time
+
+from azure.common import AzureHttpError
+
+from ..azure import AzureBlobStorageClient
+
+
+class _Item(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Page(list):
+    next_marker = None
+
+
+class MemoryBlobService(object):
+    '''Implements the parts of ``BlockBlobService`` used by
+    `AzureBlobStorageClient`, keeping blobs in memory
+
+    Arguments
+    ---------
+    latency: seconds added to every request, to emulate a round trip
+    '''
+    def __init__(self, latency=0, **kwargs):
+        self.latency = latency
+        self.containers = {}  # container -> {name: (data, last_modified)}
+        self.requests = 0
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _blobs(self, container):
+        return self.containers.setdefault(container, {})
+
+    def _store(self, container, name, data):
+        with self._lock:
+            self._blobs(container)[name] = (data, datetime.datetime.now())
+
+    def create_container(self, container, fail_on_exist=False):
+        self._request()
+        with self._lock:
+            self._blobs(container)
+        return True
+
+    def exists(self, container, blob_name=None):
+        self._request()
+        if blob_name is None:
+            return container in self.containers
+        return blob_name in self.containers.get(container, {})
+
+    def list_blobs(self, container, prefix=None, num_results=None,
+                   delimiter=None, marker=None):
+        self._request()
+        with self._lock:
+            blobs = sorted(self._blobs(container).items())
+        items, prefixes = [], set()
+        for name, (data, modified) in blobs:
+            if prefix and not name.startswith(prefix):
+                continue
+            rest = name[len(prefix or ''):]
+            if delimiter and delimiter in rest:
+                name = name[:len(name) - len(rest)] + \
+                    rest.split(delimiter)[0] + delimiter
+                if name in prefixes:
+                    continue
+                prefixes.add(name)
+                items.append(_Item(name=name))
+                continue
+            items.append(_Item(name=name, properties=_Item(
+                content_length=len(data), last_modified=modified,
+                creation_time=modified)))
+        items = [i for i in items if marker is None or i.name >= marker]
+        page = _Page(items[:num_results])
+        if num_results and len(items) > num_results:
+            page.next_marker = items[num_results].name
+        return page
+
+    def _get(self, container, blob_name):
+        try:
+            return self.containers[container][blob_name]
+        except KeyError:
+            raise AzureHttpError('The specified blob does not exist.', 404)
+
+    def get_blob_to_bytes(self, container, blob_name, start_range=None,
+                          end_range=None):
+        self._request()
+        data = self._get(container, blob_name)[0]
+        if start_range is not None:
+            if start_range >= len(data):
+                raise AzureHttpError('Range not satisfiable', 416)
+            data = data[start_range:end_range + 1]
+        return _Item(content=data)
+
+    def get_blob_to_text(self, container, blob_name, encoding='utf-8'):
+        content = self.get_blob_to_bytes(container, blob_name).content
+        return _Item(content=content.decode(encoding))
+
+    def get_blob_properties(self, container, blob_name):
+        self._request()
+        data, modified = self._get(container, blob_name)
+        return _Item(properties=_Item(content_length=len(data),
+                                      last_modified=modified))
+
+    def create_blob_from_bytes(self, container, blob_name, blob, **kwargs):
+        self._request()
+        self._store(container, blob_name, bytes(blob))
+
+    def create_blob_from_text(self, container, blob_name, text,
+                              encoding='utf-8', **kwargs):
+        self.create_blob_from_bytes(container, blob_name,
+                                    text.encode(encoding))
+
+    def put_block(self, container, blob_name, block, block_id, **kwargs):
+        self._request()
+        with self._lock:
+            self._blocks[(container, blob_name, block_id)] = bytes(block)
+
+    def put_block_list(self, container, blob_name, block_list, **kwargs):
+        self._request()
+        with self._lock:
+            data = b''.join(self._blocks.pop((container, blob_name, b.id))
+                            for b in block_list)
+        self._store(container, blob_name, data)
+
+    def delete_blob(self, container, blob_name, **kwargs):
+        self._request()
+        with self._lock:
+            self._get(container, blob_name)
+            del self.containers[container][blob_name]
+
+
+class MemoryBlobClient(AzureBlobStorageClient):
+    '''Azure blob client on a `MemoryBlobService`'''
+    _factory = MemoryBlobService
+
+    def __init__(self, latency=0):
+        super(MemoryBlobClient, self).__init__(use_env=False)
+        self._service.latency = latency
@@ -0,0 +1,170 @@
+'''Microbenchmarks of the pure (non-I/O) path operations
+
+Each operation is timed over many calls (10**3 to 10**7, chosen so that a
+run takes at least `MIN_SECONDS`, or fixed with ``--number``) and reported
+in nanoseconds per call, the best of ``--repeat`` runs, together with the
+peak memory traced by `tracemalloc` during a single call.
+
+Results can be saved as a baseline and later runs compared against it::
+
+    python -m smartpath.bench.micro --save baseline.json
+    python -m smartpath.bench.micro --baseline baseline.json
+
+The comparison exits with status 1 when an operation is slower or
+allocates more than the baseline by more than ``--threshold``. Baselines
+are only comparable on the same machine and Python version.
+'''
+import argparse
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+
+from ..base import BasePath
+
+URI = 'sftp://user@example.com:2222/data/run/2019/file.tar.gz;type=i?mode=fast'
+DISPATCH_URI = 'https://account.blob.core.windows.net/container/run/file.txt'
+MIN_SCALE = 10 ** 3
+MAX_SCALE = 10 ** 7
+MIN_SECONDS = 0.2
+THRESHOLD = 0.25
+SLACK_BYTES = 64  # noise in the memory traced, e.g. from free lists
+
+
+def operations():
+    '''Returns a list of ``(name, callable)`` for the operations timed'''
+    from ..uripath import UriPath
+
+    path = BasePath(URI)
+    session = path.session
+    return [
+        ('construct', lambda: BasePath(URI, session=session)),
+        ('construct_pooled', lambda: BasePath(URI)),
+        ('uripath_dispatch', lambda: UriPath(DISPATCH_URI)),
+        ('joinpath', lambda: path.joinpath('child')),
+        ('parent', lambda: path.parent),
+        ('parents', lambda: list(path.parents)),
+        ('with_name', lambda: path.with_name('other.txt')),
+        ('with_suffix', lambda: path.with_suffix('.bz2')),
+        ('match', lambda: path.match('run/*/*.gz')),
+        ('parts', lambda: path.parts),
+        ('name', lambda: path.name),
+        ('query', lambda: path.query['mode']),
+        ('params', lambda: path.params['type']),
+    ]
+
+
+def measure(func, number=None, repeat=5):
+    '''Returns ``{'ns': best time per call, 'number': calls per run,
+    'peak_bytes': peak memory traced during one call}``'''
+    timer = timeit.Timer(func)
+    if number is None:
+        number = MIN_SCALE
+        while number < MAX_SCALE and \
+                timer.timeit(number) < MIN_SECONDS / 10:
+            number *= 10
+    best = min(timer.repeat(repeat, number)) / number
+    return {'ns': best * 1e9, 'number': number,
+            'peak_bytes': _peak_bytes(func)}
+
+
+def run(names=None, number=None, repeat=5):
+    '''Measures the operations (all, or those in `names`), returning a
+    dictionary of results by name; operations which cannot run in this
+    environment, e.g. for lack of a backend's library, are reported as
+    ``{'skipped': reason}``'''
+    try:
+        ops = operations()
+    except ImportError as err:
+        raise SystemExit('Cannot run the microbenchmarks: {}'.format(err))
+    results = {}
+    for name, func in ops:
+        if names and name not in names:
+            continue
+        try:
+            func()
+        except ImportError as err:
+            results[name] = {'skipped': str(err)}
+            continue
+        results[name] = measure(func, number, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    '''Returns a list of ``(name, metric, baseline, value)`` for each
+    result worse than its baseline by more than `threshold` (a fraction)'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base or 'skipped' in result or 'skipped' in base:
+            continue
+        for metric in ('ns', 'peak_bytes'):
+            slack = SLACK_BYTES if metric == 'peak_bytes' else 0
+            if result[metric] > base[metric] * (1 + threshold) + slack:
+                regressions.append((name, metric, base[metric],
+                                    result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m smartpath.bench.micro',
+        description='Time the pure path operations and compare them with '
+                    'a baseline.')
+    parser.add_argument('operations', nargs='*',
+                        help='operations to run (default: all)')
+    parser.add_argument('-n', '--number', type=int,
+                        help='calls per run (default: chosen per operation '
+                             'between {} and {})'.format(MIN_SCALE, MAX_SCALE))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs, of which the fastest is reported '
+                             '(default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='fail on regressions against this baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fraction by which an operation may be slower '
+                             'or allocate more than the baseline '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    results = run(args.operations, args.number, args.repeat)
+    for name, result in sorted(results.items()):
+        if 'skipped' in result:
+            print('{:18} skipped: {}'.format(name, result['skipped']))
+        else:
+            print('{:18} {:12.1f} ns {:8} B  (x{})'.format(
+                name, result['ns'], result['peak_bytes'], result['number']))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, base, value in regressions:
+            print('REGRESSION {} {}: {:.1f} -> {:.1f} ({:+.0%})'.format(
+                name, metric, base, value, value / base - 1 if base else 1))
+        return 1 if regressions else 0
+    return 0
+
+
+def _peak_bytes(func):
+    func()  # warm up caches, e.g. imports and interned strings
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()  # also resets the peak
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
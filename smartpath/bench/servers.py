@@ -0,0 +1,211 @@
+'''Local stand-in servers for the benchmarks
+
+Each server is a context manager serving the local directory `root` in a
+background thread and yielding the URI of its `BENCH_DIR` subdirectory (the
+paths do not support the server root itself).
+'''
+import os
+import socket
+import threading
+
+from contextlib import contextmanager
+
+BENCH_DIR = 'smartpath-bench'
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+@contextmanager
+def ftp_server(root):
+    '''pyftpdlib FTP server'''
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    _bench_dir(root)
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USERNAME, PASSWORD, root, perm='elradfmwMT')
+    handler = type('BenchFTPHandler', (FTPHandler,),
+                   {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            server.serve_forever(timeout=0.1, blocking=False)
+
+    with _running(serve, stop):
+        try:
+            yield 'ftp://{}:{}@127.0.0.1:{}/{}'.format(
+                USERNAME, PASSWORD, server.address[1], BENCH_DIR)
+        finally:
+            stop.set()
+    server.close_all()
+
+
+@contextmanager
+def webdav_server(root):
+    '''WsgiDAV server on cheroot, without authentication'''
+    from cheroot import wsgi
+    from wsgidav.wsgidav_app import WsgiDAVApp
+
+    _bench_dir(root)
+    app = WsgiDAVApp({
+        'provider_mapping': {'/': root},
+        'simple_dc': {'user_mapping': {'*': True}},  # anonymous access
+        'verbose': 0,
+        'logging': {'enable_loggers': []},
+    })
+    server = wsgi.Server(('127.0.0.1', 0), app)
+    server.prepare()
+    with _running(server.serve, stop=None, on_exit=server.stop):
+        yield 'dav://127.0.0.1:{}/{}?protocol=http'.format(
+            server.bind_addr[1], BENCH_DIR)
+
+
+@contextmanager
+def sftp_server(root):
+    '''paramiko SFTP server accepting any password'''
+    import paramiko
+
+    _bench_dir(root)
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    listener.settimeout(0.1)
+    stop = threading.Event()
+    transports = []
+
+    class Server(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    def serve():
+        while not stop.is_set():
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            _local_sftp(paramiko), root=root)
+            transport.start_server(server=Server())
+            transports.append(transport)
+
+    with _running(serve, stop):
+        try:
+            yield 'sftp://{}:{}@127.0.0.1:{}/{}'.format(
+                USERNAME, PASSWORD, listener.getsockname()[1], BENCH_DIR)
+        finally:
+            stop.set()
+    for transport in transports:
+        transport.close()
+    listener.close()
+
+
+def _bench_dir(root):
+    path = os.path.join(root, BENCH_DIR)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+@contextmanager
+def _running(target, stop, on_exit=None):
+    thread = threading.Thread(target=target, name='smartpath-bench-server')
+    thread.daemon = True
+    thread.start()
+    try:
+        yield thread
+    finally:
+        if stop is not None:
+            stop.set()
+        if on_exit is not None:
+            on_exit()
+        thread.join(5)
+
+
+def _local_sftp(paramiko):
+    '''SFTP server interface serving a local directory'''
+    class LocalSFTP(paramiko.SFTPServerInterface):
+        def __init__(self, server, root, *args, **kwargs):
+            super(LocalSFTP, self).__init__(server, *args, **kwargs)
+            self.root = root
+
+        def _local(self, path):
+            path = os.path.normpath('/' + path).lstrip('/')
+            return os.path.join(self.root, path)
+
+        def _call(self, func, *args):
+            try:
+                func(*args)
+            except OSError as err:
+                return paramiko.SFTPServer.convert_errno(err.errno)
+            return paramiko.SFTP_OK
+
+        def _attributes(self, stat, path, name=None):
+            try:
+                attr = paramiko.SFTPAttributes.from_stat(stat(path))
+            except OSError as err:
+                return paramiko.SFTPServer.convert_errno(err.errno)
+            if name is not None:
+                attr.filename = name
+            return attr
+
+        def list_folder(self, path):
+            local = self._local(path)
+            try:
+                names = os.listdir(local)
+            except OSError as err:
+                return paramiko.SFTPServer.convert_errno(err.errno)
+            return [self._attributes(os.stat, os.path.join(local, name), name)
+                    for name in names]
+
+        def stat(self, path):
+            return self._attributes(os.stat, self._local(path))
+
+        def lstat(self, path):
+            return self._attributes(os.lstat, self._local(path))
+
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(self._local(path), flags, 0o666)
+            except OSError as err:
+                return paramiko.SFTPServer.convert_errno(err.errno)
+            append = flags & os.O_APPEND
+            if flags & os.O_WRONLY:
+                mode = 'ab' if append else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if append else 'r+b'
+            else:
+                mode = 'rb'
+            handle = paramiko.SFTPHandle(flags)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            return self._call(os.remove, self._local(path))
+
+        def rename(self, oldpath, newpath):
+            return self._call(os.rename, self._local(oldpath),
+                              self._local(newpath))
+
+        def posix_rename(self, oldpath, newpath):
+            return self._call(os.replace, self._local(oldpath),
+                              self._local(newpath))
+
+        def mkdir(self, path, attr):
+            return self._call(os.mkdir, self._local(path))
+
+        def rmdir(self, path):
+            return self._call(os.rmdir, self._local(path))
+
+    return LocalSFTP
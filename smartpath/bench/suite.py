@@ -0,0 +1,270 @@
+'''Throughput and latency of each backend against local stand-ins
+
+Every backend runs the same workloads:
+
+- small files: ``write_bytes`` then ``read_bytes`` of many small files, in
+  operations per second
+- large file: a streamed write then read through ``open()``, in MB/s
+- listing: ``iterdir()`` of the small files' directory, in entries per second
+- metadata: ``stat()`` (``exists()`` where the client has no ``stat``)
+  latency in milliseconds
+
+Each measurement is repeated and the median is reported. The results are
+written as JSON so that runs can be compared for regressions.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from . import servers
+from ..pool import get_pool
+from ..transfer import _makedirs
+
+BACKENDS = ('ftp', 'sftp', 'webdav', 'azure')
+CHUNK_SIZE = 1 << 20
+MAX_METADATA_CALLS = 100
+DEFAULTS = {
+    'small_files': 200,
+    'small_size': 4096,
+    'large_size': 32 << 20,
+    'repeat': 3,
+    'latency': 0,
+}
+
+
+@contextmanager
+def backend(name, root, latency=0):
+    '''Yields the benchmark directory of backend `name`, served from the
+    local directory `root`; `latency` (seconds) only applies to Azure,
+    whose stand-in is in memory'''
+    if name == 'azure':
+        from ..azure import AzurePath
+        from .fakes import MemoryBlobClient
+        yield AzurePath('https://bench.blob.core.windows.net/' +
+                        servers.BENCH_DIR, session=MemoryBlobClient(latency))
+    elif name == 'ftp':
+        from ..ftp import FTPPath
+        with servers.ftp_server(root) as uri:
+            yield FTPPath(uri)
+            get_pool().clear()
+    elif name == 'sftp':
+        import pysftp
+        from ..ftp import SFTPPath
+        cnopts = pysftp.CnOpts()
+        cnopts.hostkeys = None  # the stand-in's key is generated per run
+        with servers.sftp_server(root) as uri:
+            yield SFTPPath(uri, cnopts=cnopts)
+            get_pool().clear()
+    elif name == 'webdav':
+        from ..dav import WebDavPath
+        with servers.webdav_server(root) as uri:
+            yield WebDavPath(uri)
+            get_pool().clear()
+    else:
+        raise ValueError('Unknown backend {!r}'.format(name))
+
+
+def small_files(directory, config):
+    count, size = config['small_files'], config['small_size']
+    data = os.urandom(size)
+    folder = directory.joinpath('small')
+    _makedirs(folder)
+    paths = [folder.joinpath('file{:05d}'.format(i)) for i in range(count)]
+
+    def write():
+        for path in paths:
+            path.write_bytes(data)
+
+    def read():
+        for path in paths:
+            path.read_bytes()
+
+    return {
+        'files': count,
+        'file_bytes': size,
+        'write_ops_s': count / _timed(write, config['repeat']),
+        'read_ops_s': count / _timed(read, config['repeat']),
+    }
+
+
+def large_file(directory, config):
+    size = config['large_size']
+    chunk = os.urandom(min(size, CHUNK_SIZE))
+    path = directory.joinpath('large')
+
+    def write():
+        with path.open('wb') as f:
+            for offset in range(0, size, len(chunk)):
+                f.write(chunk[:size - offset])
+
+    def read():
+        with path.open('rb') as f:
+            while f.read(CHUNK_SIZE):
+                pass
+
+    return {
+        'bytes': size,
+        'write_mb_s': size / 1e6 / _timed(write, config['repeat']),
+        'read_mb_s': size / 1e6 / _timed(read, config['repeat']),
+    }
+
+
+def listing(directory, config):
+    folder = directory.joinpath('small')
+    entries = len(list(folder.iterdir()))
+    seconds = _timed(lambda: list(folder.iterdir()), config['repeat'])
+    return {'entries': entries, 'entries_s': entries / seconds}
+
+
+def metadata(directory, config):
+    folder = directory.joinpath('small')
+    paths = [folder.joinpath('file{:05d}'.format(i)) for i in
+             range(min(config['small_files'], MAX_METADATA_CALLS))]
+    operation = 'stat'
+    try:
+        paths[0].stat()
+    except (AttributeError, NotImplementedError):
+        operation = 'exists'
+    latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        getattr(path, operation)()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'operation': operation,
+        'calls': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'max_ms': latencies[-1],
+    }
+
+
+# in order: listing and metadata use the files written by small_files
+WORKLOADS = (('small_files', small_files), ('large_file', large_file),
+             ('listing', listing), ('metadata', metadata))
+
+
+def run_backend(name, config):
+    '''Runs every workload on backend `name`, returning a dictionary of
+    results per workload, ``{'skipped': reason}`` when the libraries
+    needed are not installed or ``{'error': message}``'''
+    root = tempfile.mkdtemp(prefix='smartpath-bench-')
+    try:
+        with backend(name, root, config['latency']) as directory:
+            results = {}
+            for workload, func in WORKLOADS:
+                try:
+                    results[workload] = func(directory, config)
+                except Exception as err:
+                    results[workload] = {'error': _error(err)}
+            return results
+    except ImportError as err:
+        return {'skipped': str(err)}
+    except Exception as err:
+        return {'error': _error(err)}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run(backends=BACKENDS, **config):
+    '''Runs the benchmarks and returns the report as a dictionary'''
+    config = dict(DEFAULTS, **config)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started': datetime.datetime.utcnow().isoformat() + 'Z',
+        'config': config,
+        'results': {},
+    }
+    for name in backends:
+        report['results'][name] = run_backend(name, config)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m smartpath.bench',
+        description='Measure the throughput and latency of each backend '
+                    'against local stand-in servers.')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS,
+                        default=list(BACKENDS))
+    parser.add_argument('--small-files', type=int,
+                        default=DEFAULTS['small_files'],
+                        help='number of small files (default: %(default)s)')
+    parser.add_argument('--small-size', type=int,
+                        default=DEFAULTS['small_size'],
+                        help='bytes per small file (default: %(default)s)')
+    parser.add_argument('--large-size', type=int,
+                        default=DEFAULTS['large_size'],
+                        help='bytes in the large file (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=DEFAULTS['repeat'],
+                        help='runs of each measurement, of which the '
+                             'median is reported (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to each request of the '
+                             'in-memory Azure stand-in (default: 0)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON output file (default: stdout)')
+    args = parser.parse_args(argv)
+    report = run(args.backends, small_files=args.small_files,
+                 small_size=args.small_size, large_size=args.large_size,
+                 repeat=args.repeat, latency=args.latency / 1000)
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    _summary(report, sys.stderr)
+    return 1 if _failed(report) else 0
+
+
+def _timed(func, repeat):
+    '''Median duration of `repeat` calls of `func`, in seconds'''
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return max(times[len(times) // 2], 1e-9)
+
+
+def _percentile(values, percent):
+    '''Nearest-rank percentile of the sorted list `values`'''
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def _error(err):
+    return '{}: {}'.format(err.__class__.__name__, err)
+
+
+def _failed(report):
+    return any('error' in result or
+               any('error' in workload for workload in result.values()
+                   if isinstance(workload, dict))
+               for result in report['results'].values())
+
+
+def _summary(report, out):
+    for name, result in sorted(report['results'].items()):
+        if 'skipped' in result or 'error' in result:
+            out.write('{:8} {}\n'.format(name, result.get('skipped') or
+                                         'error: ' + result['error']))
+            continue
+        for workload, _ in WORKLOADS:
+            values = result[workload]
+            out.write('{:8} {:12} {}\n'.format(name, workload, ' '.join(
+                '{}={}'.format(k, round(v, 2) if isinstance(v, float) else v)
+                for k, v in sorted(values.items()))))
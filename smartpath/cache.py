@@ -0,0 +1,469 @@
+'''Caches for remote metadata and file contents'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only atomic renames protect entries
+    fcntl = None
+
+from .transfer import DEFAULT_BLOCK_SIZE, fetch_ranges
+
+_MISSING = object()
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024  # total size of cached contents
+
+
+class TTLCache(object):
+    '''Thread-safe mapping whose entries expire after `ttl` seconds
+
+    Once more than `maxsize` entries are stored, the least recently used
+    entries are evicted. A `ttl` of None keeps entries until they are
+    evicted or invalidated.
+    '''
+    def __init__(self, ttl=60, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires), LRU first
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def get(self, key, default=None):
+        '''Returns the value for `key` unless it is missing or expired'''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value=True):
+        with self._lock:
+            expires = None if self.ttl is None else time.time() + self.ttl
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key):
+        '''Marks `key` as known, e.g. a container which exists'''
+        self.set(key, True)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def invalidate(self, predicate):
+        '''Removes every key for which `predicate(key)` is true and returns
+        how many were removed'''
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachingAccessor(object):
+    '''Wraps a client (session), memoising its metadata calls
+
+    Results of `CACHED` methods such as ``stat()``, ``exists()``,
+    ``is_dir()`` and ``listdir()`` are cached per path for `ttl` seconds,
+    keeping at most `maxsize` entries. Calls through the accessor which
+    modify a path (`MUTATING` methods and ``open()`` for writing) drop the
+    cached entries of that path, its ancestors and everything below it.
+    Everything else is passed through to the wrapped client, e.g.::
+
+        path = FTPPath('ftp://host/data', session=CachingAccessor(client))
+
+    Arguments
+    ---------
+    client: client or session to wrap
+    ttl: seconds for which results are cached
+    maxsize: maximum number of cached results
+    '''
+    CACHED = ('stat', 'lstat', 'exists', 'is_dir', 'is_file', 'isdir',
+              'isfile', 'listdir', 'scandir')
+    MUTATING = ('write_bytes', 'write_text', 'unlink', 'remove', 'rename',
+                'replace', 'copy', 'mkdir', 'makedirs', 'rmdir', 'rmtree',
+                'upload', 'touch', 'chmod', 'utime', 'symlink')
+
+    def __init__(self, client, ttl=60, maxsize=10000):
+        self._client = client
+        self._cache = TTLCache(ttl, maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self._client)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in self.CACHED:
+            return partial(self._cached, name)
+        if name in self.MUTATING:
+            return partial(self._mutating, name)
+        return getattr(self._client, name)
+
+    @property
+    def stats(self):
+        '''Hit and miss counts and the number of cached results'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._cache)}
+
+    def invalidate(self, path=None):
+        '''Drops cached results related to `path`, or all results'''
+        if path is None:
+            return self._cache.clear()
+        path = str(path).rstrip('/')
+        self._cache.invalidate(lambda key: _related(key[1], path))
+
+    def open(self, path, mode='r', *args, **kwargs):
+        stream = self._client.open(path, mode, *args, **kwargs)
+        if set(mode) & set('wax+'):
+            self.invalidate(path)
+            # and again once written, in case it was listed meanwhile
+            return _Invalidating(stream, partial(self.invalidate, path))
+        return stream
+
+    def _cached(self, name, path='', *args, **kwargs):
+        key = (name, str(path).rstrip('/')) + args
+        if kwargs:
+            key += tuple(sorted(kwargs.items()))
+        value = self._cache.get(key, _MISSING)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is _MISSING:
+            value = getattr(self._client, name)(path, *args, **kwargs)
+            if name in ('listdir', 'scandir'):
+                value = list(value)
+            self._cache.set(key, value)
+        return iter(value) if name == 'scandir' else value
+
+    def _mutating(self, name, *args, **kwargs):
+        try:
+            return getattr(self._client, name)(*args, **kwargs)
+        finally:
+            # e.g. rename(src, dst) affects both paths
+            for path in args[:2]:
+                if isinstance(path, str):
+                    self.invalidate(path)
+
+
+class _Invalidating(object):
+    '''Wraps a writable stream or context manager so that the cache is
+    invalidated again once it is closed'''
+    def __init__(self, wrapped, callback):
+        self._wrapped = wrapped
+        self._callback = callback
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        return iter(self._wrapped)
+
+    def __enter__(self):
+        return self._wrapped.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            return self._wrapped.__exit__(*exc_info)
+        finally:
+            self._callback()
+
+    def close(self):
+        try:
+            close = getattr(self._wrapped, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._callback()
+
+
+def _related(path, other):
+    '''Whether either path is the other or one of its ancestors'''
+    return (path == other or path.startswith(other + '/') or
+            other.startswith(path + '/') or not path or not other)
+
+
+class ContentCache(object):
+    '''Read-through cache of remote file contents on local disk
+
+    Files are cached whole, keyed by URI, and read from disk for
+    ``open()``, ``read_bytes()``, ``read_text()`` and ``read_range()``.
+    An entry is trusted for `max_age` seconds, after which the remote file's
+    size and modification time are compared with those it was cached with
+    (a single ``stat()``, often answered from a listing). Once the cached
+    files total more than `max_bytes`, the least recently used are evicted.
+
+    Several processes may share a directory: entries are written to a
+    temporary file and renamed into place, and downloads of the same file
+    are serialised with file locks, so each is only fetched once.
+
+    Caching is opt-in, e.g. for all paths or a single path::
+
+        BasePath.content_cache = ContentCache()
+        path.content_cache = ContentCache('/scratch/cache', max_age=3600)
+
+    Arguments
+    ---------
+    directory: where entries are stored, defaults to ``smartpath`` in the
+        user's cache directory ($XDG_CACHE_HOME or ~/.cache)
+    max_bytes: total size of the cached files
+    max_age: seconds for which an entry is used without checking the
+        remote file
+    max_file_bytes: larger files are read from the server rather than
+        cached, defaults to a quarter of `max_bytes`
+    max_workers: concurrent ranged reads when downloading large files
+    '''
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES,
+                 max_age=60, max_file_bytes=None, max_workers=4):
+        if directory is None:
+            directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                     os.path.expanduser('~/.cache'),
+                                     'smartpath')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_file_bytes = (max_bytes // 4 if max_file_bytes is None
+                               else max_file_bytes)
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.directory)
+
+    @property
+    def stats(self):
+        '''Hit and miss counts of this process'''
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def filename(self, path):
+        '''Local file with the current contents of `path`, downloading it
+        if it is not cached or has changed. None if it is too large to
+        cache.'''
+        data, meta_file = self._files(path)
+        meta = _load(meta_file)
+        if (meta is not None and time.time() - meta['checked'] < self.max_age
+                and os.path.exists(data)):
+            return self._hit(data)
+        validator = _validator(path)
+        if _valid(meta, validator) and os.path.exists(data):
+            _dump(meta_file, {'validator': validator, 'checked': time.time()})
+            return self._hit(data)
+        if validator is not None and validator[0] > self.max_file_bytes:
+            return None
+        with _locked(os.path.join(os.path.dirname(data), '.lock')):
+            # another process may have downloaded it meanwhile
+            if _valid(_load(meta_file), validator) and os.path.exists(data):
+                return self._hit(data)
+            with self._lock:
+                self.misses += 1
+            _atomic_write(data, partial(_download, path, validator and
+                                        validator[0], self.max_workers))
+            _dump(meta_file, {'validator': validator, 'checked': time.time()})
+        self._evict()
+        return data
+
+    def open(self, path, mode='r', buffering=-1, encoding=None, errors=None,
+             newline=None, **kwargs):
+        '''Opens the cached copy of `path` for reading'''
+        if set(mode) - set('rbt'):
+            raise ValueError('Unsupported mode: {}'.format(repr(mode)))
+        if 'b' not in mode:
+            encoding = encoding or 'utf8'
+        for retry in (True, False):
+            filename = self.filename(path)
+            if filename is None:
+                return _uncached(path, 'open')(mode, **kwargs)
+            try:
+                return open(filename, mode, buffering, encoding, errors,
+                            newline)
+            except (IOError, OSError):
+                if not retry:  # evicted by another process, fetch again
+                    raise
+                self.invalidate(path)
+
+    def read_bytes(self, path):
+        with self.open(path, 'rb') as f:
+            return f.read()
+
+    def read_text(self, path):
+        with self.open(path, 'r') as f:
+            return f.read()
+
+    def read_range(self, path, offset, length):
+        '''Reads a range from the cached copy, caching the whole file if
+        it is small enough and otherwise reading the range remotely'''
+        filename = self.filename(path)
+        if filename is None:
+            return _uncached(path, 'read_range')(offset, length)
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError):
+            f = self.open(path, 'rb')  # evicted by another process
+        with f:
+            f.seek(offset)
+            return f.read(length)
+
+    def invalidate(self, path):
+        '''Drops the cached copy of `path`'''
+        for filename in self._files(path):
+            _remove(filename)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name),
+                          ignore_errors=True)
+
+    def _files(self, path):
+        key = hashlib.sha256(str(path).encode('utf8')).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base, base + '.json'
+
+    def _hit(self, data):
+        with self._lock:
+            self.hits += 1
+        try:
+            os.utime(data)  # the modification time orders the LRU
+        except OSError:
+            pass
+        return data
+
+    def _evict(self):
+        with _locked(os.path.join(self.directory, '.lock')):
+            entries, total = [], 0
+            for sub in os.listdir(self.directory):
+                subdir = os.path.join(self.directory, sub)
+                if not os.path.isdir(subdir):
+                    continue
+                for name in os.listdir(subdir):
+                    if '.' in name:
+                        continue  # metadata, locks and downloads
+                    try:
+                        st = os.stat(os.path.join(subdir, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size,
+                                    os.path.join(subdir, name)))
+                    total += st.st_size
+            for _, size, data in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                _remove(data + '.json')
+                _remove(data)
+                total -= size
+
+
+def _uncached(path, name):
+    # the method without the `use_content_cache` wrapper
+    method = getattr(type(path), name)
+    return partial(getattr(method, '__wrapped__', method), path)
+
+
+def _download(path, size, max_workers, f):
+    if size and size > DEFAULT_BLOCK_SIZE and max_workers > 1:
+        return fetch_ranges(_uncached(path, 'read_range'), f, size,
+                            max_workers=max_workers)
+    with _uncached(path, 'open')('rb') as src:
+        shutil.copyfileobj(src, f, 1024 * 1024)
+
+
+def _validator(path):
+    try:
+        st = path.stat()
+    except (NotImplementedError, AttributeError):
+        return None  # only max_age limits how long the entry is used
+    return [st.st_size, st.st_mtime]
+
+
+def _valid(meta, validator):
+    return (meta is not None and validator is not None and
+            meta.get('validator') == validator)
+
+
+def _load(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _dump(filename, meta):
+    _atomic_write(filename, lambda f: f.write(json.dumps(meta).encode()))
+
+
+def _atomic_write(filename, write):
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, filename)
+    except BaseException:
+        _remove(tmp)
+        raise
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+@contextmanager
+def _locked(filename):
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
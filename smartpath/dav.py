@@ -1,17 +1,25 @@
 '''Module for handling WebDAV paths'''
 import easywebdav
 
-import dateutil
+import dateutil.parser
+import io
 import time
 import os
 
-import tempfile
+from .base import BasePath, Capabilities, DirEntry, make_stat
+from .metrics import instrument
+from .streams import (DEFAULT_BLOCK_SIZE, DEFAULT_READAHEAD,
+                      ResumableReader, SpooledWriter, open_reader, open_upload)
 
-from .base import BasePath
+from functools import partial
+from urllib.parse import unquote, urlparse
+from xml.etree import ElementTree
 
 
+@instrument
 class WebDavClient(easywebdav.Client):
     '''WebDAV client providing os-like functions'''
+    CAPABILITIES = Capabilities(rename=True, copy=True)  # MOVE and COPY
 
     def __init__(self, host, port=0, auth=None,
                  username=None, password=None, protocol=None,
@@ -29,7 +37,8 @@ class WebDavClient(easywebdav.Client):
         kwargs = dict([(key, val) for key, val in locals().items() if key in
                        ('host', 'username', 'password', 'auth', 'port',
                         'protocol', 'verify_ssl', 'path', 'cert')])
-        super(easywebdav.Client, self).__init__(**kwargs)
+        super(WebDavClient, self).__init__(**kwargs)
+        self.scheme, self.hostname = 'dav', host  # metrics labels
 
     def stat(self, path):
         return stat_result(self.ls(path)[0])
@@ -37,35 +46,120 @@ class WebDavClient(easywebdav.Client):
     def lstat(self, path):
         raise NotImplementedError
 
-    def open(self, path, mode='r'):
-        if 'r' in mode:
-            pass
-        elif 'w' in mode:
-            os.path.split(path)[0]
-        else:
+    def open(self, path, mode='r', readahead=DEFAULT_READAHEAD,
+             spool_size=DEFAULT_BLOCK_SIZE, **kwargs):
+        '''Open a file for reading, fetching ranges on demand, or for
+        writing. Written files are uploaded by a single PUT once closed,
+        unless the ``with`` block raises, and are spooled to a temporary
+        file beyond `spool_size` bytes until then.'''
+        if set(mode) & set('a+'):
+            raise io.UnsupportedOperation(
+                'WebDAV files cannot be appended to or updated, only read or '
+                'written whole: {}'.format(repr(mode)))
+        if set(mode) - set('rwxbt') or len(set(mode) & set('rwx')) != 1:
             raise ValueError('Unsupported mode: {}'.format(repr(mode)))
+        if 'r' in mode:
+            raw = ResumableReader(partial(self._open_at, path),
+                                  size=partial(self._size, path),
+                                  name=path, chunk_size=readahead)
+            return open_reader(raw, mode, buffer_size=readahead, **kwargs)
+        if 'x' in mode and self.exists(path):
+            raise FileExistsError('{} exists'.format(repr(path)))
+        raw = SpooledWriter(partial(self._put, path), max_size=spool_size,
+                            name=path)
+        return open_upload(raw, mode, buffer_size=readahead, **kwargs)
+
+    def _open_at(self, path, offset):
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        response = self._send('GET', path, (200, 206), stream=True,
+                              headers=headers)
+        response.raw.decode_content = True
+        if offset and response.status_code == 200:
+            # server ignored the Range header so skip to the offset
+            remaining = offset
+            while remaining > 0:
+                chunk = response.raw.read(min(remaining, DEFAULT_READAHEAD))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        return response.raw
+
+    def _put(self, path, f):
+        # easywebdav's upload() only runs on python 2
+        self._send('PUT', path, (200, 201, 204), data=f)
+
+    def _size(self, path):
+        return int(self.ls(path)[0].size)
+
+    def read_range(self, path, offset, length):
+        if length <= 0:
+            return b''
+        headers = {'Range': 'bytes={}-{}'.format(offset, offset + length - 1)}
+        response = self._send('GET', path, (200, 206, 416), headers=headers)
+        if response.status_code == 416:  # range starts beyond end of file
+            return b''
+        elif response.status_code == 200:  # Range header was ignored
+            return response.content[offset:offset + length]
+        return response.content
+
+    def is_dir(self, path):
+        '''Whether `path` is a collection, from a PROPFIND of depth 0'''
+        response = self._send('PROPFIND', path, (207, 301, 404),
+                              headers={'Depth': '0'})
+        if response.status_code != 207:
+            return response.status_code == 301  # e.g. to add a slash
+        tree = ElementTree.fromstring(response.content)
+        return tree.find('.//{DAV:}resourcetype/{DAV:}collection') is not None
 
     def listdir(self, path=''):
-        [f.name for f in self.ls(path)]
+        return [entry.name for entry in self.scandir(path)]
 
     def scandir(self, *args):
-        raise (f.name for f in self.ls('/' + '/'.join(args)))
+        '''Yields a `DirEntry` for each member of a collection, with the
+        size and times of the PROPFIND listing'''
+        path = '/' + '/'.join(args).strip('/')
+        own = unquote(urlparse(self._get_url(path)).path).rstrip('/')
+        for f in self.ls(path):
+            href = unquote(urlparse(f.name).path)
+            if href.rstrip('/') == own:
+                continue  # the collection itself
+            name = href.rstrip('/').rsplit('/', 1)[-1]
+            is_dir = (href.endswith('/') or
+                      f.contenttype == 'httpd/unix-directory')
+            yield DirEntry(name, path.rstrip('/') + '/' + name, is_dir,
+                           make_stat(int(f.size or 0), _parse_time(f.mtime),
+                                     is_dir, ctime=_parse_time(f.ctime)))
 
     def utime(self, path, times=None, *, ns=None,
               dir_fd=None, follow_symlinks=True):
         raise NotImplementedError
 
+    def _transfer(self, method, src, dst, overwrite):
+        headers = {'Destination': self._get_url(dst),
+                   'Overwrite': 'T' if overwrite else 'F'}
+        self._send(method, src, (201, 204), headers=headers)
+
     def rename(self, src, dst):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            self.download(src, os.path.join(tmpdir, 'temp'))
-            self.upload(os.path.join(tmpdir, 'temp'), dst)
+        '''Server-side MOVE, failing if `dst` exists'''
+        self._transfer('MOVE', src, dst, overwrite=False)
+
+    def replace(self, src, dst):
+        '''Server-side MOVE, replacing `dst` if it exists'''
+        self._transfer('MOVE', src, dst, overwrite=True)
+
+    def copy(self, src, dst):
+        '''Server-side COPY, replacing `dst` if it exists'''
+        self._transfer('COPY', src, dst, overwrite=True)
 
     # alias functions for uniform interface
     unlink = easywebdav.Client.delete
-    replace = rename
     makedirs = easywebdav.Client.mkdirs
 
 
+def _parse_time(value):
+    return dateutil.parser.parse(value) if value else None
+
+
 class stat_result(object):
     def __init__(self, path):
         self._file = path
@@ -107,55 +201,53 @@ class stat_result(object):
     @property
     def st_atime(self):
         '''time of most recent access'''
-        atime = dateutil.parser.parse(self.mtime)
+        atime = dateutil.parser.parse(self._file.mtime)
         return round(time.mktime(atime.timetuple()))
 
     @property
     def st_mtime(self):
         '''return time of most recent content modification'''
-        mtime = dateutil.parser.parse(self.mtime)
+        mtime = dateutil.parser.parse(self._file.mtime)
         return round(time.mktime(mtime.timetuple()))
 
     @property
     def st_ctime(self):
         '''return time of most recent metadata change'''
-        ctime = dateutil.parser.parse(self.ctime)
+        ctime = dateutil.parser.parse(self._file.ctime)
         return round(time.mktime(ctime.timetuple()))
 
 
-class WebDavPath(easywebdav.File, BasePath):
+class WebDavPath(BasePath):
+    __slots__ = ()
     SESSION_FACTORY = WebDavClient
 
-    def __init__(self, uri, session=None, **kwargs):
-        BasePath.__init__(self, uri, session, **kwargs)
-        if not self.session:
-            self.SESSION_FACTORY(
-                host=self.hostname,
-                port=self.port or 0,
-                auth=None,
-                username=self.username or kwargs.get('username'),
-                password=self.password or kwargs.get('password'),
-                protocol=kwargs.pop('protocol', self.query.get('protocol')),
-                verify_ssl=kwargs.pop('verify_ssl',
-                                      self.query.get('verify_ssl', True)),
-                path=kwargs.get('path') or self.path,
-                cert=kwargs.get('cert', self.query.get('cert')),
-                use_env=kwargs.get('use_env', self.query.get('use_env', True))
-            )
-        try:
-            self.stat = self.session.stat(self.path)
-            self.__dict__.update(self.stat._asdict())
-            easywebdav.File(self.path, *self.stat._asdict().values())
-        except easywebdav.client.OperationFailed:
-            easywebdav.File(self.path, None, None, None, None)  # defer to later
+    def _create_session(self):
+        kwargs = self._session_kwargs()
+        query = self._query_value
+        return self.SESSION_FACTORY(
+            host=self.hostname,
+            port=self.port or 0,
+            auth=None,
+            username=self.username or kwargs.get('username'),
+            password=self.password or kwargs.get('password'),
+            protocol=kwargs.get('protocol', query('protocol')),
+            verify_ssl=kwargs.get('verify_ssl', query('verify_ssl', True)),
+            path=kwargs.get('path'),
+            cert=kwargs.get('cert', query('cert')),
+            use_env=kwargs.get('use_env', query('use_env', True))
+        )
+
+    def _properties(self):
+        '''Fetches the WebDAV properties (PROPFIND) of this path'''
+        return self.session.ls(self.path)[0]
 
     @property
     def modified_time(self):
-        return getattr(self, 'mtime', None)
+        return self._properties().mtime
 
     @property
     def created_time(self):
-        return getattr(self, 'ctime', None)
+        return self._properties().ctime
 
     @property
     def anchor(self):
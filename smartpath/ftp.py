@@ -1,12 +1,16 @@
 '''Module for handling FTP paths'''
+import datetime
 import ftplib
 import ftputil
+import posixpath
 import pysftp
-import os
+import stat
 
-from .base import BaseClient, BasePath, NamedBytesIO, NamedStringIO
+from .base import BaseClient, BasePath, Capabilities, DirEntry, make_stat
+from .streams import (DEFAULT_READAHEAD, FileAdapter, ResumableReader,
+                      open_reader, open_stream)
 
-from contextlib import contextmanager
+from functools import partial
 
 
 class FTPTLSSession(ftplib.FTP_TLS):
@@ -20,6 +24,8 @@ class FTPTLSSession(ftplib.FTP_TLS):
 
 class FTPClient(ftputil.FTPHost, BaseClient):
     '''Simplified yet flexible FTP client'''
+    CAPABILITIES = Capabilities(rename=True, copy=False)  # RNFR/RNTO
+
     def __init__(self, factory=ftplib.FTP, **kwargs):
         BaseClient.__init__(self, uri=kwargs.pop('uri', 'ftp://'), **kwargs)
         ftputil.FTPHost.__init__(
@@ -33,9 +39,61 @@ class FTPClient(ftputil.FTPHost, BaseClient):
             port=kwargs.pop('port', self.port or 21),
             session_factory=factory, **kwargs)
 
+    def open(self, path, mode='r', readahead=DEFAULT_READAHEAD, **kwargs):
+        '''Open a remote file. Files opened for reading are seekable; the
+        transfer is only restarted (using REST) when the position jumps.'''
+        if mode in ('r', 'rb'):
+            raw = ResumableReader(partial(self._open_at, path),
+                                  size=partial(self._size, path),
+                                  name=path, chunk_size=readahead)
+            return open_reader(raw, mode, buffer_size=readahead, **kwargs)
+        return ftputil.FTPHost.open(self, path, mode, **kwargs)
+
+    def _open_at(self, path, offset):
+        return ftputil.FTPHost.open(self, path, 'rb', rest=offset or None)
+
+    def _size(self, path):
+        return self.stat(path).st_size
+
+    def read_range(self, path, offset, length):
+        with self._open_at(path, offset) as f:
+            return f.read(length)
+
+    def replace(self, src, dst):
+        # RNTO replaces existing files on common servers
+        return self.rename(src, dst)
+
+    def scandir(self, path='.'):
+        '''Yields a `DirEntry` for each file and directory in `path`, with
+        the metadata from a single listing: MLSD facts where the server
+        supports them, otherwise the LIST parsed into ftputil's stat cache'''
+        try:
+            facts = list(self._session.mlsd(
+                path, ['type', 'size', 'modify', 'unix.mode']))
+        except ftplib.error_perm:  # MLSD not supported
+            for name in self.listdir(path):
+                child = posixpath.join(path, name)
+                st = self.lstat(child)
+                yield DirEntry(name, child, stat.S_ISDIR(st.st_mode), st)
+            return
+        for name, fact in facts:
+            if fact.get('type', '').lower() in ('cdir', 'pdir'):
+                continue
+            is_dir = fact.get('type', '').lower() == 'dir'
+            mode = fact.get('unix.mode')
+            if mode is not None:
+                mode = int(mode, 8) | (stat.S_IFDIR if is_dir else
+                                       stat.S_IFREG)
+            yield DirEntry(name, posixpath.join(path, name), is_dir,
+                           make_stat(int(fact.get('size', 0)),
+                                     _mlsd_time(fact.get('modify')),
+                                     is_dir, mode))
+
 
 class SFTPClient(pysftp.Connection, BaseClient):
     '''An FTP over SSH client'''
+    CAPABILITIES = Capabilities(rename=True, copy=False)
+
     def __init__(self, **kwargs):
         BaseClient.__init__(self, uri=kwargs.pop('uri', 'sftp://'), **kwargs)
         pysftp.Connection.__init__(
@@ -57,60 +115,109 @@ class SFTPClient(pysftp.Connection, BaseClient):
                 'default_path', self.path if len(self.path) > 1 else None),
             ciphers=kwargs.pop('ciphers', self.query.get('ciphers')),
             log=kwargs.pop('log', self.query.get('log', False)),
-            cnopts=dict([(k, kwargs.get(k, self.query.get(k)))
-                         for k in set(list(kwargs.keys()) +
-                                      list(self.query.keys()))])
+            cnopts=kwargs.pop('cnopts', None) or  # e.g. a pysftp.CnOpts
+            dict([(k, kwargs.get(k, self.query.get(k)))
+                  for k in set(list(kwargs.keys()) +
+                               list(self.query.keys()))])
             )
 
     def is_dir(self, path):
         return self.isdir(path)
 
-    @contextmanager
-    def open(self, filename, mode='r', **kwargs):
-        if '+' in mode or 'a' in mode:
-            raise ValueError(mode + 'not supported')
-        bio = NamedBytesIO(name='{}${}'.format(filename, str(self)))
-        try:
-            if mode.beginswith('r'):
-                self.getfo(filename, bio)
-                bio.seek(0)
-            io = (bio if mode.endswith('b') else
-                  NamedStringIO(bio.getvalue().decode('utf8')))
-            yield io
-        finally:
-            if mode.beginswith('w'):
-                if io != bio:
-                    bio.write(io.getvalue().encode('ascii'))
-                bio.seek(0)
-                self.putfo(filename, bio)
+    def replace(self, src, dst):
+        # plain SFTP rename fails if dst exists, the posix extension replaces
+        return self.sftp_client.posix_rename(src, dst)
+
+    def open(self, filename, mode='r', bufsize=DEFAULT_READAHEAD,
+             readahead=None, **kwargs):
+        '''Open a remote file as a stream over a paramiko ``SFTPFile``
+
+        Reads fetch `bufsize` (or `readahead`) bytes per round trip by
+        pipelining the SFTP read requests for that window, as paramiko's
+        prefetch does, and writes are pipelined rather than waiting for each
+        block to be acknowledged. Memory use is bounded by `bufsize` however
+        large the file is.
+        '''
+        if set(mode) - set('rwaxbt+'):
+            raise ValueError('Unsupported mode: {}'.format(repr(mode)))
+        bufsize = readahead or bufsize
+        sftp_mode = mode.replace('t', '').replace('b', '') + 'b'
+        remote = self.sftp_client.open(filename, sftp_mode, bufsize)
+        if set(mode) & set('wax+'):
+            remote.set_pipelined(True)
+        raw = SFTPStream(remote, sftp_mode, name=filename)
+        return open_stream(raw, mode, buffer_size=bufsize, **kwargs)
+
+    def read_range(self, filename, offset, length):
+        with self.open(filename, 'rb', bufsize=max(length, 1)) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def scandir(self, path='.'):
+        '''Yields a `DirEntry` for each file and directory in `path`, with
+        the attributes returned by a single READDIR listing'''
+        for attr in self.sftp_client.listdir_attr(path):
+            is_dir = stat.S_ISDIR(attr.st_mode or 0)
+            yield DirEntry(attr.filename,
+                           posixpath.join(path, attr.filename), is_dir,
+                           make_stat(attr.st_size, attr.st_mtime, is_dir,
+                                     attr.st_mode, attr.st_atime,
+                                     uid=attr.st_uid, gid=attr.st_gid))
+
+
+def _mlsd_time(value):
+    '''Parses a MLSD time fact (YYYYMMDDHHMMSS[.sss] in UTC)'''
+    if not value:
+        return None
+    return datetime.datetime.strptime(value[:14], '%Y%m%d%H%M%S').replace(
+        tzinfo=datetime.timezone.utc)
+
+
+class SFTPStream(FileAdapter):
+    '''Stream over a paramiko ``SFTPFile`` which reads in pipelined windows'''
+    def __init__(self, f, mode='rb', name=None):
+        super(SFTPStream, self).__init__(f, mode, name)
+        self._size = None
+
+    def _read(self, size):
+        if self.mode != 'rb':
+            return self._file.read(size)  # the size may change as we write
+        if self._size is None:
+            self._size = self._file.stat().st_size
+        offset = self._file.tell()
+        size = min(size, self._size - offset)
+        if size <= 0:
+            return b''
+        # readv prefetches the window as concurrent requests of at most
+        # MAX_REQUEST_SIZE rather than a round trip for each of them
+        return b''.join(self._file.readv([(offset, size)]))
 
 
 class SFTPPath(BasePath):
     '''FTP over SSH path'''
+    __slots__ = ()
     SESSION_FACTORY = SFTPClient
 
-    def __init__(self, uri, session=None):
-        super(BaseClient, self).__init__(uri, session)
-        self.session = self.session or (
-            SFTPClient(username=self.username,
-                       password=self.password,
-                       port=self.port or 22,
-                       default_path=os.dirname(self.path),
-                       private_key=self.query.get('private_key', None),
-                       cnopts=self.query))
+    def _create_session(self):
+        kwargs = self._session_kwargs()
+        # paths are absolute, and pooled sessions are shared by every path
+        # of the server, so do not chdir to the path which connected first
+        kwargs.setdefault('default_path', None)
+        return SFTPClient(uri=self.uri, **kwargs)
 
 
 class FTPPath(BasePath):
     '''FTP or FTPS Path'''
+    __slots__ = ()
     SESSION_FACTORY = FTPClient
 
     def __init__(self, uri, session=None, **kwargs):
-        BasePath.__init__(self, uri, session, **kwargs)
-        if self.scheme is 'sftp':
-            self.session = session or SFTPClient(**kwargs)
+        if str(uri or '').startswith('sftp:'):
             self.__class__ = SFTPPath  # dark magic to convert to SFTPPath
-        else:
-            factory = FTPTLSSession if self.scheme is 'ftps' else ftplib.FTP
-            factory = kwargs.pop('session_factory', factory)
-            self.session = session or (
-                FTPClient(session_factory=factory, **kwargs))
+        BasePath.__init__(self, uri, session, **kwargs)
+
+    def _create_session(self):
+        kwargs = self._session_kwargs()
+        factory = FTPTLSSession if self.scheme == 'ftps' else ftplib.FTP
+        factory = kwargs.pop('session_factory', factory)
+        return FTPClient(factory=factory, uri=self.uri, **kwargs)
@@ -0,0 +1,384 @@
+'''Metrics of client operations, labelled by scheme and host
+
+Every client method named in `OPERATIONS` records its calls, errors,
+latency and the bytes it transferred in the process-wide `MetricsRegistry`
+(see `get_registry()`). Subclasses of `BaseClient` are instrumented
+automatically; other clients are decorated with `instrument`.
+
+The metrics can be exported as Prometheus text::
+
+    print(smartpath.metrics.get_registry().prometheus())
+
+or observed per call with a hook::
+
+    get_registry().add_hook(lambda event: print(event.operation,
+                                                event.seconds))
+
+Only the outermost operation of a thread is recorded, so that e.g. a
+``listdir`` implemented with ``scandir`` counts once, as ``listdir``.
+'''
+import threading
+import time
+import types
+import warnings
+
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+OPERATIONS = ('open', 'read_range', 'read_bytes', 'read_text',
+              'write_bytes', 'write_text', 'stat', 'listdir', 'scandir',
+              'scantree', 'exists', 'unlink', 'rename', 'copy', 'mkdir',
+              'makedirs', 'rmdir')
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0)
+
+OperationEvent = namedtuple('OperationEvent', ['scheme', 'host', 'operation',
+                                               'seconds', 'error',
+                                               'bytes_in', 'bytes_out'])
+OperationEvent.__doc__ = '''A completed client call, given to hooks; `error`
+is the exception raised, if any'''
+
+
+class OperationMetrics(object):
+    '''Totals of one operation on one host'''
+    __slots__ = ('calls', 'errors', 'bytes_in', 'bytes_out', 'seconds',
+                 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last is +Inf
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class MetricsRegistry(object):
+    '''Thread-safe totals of client operations by
+    ``(scheme, host, operation)``
+
+    Arguments
+    ---------
+    enabled: whether clients record their calls at all
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def observe(self, scheme, host, operation, seconds, error=None,
+                bytes_in=0, bytes_out=0):
+        '''Records a completed call and passes it to the hooks'''
+        with self._lock:
+            metrics = self._get(scheme, host, operation)
+            metrics.calls += 1
+            metrics.errors += error is not None
+            metrics.bytes_in += bytes_in
+            metrics.bytes_out += bytes_out
+            metrics.seconds += seconds
+            metrics.buckets[bisect_left(BUCKETS, seconds)] += 1
+        if self._hooks:
+            event = OperationEvent(scheme, host, operation, seconds, error,
+                                   bytes_in, bytes_out)
+            for hook in list(self._hooks):
+                try:
+                    hook(event)
+                except Exception as err:
+                    warnings.warn('smartpath metrics hook {!r} failed: '
+                                  '{!r}'.format(hook, err), RuntimeWarning)
+
+    def add_bytes(self, scheme, host, operation, bytes_in=0, bytes_out=0):
+        '''Adds bytes transferred after a call returned, e.g. through the
+        file object returned by ``open()``'''
+        with self._lock:
+            metrics = self._get(scheme, host, operation)
+            metrics.bytes_in += bytes_in
+            metrics.bytes_out += bytes_out
+
+    def add_hook(self, hook):
+        '''Calls ``hook(event)`` with an `OperationEvent` after each call'''
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def snapshot(self, scheme=None, host=None):
+        '''Dictionary of `OperationMetrics.as_dict()` by
+        ``(scheme, host, operation)``, optionally only for one scheme or
+        host'''
+        with self._lock:
+            return dict((key, metrics.as_dict()) for key, metrics
+                        in self._metrics.items()
+                        if scheme in (None, key[0]) and host in (None, key[1]))
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def prometheus(self):
+        '''The metrics in the Prometheus text exposition format'''
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, doc, field):
+            lines.append('# HELP smartpath_{} {}'.format(name, doc))
+            lines.append('# TYPE smartpath_{} {}'.format(name, kind))
+            for key, metrics in snapshot:
+                lines.append('smartpath_{}{{{}}} {}'.format(
+                    name, _labels(key), metrics[field]))
+
+        family('operations_total', 'counter', 'Client calls', 'calls')
+        family('operation_errors_total', 'counter',
+               'Client calls which raised', 'errors')
+        family('received_bytes_total', 'counter', 'Bytes read', 'bytes_in')
+        family('sent_bytes_total', 'counter', 'Bytes written', 'bytes_out')
+        name = 'smartpath_operation_duration_seconds'
+        lines.append('# HELP {} Latency of client calls'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for key, metrics in snapshot:
+            count = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), metrics['buckets']):
+                count += n
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, _labels(key), bound, count))
+            lines.append('{}_sum{{{}}} {}'.format(name, _labels(key),
+                                                  metrics['seconds']))
+            lines.append('{}_count{{{}}} {}'.format(name, _labels(key),
+                                                    metrics['calls']))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, scheme, host, operation):
+        key = (scheme, host, operation)
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            metrics = self._metrics[key] = OperationMetrics()
+        return metrics
+
+
+_registry = MetricsRegistry()
+_local = threading.local()  # `active`: whether an operation is recorded
+
+
+def get_registry():
+    '''Returns the process-wide `MetricsRegistry`'''
+    return _registry
+
+
+def set_registry(registry):
+    '''Replaces the process-wide `MetricsRegistry`'''
+    global _registry
+    _registry = registry
+
+
+def instrument(cls):
+    '''Class decorator recording the calls of the methods in `OPERATIONS`
+    which `cls` has; the labels are its ``scheme`` and ``hostname``
+    attributes'''
+    for name in OPERATIONS:
+        method = getattr(cls, name, None)
+        if callable(method) and not getattr(method, '_metered', False):
+            setattr(cls, name, metered(method))
+    return cls
+
+
+def metered(func):
+    '''Decorator recording the calls of the client method `func`, unless
+    it is called by another recorded operation of the same thread'''
+    operation = func.__name__
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        registry = _registry
+        if not registry.enabled or getattr(_local, 'active', False):
+            return func(self, *args, **kwargs)
+        labels = (getattr(self, 'scheme', None) or '',
+                  getattr(self, 'hostname', None) or '')
+        start = time.perf_counter()
+        _local.active = True
+        try:
+            result = func(self, *args, **kwargs)
+        except NotImplementedError:
+            raise  # nothing was sent
+        except Exception as err:
+            registry.observe(labels[0], labels[1], operation,
+                             time.perf_counter() - start, error=err)
+            raise
+        finally:
+            _local.active = False
+        if isinstance(result, types.GeneratorType):
+            return _metered_iter(registry, labels, operation, start, result)
+        bytes_in, bytes_out = _sizes(operation, args, result)
+        registry.observe(labels[0], labels[1], operation,
+                         time.perf_counter() - start, bytes_in=bytes_in,
+                         bytes_out=bytes_out)
+        if operation == 'open':
+            if hasattr(result, 'read') or hasattr(result, 'write'):
+                return MeteredFile(result, registry, labels)
+            if hasattr(result, '__enter__'):
+                return MeteredContext(result, registry, labels)
+        return result
+    wrapper._metered = True
+    return wrapper
+
+
+@contextmanager
+def _unmetered():
+    '''Runs client code on behalf of an operation already recorded'''
+    active = getattr(_local, 'active', False)
+    _local.active = True
+    try:
+        yield
+    finally:
+        _local.active = active
+
+
+class MeteredFile(object):
+    '''Proxy of a file object counting the bytes read and written, which
+    are added to the ``open`` metrics when it is closed'''
+    def __init__(self, wrapped, registry, labels):
+        self._wrapped = wrapped
+        self._registry = registry
+        self._labels = labels
+        self._in = self._out = 0
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        for line in self._wrapped:
+            self._in += len(line)
+            yield line
+
+    def __enter__(self):
+        self._wrapped.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            with _unmetered():
+                return self._wrapped.__exit__(*exc_info)
+        finally:
+            self._flush()
+
+    def read(self, *args):
+        data = self._wrapped.read(*args)
+        self._in += len(data)
+        return data
+
+    def read1(self, *args):
+        data = self._wrapped.read1(*args)
+        self._in += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._wrapped.readline(*args)
+        self._in += len(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self._wrapped.readlines(*args)
+        self._in += sum(len(line) for line in lines)
+        return lines
+
+    def readinto(self, buffer):
+        n = self._wrapped.readinto(buffer)
+        self._in += n or 0
+        return n
+
+    def write(self, data):
+        n = self._wrapped.write(data)
+        self._out += len(data) if n is None else n
+        return n
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        try:
+            with _unmetered():
+                self._wrapped.close()
+        finally:
+            self._flush()
+
+    def _flush(self):
+        if self._in or self._out:
+            self._registry.add_bytes(self._labels[0], self._labels[1], 'open',
+                                     self._in, self._out)
+            self._in = self._out = 0
+
+    def __del__(self):
+        self._flush()
+
+
+class MeteredContext(object):
+    '''Proxy of a context manager returned by ``open()``, e.g. one which
+    uploads what is written once its block exits, counting the bytes of the
+    file object it yields'''
+    def __init__(self, wrapped, registry, labels):
+        self._wrapped = wrapped
+        self._registry = registry
+        self._labels = labels
+        self._file = None
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __enter__(self):
+        self._file = MeteredFile(self._wrapped.__enter__(), self._registry,
+                                 self._labels)
+        return self._file
+
+    def __exit__(self, *exc_info):
+        try:
+            with _unmetered():
+                return self._wrapped.__exit__(*exc_info)
+        finally:
+            if self._file is not None:
+                self._file._flush()
+
+
+def _metered_iter(registry, labels, operation, start, generator):
+    '''Records a generator's call once it is exhausted or fails'''
+    error = None
+    try:
+        while True:
+            with _unmetered():
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+    except Exception as err:
+        error = err
+        raise
+    finally:
+        registry.observe(labels[0], labels[1], operation,
+                         time.perf_counter() - start, error=error)
+
+
+def _sizes(operation, args, result):
+    '''Bytes received and sent by a call'''
+    if operation.startswith('read_') and isinstance(result, (bytes, str)):
+        return len(result), 0
+    if operation.startswith('write_') and len(args) > 1:
+        return 0, len(args[1])
+    return 0, 0
+
+
+def _labels(key):
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value
+                    in zip(('scheme', 'host', 'operation'), key))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
@@ -73,4 +73,4 @@ class GridFsClient(object):
 
 
 class GridFSPath(BasePath):
-    pass
+    __slots__ = ()
@@ -1,9 +1,11 @@
 '''Module for handling NFS paths'''
 import libnfs
 
-from .base import BasePath, BaseClient
+from .base import BasePath, BaseClient, DirEntry, make_stat, use_dir_entry
+from .streams import DEFAULT_READAHEAD, ResumableReader, open_reader
 
 import datetime
+from functools import partial
 
 
 class NFSClient(libnfs.NFS, BaseClient):
@@ -11,19 +13,73 @@ class NFSClient(libnfs.NFS, BaseClient):
         BaseClient.__init__(self, uri or 'nfs://', **kwargs)
         libnfs.NFS.__init__(self, uri)
 
+    def open(self, path, mode='r', readahead=DEFAULT_READAHEAD, **kwargs):
+        if mode in ('r', 'rb'):
+            raw = ResumableReader(partial(self._open_at, path),
+                                  size=partial(self._size, path),
+                                  name=path, chunk_size=readahead)
+            return open_reader(raw, mode, buffer_size=readahead, **kwargs)
+        return libnfs.NFS.open(self, path, mode, **kwargs)
+
+    def _open_at(self, path, offset):
+        handle = libnfs.NFS.open(self, path, 'r')
+        handle.seek(offset)
+        return handle
+
+    def _size(self, path):
+        return self.stat(path)['size']
+
+    def read_range(self, path, offset, length):
+        handle = self._open_at(path, offset)
+        try:
+            return handle.read(length)
+        finally:
+            handle.close()
+
+    def scandir(self, path):
+        '''Yields a `DirEntry` for each file and directory in `path`. NFS
+        listings carry no attributes, so each entry is stat'ed while the
+        connection is still held (`NFSPath.iterdir` defers this instead).'''
+        for name in self.listdir(path):
+            if name in ('.', '..'):
+                continue
+            child = path.rstrip('/') + '/' + name
+            yield DirEntry(name, child, None, _stat_result(self, child))
+
+
+def _stat_result(session, path):
+    st = session.stat(path)
+    return make_stat(st['size'], st['mtime']['sec'], mode=st['mode'],
+                     atime=st['atime']['sec'], ctime=st['ctime']['sec'],
+                     uid=st['uid'], gid=st['gid'])
+
 
 class NFSPath(BasePath):
     '''A Network File Share Path'''
+    __slots__ = ()
     SESSION_FACTORY = NFSClient
 
-    def __init__(self, uri, session=None, **kwargs):
-        BasePath.__init__(uri, session, **kwargs)
-        if not session:
-            self.session = self.SESSION_FACTORY(uri, **kwargs)
+    def _create_session(self):
+        return self.SESSION_FACTORY(self.uri, **self._session_kwargs())
+
+    def iterdir(self):
+        '''Iterate over the files in this directory. Their attributes are
+        only fetched on first use, through this path's (pooled) session, as
+        NFS listings carry none.'''
+        for name in self.session.listdir(self.path):
+            if name in ('.', '..'):
+                continue
+            child = self.joinpath(name)
+            child._dir_entry = DirEntry(name, child.path, None,
+                                        partial(_stat_result, self.session,
+                                                child.path))
+            yield child
 
+    @use_dir_entry
     def is_file(self):
         return self.session.isfile(self.path)
 
+    @use_dir_entry
     def is_dir(self):
         return self.session.isdir(self.path)
 
@@ -0,0 +1,513 @@
+'''Process-wide pool of remote sessions shared between path objects'''
+import socket
+import threading
+import time
+import types
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+DEFAULT_TIMEOUT = 60
+
+
+class PoolTimeout(Exception):
+    '''Raised when no pooled connection becomes available in time'''
+    pass
+
+
+class ConnectionPool(object):
+    '''Thread-safe pool of client sessions with checkout/return semantics
+
+    Connections are grouped by key, typically
+    ``(scheme, host, port, username, credentials)``, so that every path
+    pointing at the same server with the same login shares the same sessions.
+    A checked out connection is used exclusively by a single thread until it
+    is returned.
+
+    Arguments
+    ---------
+    max_size: maximum number of connections per key (host)
+    idle_timeout: seconds after which idle connections are closed
+    keepalive_interval: seconds between keep-alive pings of idle
+        connections, or None to disable the background keep-alive thread
+    timeout: seconds to wait for a free connection before raising
+        `PoolTimeout`, or None to wait forever
+
+    page_size: number of entries a listing reads per checkout of its
+        connection
+
+    A thread which already holds every connection of a key, e.g. through
+    nested ``open()`` calls, gets a `PoolTimeout` at once rather than
+    waiting for itself.
+    '''
+    def __init__(self, max_size=4, idle_timeout=300, keepalive_interval=60,
+                 timeout=DEFAULT_TIMEOUT, page_size=1000):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.page_size = page_size
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = defaultdict(deque)  # key -> deque of (conn, last_used)
+        self._size = defaultdict(int)  # key -> open connections (incl. busy)
+        self._keys = {}  # id(conn) -> key
+        self._owners = {}  # id(conn) -> ident of the thread holding it
+        self._pinned = defaultdict(int)  # id(conn) -> unfinished listings
+        self._keepalive_thread = None
+        self._closed = threading.Event()
+
+    def __len__(self):
+        with self._cond:
+            return sum(self._size.values())
+
+    def acquire(self, key, factory):
+        '''Checkout a connection for `key`, creating it with `factory`
+        if there is no idle connection and the pool for `key` is not full'''
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        expired = []
+        try:
+            with self._cond:
+                while True:
+                    expired.extend(self._evict_expired(key))
+                    idle = self._idle[key]
+                    if idle:
+                        conn, _ = idle.pop()  # most recently used first
+                        self._owners[id(conn)] = threading.get_ident()
+                        return conn
+                    if self._size[key] < self.max_size:
+                        self._size[key] += 1
+                        break
+                    if self._held_by_caller(key):
+                        raise PoolTimeout(
+                            'All {} connections to {} are checked out by '
+                            'this thread; close open files or listings '
+                            'first or raise max_size'.format(
+                                self.max_size, self._describe(key)))
+                    remaining = (None if deadline is None
+                                 else deadline - time.time())
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout('No connection available for '
+                                          '{}'.format(self._describe(key)))
+                    self._cond.wait(remaining)
+        finally:
+            for old in expired:
+                _close(old)
+        try:
+            conn = factory()
+        except BaseException:
+            with self._cond:
+                self._size[key] -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._keys[id(conn)] = key
+            self._owners[id(conn)] = threading.get_ident()
+        self._start_keepalive()
+        return conn
+
+    def reacquire(self, conn):
+        '''Checkout `conn` again once it is idle, e.g. to read the next page
+        of a listing started on it'''
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._cond:
+            while True:
+                key = self._keys.get(id(conn))
+                if key is None:
+                    raise ConnectionError('Pooled connection was closed '
+                                          'while a listing was being read')
+                idle = self._idle[key]
+                for item in idle:
+                    if item[0] is conn:
+                        idle.remove(item)
+                        self._owners[id(conn)] = threading.get_ident()
+                        return conn
+                if self._owners.get(id(conn)) == threading.get_ident():
+                    raise PoolTimeout(
+                        'The connection to {} of this listing is checked out '
+                        'by this thread; close open files first'.format(
+                            self._describe(key)))
+                remaining = (None if deadline is None
+                             else deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout('Connection to {} of this listing did '
+                                      'not become available'.format(
+                                          self._describe(key)))
+                self._cond.wait(remaining)
+
+    def pin(self, conn):
+        '''Keep `conn` from being evicted while idle, until `unpin`'''
+        with self._cond:
+            self._pinned[id(conn)] += 1
+
+    def unpin(self, conn):
+        with self._cond:
+            self._pinned[id(conn)] -= 1
+            if self._pinned[id(conn)] <= 0:
+                del self._pinned[id(conn)]
+
+    def release(self, conn, discard=False):
+        '''Return a checked out connection to the pool, closing it instead
+        if `discard` is set (e.g. after a connection error)'''
+        with self._cond:
+            key = self._keys.get(id(conn))
+            if key is None:
+                return
+            self._owners.pop(id(conn), None)
+            if discard or self._closed.is_set():
+                self._forget(conn, key)
+            else:
+                self._idle[key].append((conn, time.time()))
+            self._cond.notify()
+        if discard or self._closed.is_set():
+            _close(conn)
+
+    @contextmanager
+    def connection(self, key, factory):
+        '''Context manager which checks out a connection and returns it
+        afterwards, discarding it if it failed with a connection error'''
+        conn = self.acquire(key, factory)
+        try:
+            yield conn
+        except Exception as err:
+            self.release(conn, discard=_is_connection_error(err))
+            raise
+        else:
+            self.release(conn)
+
+    def session(self, key, factory):
+        '''Returns a lazy `PooledSession` proxy for `key`'''
+        return PooledSession(self, key, factory)
+
+    def evict_idle(self, max_idle=None):
+        '''Close connections idle for longer than `max_idle` seconds
+        (defaults to `idle_timeout`) and return how many were closed'''
+        with self._cond:
+            expired = []
+            for key in list(self._idle):
+                expired.extend(self._evict_expired(key, max_idle))
+        for conn in expired:
+            _close(conn)
+        return len(expired)
+
+    def keepalive(self):
+        '''Ping idle connections, dropping any which no longer respond'''
+        with self._cond:
+            # checkout every idle connection so no other thread can use it
+            idle = [(key, item) for key, conns in self._idle.items()
+                    for item in conns]
+            for conns in self._idle.values():
+                conns.clear()
+        alive = defaultdict(list)
+        for key, item in idle:
+            if _ping(item[0]):
+                alive[key].append(item)
+            else:
+                _close(item[0])
+        with self._cond:
+            for key, item in idle:
+                if item not in alive[key] or self._closed.is_set():
+                    self._forget(item[0], key)
+            if not self._closed.is_set():
+                for key, items in alive.items():
+                    # keep the deque ordered from least to most recently used
+                    merged = sorted(items + list(self._idle[key]),
+                                    key=lambda item: item[1])
+                    self._idle[key] = deque(merged)
+            self._cond.notify_all()
+        if self._closed.is_set():
+            for items in alive.values():
+                for conn, _ in items:
+                    _close(conn)
+
+    def clear(self):
+        '''Close all idle connections. Busy connections are closed when
+        they are returned.'''
+        with self._cond:
+            idle = [conn for conns in self._idle.values() for conn, _ in conns]
+            for conn in idle:
+                self._forget(conn, self._keys.get(id(conn)))
+            self._idle.clear()
+        for conn in idle:
+            _close(conn)
+
+    def close(self):
+        '''Close the pool and all of its idle connections'''
+        self._closed.set()
+        self.clear()
+
+    def _evict_expired(self, key, max_idle=None):
+        # must be called with the lock held; caller closes the connections
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        expired = []
+        idle = self._idle.get(key)
+        if max_idle is None or not idle:
+            return expired
+        now = time.time()
+        kept = []
+        while idle and now - idle[0][1] > max_idle:  # oldest on the left
+            conn, last_used = idle.popleft()
+            if id(conn) in self._pinned:  # an unfinished listing needs it
+                kept.append((conn, last_used))
+                continue
+            self._forget(conn, key)
+            expired.append(conn)
+        idle.extendleft(reversed(kept))
+        return expired
+
+    def _held_by_caller(self, key):
+        # must be called with the lock held and the pool for `key` full
+        busy = self._size[key] - len(self._idle[key])
+        ident = threading.get_ident()
+        return busy > 0 and busy == sum(
+            1 for conn_id, owner in self._owners.items()
+            if owner == ident and self._keys.get(conn_id) == key)
+
+    def _forget(self, conn, key):
+        self._keys.pop(id(conn), None)
+        self._owners.pop(id(conn), None)
+        if key is not None:
+            self._size[key] -= 1
+
+    def _start_keepalive(self):
+        if not self.keepalive_interval or self._keepalive_thread is not None:
+            return
+        with self._cond:
+            if self._keepalive_thread is not None:
+                return
+            thread = threading.Thread(target=self._keepalive_loop,
+                                      name='smartpath-pool-keepalive')
+            thread.daemon = True
+            self._keepalive_thread = thread
+        thread.start()
+
+    def _keepalive_loop(self):
+        while not self._closed.wait(self.keepalive_interval):
+            self.evict_idle()
+            self.keepalive()
+
+    @staticmethod
+    def _describe(key):
+        # avoid leaking credentials into error messages
+        return repr(tuple(key[:3])) if isinstance(key, tuple) else repr(key)
+
+
+class PooledSession(object):
+    '''Lazy session proxy which checks out a pooled connection per call
+
+    No connection is made until the first method call. Context managers
+    (e.g. ``open()``) keep their connection checked out until they are
+    closed. Generators (e.g. ``scandir()``) are read ``page_size`` entries
+    at a time, returning the connection between pages, so that a listing
+    being iterated holds no connection and nested calls, e.g. a recursive
+    ``iterdir()``, cannot exhaust the pool.
+    '''
+    def __init__(self, pool, key, factory):
+        self._pool = pool
+        self._key = key
+        self._factory = factory
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               self._pool._describe(self._key))
+
+    @property
+    def pool_key(self):
+        return self._key
+
+    @contextmanager
+    def connection(self):
+        '''Checkout the underlying connection for several calls'''
+        with self._pool.connection(self._key, self._factory) as conn:
+            yield conn
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        conn_type = self.__dict__.get('_conn_type')
+        if conn_type is not None and callable(getattr(conn_type, name, None)):
+            return _PooledMethod(self, name)  # no checkout needed for methods
+        with self.connection() as conn:
+            self._conn_type = type(conn)
+            attr = getattr(conn, name)
+        return _PooledMethod(self, name) if callable(attr) else attr
+
+
+class _PooledMethod(object):
+    '''Bound method of a `PooledSession` run on a checked out connection'''
+    def __init__(self, session, name):
+        self._session = session
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        pool = self._session._pool
+        conn = pool.acquire(self._session._key, self._session._factory)
+        try:
+            result = getattr(conn, self.__name__)(*args, **kwargs)
+        except Exception as err:
+            pool.release(conn, discard=_is_connection_error(err))
+            raise
+        if isinstance(result, types.GeneratorType):
+            pool.release(conn)
+            return _PagedIterator(pool, conn, result)
+        if (hasattr(result, '__enter__') and hasattr(result, '__exit__') and
+                result is not conn):
+            return _ReleasingContext(pool, conn, result)
+        pool.release(conn)
+        return result
+
+
+class _PagedIterator(object):
+    '''Reads a generator run on a pooled connection a page at a time,
+    checking the same connection out only while a page is being read'''
+    def __init__(self, pool, conn, generator):
+        self._pool = pool
+        self._conn = conn
+        self._generator = generator
+        self._page = deque()
+        self._done = False
+        pool.pin(conn)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._page and not self._done:
+            self._read_page()
+        if not self._page:
+            raise StopIteration
+        return self._page.popleft()
+
+    next = __next__  # python 2
+
+    def _read_page(self):
+        pool, conn = self._pool, self._conn
+        try:
+            pool.reacquire(conn)
+        except Exception:
+            self._finish()
+            raise
+        try:
+            for _ in range(pool.page_size):
+                self._page.append(next(self._generator))
+        except StopIteration:
+            pool.release(conn)
+            self._finish()
+        except Exception as err:
+            pool.release(conn, discard=_is_connection_error(err))
+            self._finish()
+            raise
+        else:
+            pool.release(conn)
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._pool.unpin(self._conn)
+
+    def close(self):
+        if not self._done:
+            self._generator.close()
+        self._finish()
+
+    def __del__(self):
+        # listings which are dropped before being exhausted
+        self._finish()
+
+
+class _ReleasingContext(object):
+    '''Wraps a context manager or file object so that its pooled connection
+    is returned when it is closed or its ``with`` block exits'''
+    def __init__(self, pool, conn, wrapped):
+        self._pool = pool
+        self._conn = conn
+        self._wrapped = wrapped
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        return iter(self._wrapped)
+
+    def __enter__(self):
+        return self._wrapped.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            return self._wrapped.__exit__(*exc_info)
+        finally:
+            self._release()
+
+    def close(self):
+        try:
+            close = getattr(self._wrapped, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def __del__(self):
+        # streams which are dropped without being closed
+        self._release()
+
+
+def _is_connection_error(err):
+    '''Whether `err` means the connection itself is no longer usable'''
+    if isinstance(err, (EOFError, socket.timeout, ConnectionError)):
+        return True
+    return type(err).__name__ in ('SSHException', 'error_temp', 'error_proto',
+                                  'TemporaryError')
+
+
+def _ping(conn):
+    '''Best-effort liveness check using whichever keep-alive the client has'''
+    try:
+        for name in ('keep_alive', 'keepalive', 'noop'):
+            ping = getattr(conn, name, None)
+            if callable(ping):
+                ping()
+                return True
+        transport = getattr(conn, '_transport', None)
+        if transport is not None and hasattr(transport, 'is_active'):
+            return transport.is_active()
+    except Exception:
+        return False
+    return True
+
+
+def _close(conn):
+    try:
+        close = getattr(conn, 'close', None)
+        if callable(close):
+            close()
+    except Exception:
+        pass
+
+
+_DEFAULT_POOL = None
+_DEFAULT_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    '''Returns the process-wide connection pool, creating it if needed'''
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None:
+        with _DEFAULT_POOL_LOCK:
+            if _DEFAULT_POOL is None:
+                _DEFAULT_POOL = ConnectionPool()
+    return _DEFAULT_POOL
+
+
+def set_pool(pool):
+    '''Replaces the process-wide connection pool, closing the old one'''
+    global _DEFAULT_POOL
+    with _DEFAULT_POOL_LOCK:
+        old, _DEFAULT_POOL = _DEFAULT_POOL, pool
+    if old is not None and old is not pool:
+        old.close()
+    return pool
@@ -0,0 +1,471 @@
+'''Round-trip profiler attributing protocol requests to path methods
+
+Within ``with smartpath.profile() as report:`` every request sent by the
+underlying libraries (HTTP requests of the Azure SDK, WebDAV and S3, FTP
+commands and SFTP packets) is attributed to the outermost `BasePath`
+method running in the same thread, e.g. ``iterdir`` or ``stat``::
+
+    with smartpath.profile() as report:
+        for path in directory.iterdir():
+            path.stat()
+    print(report)
+
+The report lists the round trips and bytes of each method and flags N+1
+access patterns (see `ProfileReport.patterns`). Requests sent by worker
+threads (e.g. of a parallel ``glob``) are attributed to the path methods
+those threads call. Bytes sent over FTP data connections are not counted.
+'''
+import posixpath
+import threading
+import time
+import types
+
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+from .base import BasePath
+
+# BasePath methods which may make requests
+PATH_METHODS = ('exists', 'is_dir', 'is_file', 'is_symlink', 'stat',
+                'lstat', 'owner', 'group', 'iterdir', 'glob', 'rglob',
+                'walk', 'rwalk', 'open', 'read_bytes', 'read_text',
+                'read_range', 'write_bytes', 'write_text', 'mmap', 'mkdir',
+                'rmdir', 'unlink', 'touch', 'rename', 'replace', 'chmod',
+                'samefile')
+LISTING_METHODS = ('iterdir', 'glob', 'rglob', 'walk', 'rwalk')
+METADATA_METHODS = ('exists', 'is_dir', 'is_file', 'is_symlink', 'stat',
+                    'lstat', 'owner', 'group')
+FTP_LISTINGS = ('LIST', 'NLST', 'MLSD')
+SFTP_LISTINGS = ('opendir', 'readdir')
+SFTP_HANDLE_COMMANDS = ('close', 'read', 'write', 'readdir', 'fstat',
+                        'fsetstat')
+DEFAULT_THRESHOLD = 10
+
+RoundTrip = namedtuple('RoundTrip', ['protocol', 'request', 'target',
+                                     'bytes_in', 'bytes_out', 'seconds',
+                                     'listing'])
+RoundTrip.__doc__ = '''A request sent to a server; `listing` is whether it
+lists a directory and `seconds` is None where the reply is asynchronous'''
+
+Pattern = namedtuple('Pattern', ['kind', 'method', 'directory', 'calls',
+                                 'round_trips', 'message'])
+Pattern.__doc__ = '''An N+1 access pattern: `kind` is 'per-entry' (one call
+per entry of `directory`) or 'listing-fallback' (metadata calls which each
+list a directory)'''
+
+
+class Call(object):
+    '''A top-level call of a `BasePath` method and its round trips'''
+    __slots__ = ('method', 'path', 'round_trips')
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.round_trips = []
+
+    def __repr__(self):
+        return '{}({}, {!r}, round_trips={})'.format(
+            self.__class__.__name__, self.method, self.path,
+            len(self.round_trips))
+
+    @property
+    def bytes_in(self):
+        return sum(rt.bytes_in for rt in self.round_trips)
+
+    @property
+    def bytes_out(self):
+        return sum(rt.bytes_out for rt in self.round_trips)
+
+
+class ProfileReport(object):
+    '''Round trips recorded by `profile()`
+
+    `calls` lists the top-level `Call` of each path method in order and
+    `unattributed` the round trips made outside of any path method.
+    '''
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.calls = []
+        self.unattributed = []
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return self.format()
+
+    @property
+    def round_trips(self):
+        return sum(len(call.round_trips) for call in self.calls) + \
+            len(self.unattributed)
+
+    def summary(self):
+        '''Dictionary of totals by method: calls, round_trips, bytes_in and
+        bytes_out'''
+        totals = {}
+        for call in self.calls:
+            total = totals.setdefault(call.method, dict(
+                calls=0, round_trips=0, bytes_in=0, bytes_out=0))
+            total['calls'] += 1
+            total['round_trips'] += len(call.round_trips)
+            total['bytes_in'] += call.bytes_in
+            total['bytes_out'] += call.bytes_out
+        return totals
+
+    def patterns(self, threshold=None):
+        '''N+1 access patterns, as a list of `Pattern`:
+
+        - 'per-entry': at least `threshold` calls of the same metadata
+          method (e.g. ``stat``), each making requests, on the entries of
+          one directory; typically after listing it with ``iterdir``, whose
+          paths already carry the metadata of the listing
+        - 'listing-fallback': at least `threshold` metadata calls which
+          each listed a directory, as backends without a native ``stat``
+          or ``exists`` do
+        '''
+        threshold = threshold or self.threshold
+        listed = {}  # directory -> (index, method) of its first listing
+        entries = {}  # (method, parent) -> [(index, call)]
+        fallbacks = {}  # method -> [call]
+        for index, call in enumerate(self.calls):
+            if call.method in LISTING_METHODS:
+                listed.setdefault(call.path.rstrip('/'), (index, call.method))
+            elif call.method in METADATA_METHODS and call.round_trips:
+                parent = posixpath.dirname(call.path.rstrip('/'))
+                entries.setdefault((call.method, parent), []).append(
+                    (index, call))
+                if any(rt.listing for rt in call.round_trips):
+                    fallbacks.setdefault(call.method, []).append(call)
+        found = []
+        for (method, directory), group in entries.items():
+            if len(group) < threshold:
+                continue
+            trips = sum(len(call.round_trips) for _, call in group)
+            listing = _listing_of(listed, directory, group[0][0])
+            if listing:
+                message = ('{} {}() calls on entries of {} after {}() made {}'
+                           ' round trips; use the metadata of the paths {}()'
+                           ' yields').format(len(group), method, directory,
+                                             listing, trips, listing)
+            else:
+                message = ('{} {}() calls on entries of {} made {} round '
+                           'trips; list {} once with iterdir() instead'
+                           ).format(len(group), method, directory, trips,
+                                    directory)
+            found.append(Pattern('per-entry', method, directory, len(group),
+                                 trips, message))
+        for method, group in fallbacks.items():
+            if len(group) < threshold:
+                continue
+            trips = sum(len(call.round_trips) for call in group)
+            message = ('{} {}() calls each listed a directory ({} round '
+                       'trips); list the directory once and look the names '
+                       'up instead').format(len(group), method, trips)
+            found.append(Pattern('listing-fallback', method, None, len(group),
+                                 trips, message))
+        return found
+
+    def format(self):
+        '''The report as text'''
+        lines = ['{} round trips in {} path calls ({} unattributed)'.format(
+            self.round_trips, len(self.calls), len(self.unattributed))]
+        summary = sorted(self.summary().items(),
+                         key=lambda item: -item[1]['round_trips'])
+        if summary:
+            lines.append('{:12} {:>8} {:>12} {:>12} {:>12}'.format(
+                'method', 'calls', 'round trips', 'bytes in', 'bytes out'))
+            for method, total in summary:
+                lines.append('{:12} {calls:8} {round_trips:12} {bytes_in:12} '
+                             '{bytes_out:12}'.format(method, **total))
+        patterns = self.patterns()
+        if patterns:
+            lines.append('N+1 patterns:')
+            lines.extend('  - ' + pattern.message for pattern in patterns)
+        return '\n'.join(lines)
+
+    def _start(self, method, path):
+        call = Call(method, path.path or '/')
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def _add(self, call, round_trip):
+        with self._lock:
+            (call.round_trips if call else self.unattributed).append(
+                round_trip)
+
+
+_active = None  # the report being recorded
+_active_lock = threading.Lock()
+_local = threading.local()
+
+
+@contextmanager
+def profile(threshold=DEFAULT_THRESHOLD):
+    '''Records the round trips made within the block, yielding a
+    `ProfileReport`; N+1 patterns are flagged from `threshold` calls.
+    Only one profile can be recorded at a time.'''
+    global _active
+    with _active_lock:
+        if _active is not None:
+            raise RuntimeError('smartpath.profile() is already recording')
+        _active = report = ProfileReport(threshold)
+    patches = []
+    try:
+        patches.extend(_patch_paths())
+        for patch in PROTOCOL_PATCHES:
+            try:
+                patches.append(patch())
+            except ImportError:
+                pass  # library not installed
+        yield report
+    finally:
+        for cls, name, original in reversed(patches):
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        with _active_lock:
+            _active = None
+
+
+def record(protocol, request, target, bytes_in=0, bytes_out=0, seconds=None,
+           listing=False):
+    '''Records a round trip in the active profile, if any; for clients
+    using libraries which are not patched by `profile()`'''
+    report = _active
+    if report is not None:
+        report._add(_current(), RoundTrip(protocol, request, target, bytes_in,
+                                          bytes_out, seconds, listing))
+
+
+def _current():
+    stack = getattr(_local, 'stack', None)
+    return stack[0] if stack else None
+
+
+@contextmanager
+def _frame(call):
+    # calls nested within another path method are attributed to it
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(call)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def _listing_of(listed, directory, before):
+    for listed_dir, (index, method) in listed.items():
+        if index < before and (directory == listed_dir or
+                               directory.startswith(listed_dir + '/')):
+            return method
+    return None
+
+
+# BasePath methods
+
+def _patch_paths():
+    '''Wraps the path methods of BasePath and its subclasses'''
+    patches = []
+    classes = [BasePath]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        for name in PATH_METHODS:
+            func = cls.__dict__.get(name)
+            if isinstance(func, types.FunctionType):
+                setattr(cls, name, _traced(func, name))
+                patches.append((cls, name, func))
+    return patches
+
+
+def _traced(func, method):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        report = _active
+        if report is None or _current() is not None:
+            return func(self, *args, **kwargs)
+        call = report._start(method, self)
+        with _frame(call):
+            result = func(self, *args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return _TracedIterator(result, call)
+        if (hasattr(result, 'read') or hasattr(result, 'write') or
+                hasattr(result, '__enter__')):
+            return _TracedFile(result, call)
+        return result
+    return wrapper
+
+
+class _TracedIterator(object):
+    '''Attributes the requests made while iterating to `call`'''
+    def __init__(self, iterator, call):
+        self._iterator = iterator
+        self._call = call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if _current() is not None:
+            return next(self._iterator)
+        with _frame(self._call):
+            return next(self._iterator)
+
+    next = __next__  # python 2
+
+    def close(self):
+        self._iterator.close()
+
+
+class _TracedFile(object):
+    '''Attributes the requests made through a file object or context
+    manager, e.g. of ``open()``, to `call`'''
+    def __init__(self, wrapped, call):
+        self._wrapped = wrapped
+        self._call = call
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def traced(*args, **kwargs):
+            with _frame(self._call):
+                return attr(*args, **kwargs)
+        return traced
+
+    def __iter__(self):
+        return _TracedIterator(iter(self._wrapped), self._call)
+
+    def __enter__(self):
+        with _frame(self._call):
+            entered = self._wrapped.__enter__()
+        if entered is self._wrapped:
+            return self
+        if hasattr(entered, 'read') or hasattr(entered, 'write'):
+            return _TracedFile(entered, self._call)  # e.g. a yielded stream
+        return entered
+
+    def __exit__(self, *exc_info):
+        with _frame(self._call):
+            return self._wrapped.__exit__(*exc_info)
+
+
+# protocol libraries; each patch returns (class, name, original or None)
+
+def _patch(cls, name, make_wrapper):
+    original = cls.__dict__.get(name)
+    setattr(cls, name, wraps(getattr(cls, name))(
+        make_wrapper(getattr(cls, name))))
+    return cls, name, original
+
+
+def _timed(func, on_done):
+    '''Calls `func`, then ``on_done(result, seconds)`` even if it failed'''
+    start = time.perf_counter()
+    result = None
+    try:
+        result = func()
+        return result
+    finally:
+        on_done(result, time.perf_counter() - start)
+
+
+def _patch_requests():
+    import requests
+
+    def make_wrapper(request):
+        def wrapper(session, method, url, *args, **kwargs):
+            def done(response, seconds):
+                headers = kwargs.get('headers') or {}
+                listing = (method.upper() == 'PROPFIND' and
+                           str(headers.get('Depth', '1')) != '0') or \
+                    'comp=list' in url or 'list-type=' in url
+                record('http', method.upper(), url.split('?')[0],
+                       _response_size(response, kwargs.get('stream')),
+                       _size(kwargs.get('data')), seconds, listing)
+            return _timed(lambda: request(session, method, url, *args,
+                                          **kwargs), done)
+        return wrapper
+    return _patch(requests.Session, 'request', make_wrapper)
+
+
+def _patch_botocore():
+    from botocore.endpoint import Endpoint
+
+    def make_wrapper(send):
+        def wrapper(endpoint, request):
+            def done(response, seconds):
+                record('http', request.method, request.url.split('?')[0],
+                       _response_size(response, True), _size(request.body),
+                       seconds, 'list-type=' in request.url)
+            return _timed(lambda: send(endpoint, request), done)
+        return wrapper
+    return _patch(Endpoint, '_send', make_wrapper)
+
+
+def _ftp_wrapper(command):
+    def wrapper(ftp, cmd):
+        verb = cmd.split(' ', 1)[0].upper()
+        target = '****' if verb == 'PASS' else cmd[len(verb) + 1:]
+
+        def done(response, seconds):
+            record('ftp', verb, target, 0, 0, seconds, verb in FTP_LISTINGS)
+        return _timed(lambda: command(ftp, cmd), done)
+    return wrapper
+
+
+def _patch_ftplib():
+    import ftplib
+    return _patch(ftplib.FTP, 'sendcmd', _ftp_wrapper)
+
+
+def _patch_ftplib_voidcmd():
+    # voidcmd() does not go through sendcmd(), e.g. for CWD, MKD and TYPE
+    import ftplib
+    return _patch(ftplib.FTP, 'voidcmd', _ftp_wrapper)
+
+
+def _patch_paramiko():
+    from paramiko import SFTPClient
+    from paramiko.sftp import CMD_NAMES
+
+    def make_wrapper(async_request):
+        def wrapper(client, fileobj, t, *args):
+            name = CMD_NAMES.get(t, str(t))
+            target = ''  # the arguments of some commands are handles
+            if args and name not in SFTP_HANDLE_COMMANDS:
+                target = args[0]
+                if isinstance(target, bytes):
+                    target = target.decode('utf8', 'replace')
+            record('sftp', name, str(target), 0,
+                   _size(args[-1]) if name == 'write' else 0, None,
+                   name in SFTP_LISTINGS)
+            return async_request(client, fileobj, t, *args)
+        return wrapper
+    return _patch(SFTPClient, '_async_request', make_wrapper)
+
+
+PROTOCOL_PATCHES = [_patch_requests, _patch_botocore, _patch_ftplib,
+                    _patch_ftplib_voidcmd, _patch_paramiko]
+
+
+def _response_size(response, stream):
+    if response is None:
+        return 0
+    length = getattr(response, 'headers', {}).get('Content-Length')
+    if length is not None:
+        return int(length)
+    if not stream:
+        return len(getattr(response, 'content', b'') or b'')
+    return 0
+
+
+def _size(data):
+    if isinstance(data, (bytes, bytearray, str)):
+        return len(data)
+    return 0
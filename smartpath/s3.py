@@ -78,8 +78,12 @@ class S3Client(BaseClient):
 
 
 class S3Path(BasePath):
+    __slots__ = ()
     SESSION_FACTORY = S3Client
 
     def __init__(self, uri, session=None):
-        super(BasePath, self).__init__(uri, session)
+        BasePath.__init__(self, uri, session)
         # TODO - implement S3 specific features
+
+    def _create_session(self):
+        return self.SESSION_FACTORY(self.uri)
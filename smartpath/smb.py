@@ -2,11 +2,13 @@
 # -*- coding: utf8 -*-
 import smbclient
 
-from .base import BaseClient, BasePath
+from .base import BaseClient, BasePath, Capabilities, DirEntry, make_stat
 
 
 class SambaClient(smbclient.SambaClient, BaseClient):
     '''Samba client for connecting to Windows/CIFS shares'''
+    CAPABILITIES = Capabilities(rename=True, copy=False)
+
     def __init__(self, **kwargs):
         BaseClient.__init__(self, uri=kwargs.pop('uri', 'smb://'), **kwargs)
 
@@ -21,7 +23,8 @@ class SambaClient(smbclient.SambaClient, BaseClient):
                      'ip', 'buffer_size', 'debug_level', 'config_file',
                      'logdir', 'netbios_name', 'workgroup')])
 
-        smbclient.SambaClient(
+        smbclient.SambaClient.__init__(
+            self,
             server=resolve('server') or resolve('hostname'),
             share=resolve('share') or self.getshare(),
             kerberos=resolve('kerberos', False),
@@ -46,14 +49,20 @@ class SambaClient(smbclient.SambaClient, BaseClient):
         return self.isdir(path)
 
     def scandir(self, path):
-        return (p for p in self.listdir(path))
+        '''Yields a `DirEntry` for each file and directory in `path`, with
+        the size and modification date of the listing'''
+        for name, modes, size, date in self.lsdir(path):
+            if name in ('.', '..'):
+                continue
+            is_dir = 'D' in modes
+            yield DirEntry(name, path.rstrip('/') + '/' + name, is_dir,
+                           make_stat(size, date, is_dir))
 
 
 class SambaPath(BasePath):
     '''Samba/Windows share path'''
+    __slots__ = ()
     SESSION_FACTORY = SambaClient
 
-    def __init__(self, uri, session=None, **kwargs):
-        BasePath.__init__(self, uri, session, **kwargs)
-        if not session:
-            self.session = self.SESSION_FACTORY(uri=uri, **kwargs)
+    def _create_session(self):
+        return self.SESSION_FACTORY(uri=self.uri, **self._session_kwargs())
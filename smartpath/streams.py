@@ -0,0 +1,422 @@
+'''Lazy, seekable file objects for remote paths'''
+import io
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_READAHEAD = 1024 * 1024  # bytes fetched per round trip
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024  # bytes uploaded per block
+
+
+class RangedReader(io.RawIOBase):
+    '''Seekable read-only stream which fetches byte ranges on demand
+
+    Arguments
+    ---------
+    fetch: callable(offset, length) returning up to `length` bytes from
+        `offset`, which may return fewer bytes only at the end of the file
+    size: size in bytes, or a callable returning it which is only called
+        when it is needed (e.g. seeking relative to the end)
+    name: name of the stream, e.g. the remote path
+    chunk_size: maximum bytes per fetch when reading to the end of file
+    '''
+    def __init__(self, fetch, size=None, name=None,
+                 chunk_size=DEFAULT_READAHEAD):
+        super(RangedReader, self).__init__()
+        self._fetch = fetch
+        self._size = size
+        self._pos = 0
+        self.name = name
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        return '<{} name={!r}>'.format(self.__class__.__name__, self.name)
+
+    @property
+    def size(self):
+        '''Size of the file, which may require a metadata request'''
+        if callable(self._size):
+            self._size = self._size()
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def _clamp(self, length):
+        # only use the size if known, rather than fetching it
+        if self._size is not None and not callable(self._size):
+            length = min(length, max(self._size - self._pos, 0))
+        return length
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        length = self._clamp(len(buffer))
+        if length <= 0:
+            return 0
+        data = self._fetch(self._pos, length)
+        n = len(data)
+        memoryview(buffer).cast('B')[:n] = data
+        self._pos += n
+        return n
+
+    def readall(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        chunks = []
+        while True:
+            length = self._clamp(self.chunk_size)
+            if length <= 0:
+                break
+            data = self._fetch(self._pos, length)
+            if not data:
+                break
+            self._pos += len(data)
+            chunks.append(data)
+        return b''.join(chunks)
+
+
+class ResumableReader(RangedReader):
+    '''Seekable read-only stream over a sequential transfer
+
+    The transfer is opened lazily at the current position and kept open
+    while reads are sequential. It is only seeked, or reopened at the new
+    offset (e.g. with FTP ``REST`` or a HTTP ``Range`` header), when the
+    position jumps.
+
+    Arguments
+    ---------
+    open_at: callable(offset) returning a file-like object with
+        ``read(n)`` and ``close()``, positioned at `offset`
+    '''
+    def __init__(self, open_at, size=None, name=None,
+                 chunk_size=DEFAULT_READAHEAD):
+        super(ResumableReader, self).__init__(self._read_at, size, name,
+                                              chunk_size)
+        self._open_at = open_at
+        self._stream = None
+        self._stream_pos = None
+
+    def _read_at(self, offset, length):
+        if self._stream is not None and self._stream_pos != offset:
+            if _can_seek(self._stream):
+                self._stream.seek(offset)
+                self._stream_pos = offset
+            else:
+                self._close_stream()
+        if self._stream is None:
+            self._stream = self._open_at(offset)
+            self._stream_pos = offset
+        data = self._stream.read(length)
+        self._stream_pos += len(data)
+        return bytes(data)
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.close()
+
+    def close(self):
+        try:
+            self._close_stream()
+        finally:
+            super(ResumableReader, self).close()
+
+
+class BlockWriter(io.RawIOBase):
+    '''Write-only stream which uploads fixed size blocks concurrently
+
+    Blocks are uploaded by a bounded pool of workers while the caller is
+    still writing, and committed in order when the stream is closed.
+    Writes block once `max_pending` blocks are in flight, so memory use is
+    bounded by ``max_pending * block_size`` regardless of the file size.
+
+    Arguments
+    ---------
+    put_block: callable(block_id, data) uploading a single block
+    commit: callable(block_ids) committing the uploaded blocks in order
+    block_size: size of each block (except the last) in bytes
+    max_workers: number of concurrent block uploads
+    max_pending: maximum number of blocks in flight, defaults to twice
+        `max_workers`
+    block_id: callable(index) returning the id of the index'th block
+    name: name of the stream, e.g. the remote path
+    '''
+    def __init__(self, put_block, commit, block_size=DEFAULT_BLOCK_SIZE,
+                 max_workers=4, max_pending=None, block_id=str, name=None):
+        super(BlockWriter, self).__init__()
+        self._put_block = put_block
+        self._commit = commit
+        self._block_id = block_id
+        self.block_size = block_size
+        self.name = name
+        self._buffer = bytearray()
+        self._block_ids = []
+        self._futures = set()
+        self._slots = threading.Semaphore(max_pending or 2 * max_workers)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._aborted = False
+
+    def __repr__(self):
+        return '<{} name={!r}>'.format(self.__class__.__name__, self.name)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        self._raise_failed()
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        self._slots.acquire()  # waits while too many blocks are in flight
+        block_id = self._block_id(len(self._block_ids))
+        self._block_ids.append(block_id)
+        try:
+            future = self._executor.submit(self._put_block, block_id, block)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.add(future)
+
+    def _raise_failed(self):
+        for future in [f for f in self._futures if f.done()]:
+            self._futures.discard(future)
+            future.result()  # re-raises upload errors in the writing thread
+
+    def close(self):
+        '''Upload any remaining data and commit all blocks'''
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                    del self._buffer[:]
+                for future in list(self._futures):
+                    future.result()
+                self._futures.clear()
+                self._commit(list(self._block_ids))
+        finally:
+            for future in self._futures:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            super(BlockWriter, self).close()
+
+    def abort(self):
+        '''Close the stream without committing any of the uploaded blocks'''
+        self._aborted = True
+        self.close()
+
+
+class SpooledWriter(io.RawIOBase):
+    '''Write-only stream which is uploaded whole, in a single request, when
+    it is closed, for servers which cannot take a file in parts (e.g. a
+    WebDAV PUT). Up to `max_size` bytes are kept in memory and any more
+    are spooled to a temporary file.
+
+    Arguments
+    ---------
+    upload: callable(f) uploading the file object `f` from its start
+    max_size: bytes kept in memory before spooling to disk
+    name: name of the stream, e.g. the remote path
+    '''
+    def __init__(self, upload, max_size=DEFAULT_BLOCK_SIZE, name=None):
+        super(SpooledWriter, self).__init__()
+        self._upload = upload
+        self._file = tempfile.SpooledTemporaryFile(max_size)
+        self.name = name
+        self._aborted = False
+
+    def __repr__(self):
+        return '<{} name={!r}>'.format(self.__class__.__name__, self.name)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        self._file.write(data)
+        return len(data)
+
+    def close(self):
+        '''Upload what was written'''
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                self._file.seek(0)
+                self._upload(self._file)
+        finally:
+            self._file.close()
+            super(SpooledWriter, self).close()
+
+    def abort(self):
+        '''Close the stream without uploading it'''
+        self._aborted = True
+        self.close()
+
+
+class FileAdapter(io.RawIOBase):
+    '''Raw stream over a file object from a client library (e.g. a paramiko
+    ``SFTPFile``), so that it can be buffered or wrapped for text like a
+    built-in file
+
+    Arguments
+    ---------
+    f: file-like object supporting read, write and seek as its mode allows
+    mode: mode in which `f` was opened
+    name: name of the stream, e.g. the remote path
+    '''
+    def __init__(self, f, mode='rb', name=None):
+        super(FileAdapter, self).__init__()
+        self._file = f
+        self.mode = mode
+        self.name = name
+
+    def __repr__(self):
+        return '<{} name={!r} mode={!r}>'.format(self.__class__.__name__,
+                                                 self.name, self.mode)
+
+    def readable(self):
+        return 'r' in self.mode or '+' in self.mode
+
+    def writable(self):
+        return bool(set(self.mode) & set('wax+'))
+
+    def seekable(self):
+        return _can_seek(self._file)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._file.seek(offset, whence)
+        return self._file.tell()
+
+    def tell(self):
+        return self._file.tell()
+
+    def readinto(self, buffer):
+        data = self._read(len(buffer))
+        n = len(data)
+        memoryview(buffer).cast('B')[:n] = data
+        return n
+
+    def _read(self, size):
+        return self._file.read(size)
+
+    def write(self, data):
+        self._file.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        flush = getattr(self._file, 'flush', None)
+        if not self.closed and callable(flush):
+            flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super(FileAdapter, self).close()  # flushes
+        finally:
+            self._file.close()
+
+
+class _AbortOnError(object):
+    '''Proxy of a stream which aborts its raw writer, rather than uploading
+    what was written, when its ``with`` block raises'''
+    def __init__(self, stream, raw):
+        self._stream = stream
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self._raw.abort()
+        return self._stream.__exit__(exc_type, *args)
+
+
+def _can_seek(stream):
+    seekable = getattr(stream, 'seekable', None)
+    if callable(seekable):
+        try:
+            return seekable()
+        except Exception:
+            return False
+    return callable(getattr(stream, 'seek', None))
+
+
+def open_reader(raw, mode='rb', buffer_size=DEFAULT_READAHEAD,
+                encoding=None, errors=None, newline=None):
+    '''Wraps a raw reader in a buffered (binary) or text stream
+
+    The `buffer_size` is the readahead, i.e. the minimum number of bytes
+    requested from the server per read.
+    '''
+    if set(mode) - set('rbt'):
+        raise ValueError('Unsupported mode: {}'.format(repr(mode)))
+    return open_stream(raw, mode, buffer_size, encoding, errors, newline)
+
+
+def open_stream(raw, mode, buffer_size=DEFAULT_READAHEAD,
+                encoding=None, errors=None, newline=None):
+    '''Wraps a raw stream in a buffered (binary) or text stream for reading,
+    writing or both, depending on `mode`'''
+    if '+' in mode:
+        stream = io.BufferedRandom(raw, buffer_size=buffer_size)
+    elif 'r' in mode:
+        stream = io.BufferedReader(raw, buffer_size=buffer_size)
+    else:
+        stream = io.BufferedWriter(raw, buffer_size=buffer_size)
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding or 'utf8',
+                            errors=errors, newline=newline)
+
+
+def open_upload(raw, mode, buffer_size=DEFAULT_READAHEAD,
+                encoding=None, errors=None, newline=None):
+    '''Wraps a raw writer with an ``abort()`` method, e.g. a `SpooledWriter`,
+    in a buffered (binary) or text stream which is uploaded when closed,
+    unless its ``with`` block raises'''
+    if set(mode) - set('wxbt'):
+        raise ValueError('Unsupported mode: {}'.format(repr(mode)))
+    return _AbortOnError(open_stream(raw, mode, buffer_size, encoding, errors,
+                                     newline), raw)
@@ -0,0 +1,198 @@
+'''Incremental synchronisation of directory trees on any backends'''
+import os
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .transfer import (DEFAULT_CHUNK_SIZE, DEFAULT_MAX_PER_HOST,
+                       DEFAULT_MAX_WORKERS, _copy_many, _is_local, _makedirs,
+                       _path)
+
+ManifestEntry = namedtuple('ManifestEntry', ['path', 'size', 'mtime'])
+ManifestEntry.__doc__ = '''A file in a manifest, with its path relative to
+the top directory using "/" separators'''
+
+MTIME_TOLERANCE = 2  # seconds, e.g. for FTP servers or FAT file systems
+
+
+class SyncReport(object):
+    '''What `sync()` transferred and deleted, or would have for a dry run
+
+    `new`, `changed` and `deleted` are lists of relative paths, and
+    `transfer` is the `BatchResult` of the copies (None for a dry run).
+    Errors copying or deleting are collected in `errors` as
+    ``(relative path, exception)`` tuples.
+    '''
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.new = []
+        self.changed = []
+        self.deleted = []
+        self.unchanged = 0
+        self.errors = []
+        self.transfer = None
+
+    def __repr__(self):
+        return ('{}(new={}, changed={}, deleted={}, unchanged={}, errors={}'
+                '{})').format(self.__class__.__name__, len(self.new),
+                              len(self.changed), len(self.deleted),
+                              self.unchanged, len(self.errors),
+                              ', dry_run=True' if self.dry_run else '')
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def manifest(directory, max_workers=DEFAULT_MAX_WORKERS):
+    '''Sorted list of `ManifestEntry` for the files below `directory`
+
+    Remote trees are listed once with ``glob('**/*')`` and the sizes and
+    times come from the listing, so no file is stat'ed individually. A
+    missing directory has an empty manifest.
+    '''
+    directory = _path(directory)
+    entries = []
+    if _is_local(directory):
+        top = str(directory)
+        for dirpath, _, filenames in os.walk(top):
+            relative = os.path.relpath(dirpath, top).replace(os.sep, '/')
+            for name in filenames:
+                st = os.stat(os.path.join(dirpath, name))
+                entries.append(ManifestEntry(
+                    name if relative == '.' else relative + '/' + name,
+                    st.st_size, st.st_mtime))
+    else:
+        base = directory.path.rstrip('/') + '/'
+        for path in directory.glob('**/*', max_workers):
+            if not path.is_dir():
+                st = path.stat()
+                entries.append(ManifestEntry(path.path[len(base):],
+                                             st.st_size, st.st_mtime))
+    entries.sort()
+    return entries
+
+
+def changed(src, dst):
+    '''Whether the `ManifestEntry` `src` differs from its copy `dst`: the
+    sizes differ or the source was modified after the copy was written
+
+    Etags and checksums are not compared, as they are computed differently
+    by each backend.
+    '''
+    if src.size != dst.size:
+        return True
+    if src.mtime is None or dst.mtime is None:
+        return False
+    return src.mtime > dst.mtime + MTIME_TOLERANCE
+
+
+def diff(src, dst, compare=changed):
+    '''Merge-joins two sorted manifests, yielding ``(action, src, dst)``
+    where action is 'new', 'changed', 'unchanged' or 'deleted' (only in
+    `dst`) and the missing side is None'''
+    src, dst = iter(src), iter(dst)
+    s, d = next(src, None), next(dst, None)
+    while s is not None or d is not None:
+        if d is None or (s is not None and s.path < d.path):
+            yield 'new', s, None
+            s = next(src, None)
+        elif s is None or d.path < s.path:
+            yield 'deleted', None, d
+            d = next(dst, None)
+        else:
+            yield 'changed' if compare(s, d) else 'unchanged', s, d
+            s, d = next(src, None), next(dst, None)
+
+
+def sync(src_dir, dst_dir, delete=False, dry_run=False, compare=changed,
+         max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+         chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    '''Make the tree `dst_dir` a copy of `src_dir`, transferring only new
+    and changed files; the directories may be on any two backends
+
+    Each side is listed once (see `manifest`) and the sorted manifests are
+    merge-joined (see `diff`). New and changed files are copied
+    concurrently as with `upload_many`, creating directories as needed.
+
+    Arguments
+    ---------
+    delete: remove files from `dst_dir` which are not in `src_dir`
+    dry_run: only report what would be copied and deleted
+    compare: callable(src, dst) returning whether a file needs copying,
+        given the `ManifestEntry` of both sides
+    progress: callable(result) called with the `BatchResult` after each
+        file has been copied
+
+    Returns a `SyncReport`
+    '''
+    src_dir, dst_dir = _path(src_dir), _path(dst_dir)
+    report = SyncReport(dry_run)
+    src, dst = _manifests(src_dir, dst_dir, max_workers)
+    # directories (and their ancestors) which already exist at dst
+    existing = {''} if dst else set()
+    for entry in dst:
+        parts = entry.path.split('/')[:-1]
+        existing.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+
+    def pairs():
+        for action, s, d in diff(src, dst, compare):
+            if action == 'unchanged':
+                report.unchanged += 1
+            elif action == 'deleted':
+                if delete:
+                    report.deleted.append(d.path)
+            else:
+                getattr(report, action).append(s.path)
+                if not dry_run:
+                    parent = s.path.rpartition('/')[0]
+                    if parent not in existing and not _is_local(dst_dir):
+                        _makedirs(_join(dst_dir, parent))
+                        existing.add(parent)
+                    yield _join(src_dir, s.path), _join(dst_dir, s.path)
+
+    if dry_run:
+        for _ in pairs():
+            pass
+    else:
+        report.transfer = _copy_many(pairs(), max_workers, max_per_host,
+                                     progress, chunk_size=chunk_size,
+                                     makedirs=_is_local(dst_dir))
+        base = _top(src_dir)
+        report.errors.extend((_relative(s, base), err)
+                             for s, _, err in report.transfer.errors)
+    if report.deleted and not dry_run:
+        with ThreadPoolExecutor(max_workers) as executor:
+            errors = executor.map(lambda name: _unlink(_join(dst_dir, name)),
+                                  report.deleted)
+            report.errors.extend((name, err) for name, err
+                                 in zip(report.deleted, errors)
+                                 if err is not None)
+    return report
+
+
+def _manifests(src_dir, dst_dir, max_workers):
+    # both sides are listed at the same time
+    with ThreadPoolExecutor(2) as executor:
+        dst = executor.submit(manifest, dst_dir, max_workers)
+        return manifest(src_dir, max_workers), dst.result()
+
+
+def _join(directory, relative):
+    return directory.joinpath(*relative.split('/')) if relative else directory
+
+
+def _top(directory):
+    return str(directory) if _is_local(directory) else directory.path
+
+
+def _relative(path, base):
+    path = str(path) if _is_local(path) else path.path
+    return path[len(base):].replace(os.sep, '/').strip('/')
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except Exception as err:
+        return err
@@ -0,0 +1,381 @@
+'''Streaming transfers between paths on any (mixed) backends'''
+import os
+import pathlib
+import queue
+import threading
+import time
+
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .pool import get_pool
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # bytes per read from the source
+DEFAULT_MAX_CHUNKS = 4  # chunks buffered between the reader and writer
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024  # bytes per ranged read in parallel
+DEFAULT_MAX_WORKERS = 32  # files transferred concurrently
+DEFAULT_MAX_PER_HOST = None  # per server; None for the pool's max_size
+
+
+class TransferStats(object):
+    '''Progress of a transfer, as passed to progress callbacks'''
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.started = time.time()
+        self.finished = None
+
+    def __repr__(self):
+        return '{}(bytes={}, elapsed={:.3f}s, throughput={:.0f}B/s)'.format(
+            self.__class__.__name__, self.bytes, self.elapsed,
+            self.throughput)
+
+    @property
+    def elapsed(self):
+        '''Seconds since the transfer started, until it finished'''
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        '''Average bytes per second'''
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+
+class BatchResult(TransferStats):
+    '''Outcome and progress of a bulk transfer, as passed to progress
+    callbacks
+
+    Failed files do not stop the transfer; they are collected in `errors`
+    as ``(src, dst, exception)`` tuples.
+    '''
+    def __init__(self):
+        super(BatchResult, self).__init__()
+        self.files = 0
+        self.errors = []
+
+    def __repr__(self):
+        return ('{}(files={}, errors={}, bytes={}, elapsed={:.3f}s, '
+                'throughput={:.0f}B/s)').format(
+                    self.__class__.__name__, self.files, len(self.errors),
+                    self.bytes, self.elapsed, self.throughput)
+
+    @property
+    def ok(self):
+        '''Whether every file was transferred'''
+        return not self.errors
+
+
+def _path(path):
+    if isinstance(path, str):
+        if '://' not in path:
+            return pathlib.Path(path)  # a local file
+        from .uripath import UriPath
+        return UriPath(path)
+    return path
+
+
+def _is_local(path):
+    return isinstance(path, pathlib.PurePath)
+
+
+def _host(path):
+    '''Server of a path which concurrency is limited for, None if local'''
+    if _is_local(path):
+        return None
+    return (getattr(path, 'scheme', None), getattr(path, 'hostname', None),
+            getattr(path, 'port', None))
+
+
+def _size_hint(path):
+    '''Size of a file if known without a request to its server'''
+    try:
+        if _is_local(path):
+            return os.stat(str(path)).st_size
+        entry = getattr(path, '_dir_entry', None)  # e.g. from a listing
+        return None if entry is None else entry.stat().st_size
+    except (OSError, TypeError, AttributeError):
+        return None
+
+
+def copy(src, dst, chunk_size=DEFAULT_CHUNK_SIZE,
+         max_chunks=DEFAULT_MAX_CHUNKS, progress=None):
+    '''Copy the file `src` to `dst`, which may be paths (or URIs) on
+    different backends, e.g. from SFTP to Azure blob storage
+
+    The source is read by a background thread into a queue of at most
+    `max_chunks` chunks, which is written to the destination as it fills,
+    so downloading and uploading overlap and memory use is bounded to a few
+    chunks whatever the size of the file. If either side fails the
+    destination is closed with the error, so writers which support it
+    discard the partial upload.
+
+    Arguments
+    ---------
+    chunk_size: bytes per read from the source
+    max_chunks: chunks which may be buffered between reader and writer
+    progress: callable(stats) called with the `TransferStats` after each
+        chunk has been written
+
+    Returns the final `TransferStats`
+    '''
+    src, dst = _path(src), _path(dst)
+    chunks = queue.Queue(max_chunks)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        # gives up once the writer has stopped, rather than blocking forever
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read():
+        try:
+            with src.open('rb') as f:
+                while not stop.is_set():
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    put(chunk)
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            put(None)
+
+    reader = threading.Thread(target=read, name='smartpath-copy-reader')
+    reader.daemon = True
+    stats = TransferStats()
+    reader.start()
+    try:
+        with dst.open('wb') as f:
+            for chunk in iter(chunks.get, None):
+                f.write(chunk)
+                stats.bytes += len(chunk)
+                stats.chunks += 1
+                if progress is not None:
+                    progress(stats)
+            if errors:
+                raise errors[0]  # inside the with block to abort the upload
+    finally:
+        stop.set()
+        reader.join()
+    stats.finished = time.time()
+    return stats
+
+
+def fetch_ranges(fetch, f, size, block_size=DEFAULT_BLOCK_SIZE,
+                 max_workers=DEFAULT_MAX_PER_HOST):
+    '''Download `size` bytes into the file `f` with concurrent ranged reads
+
+    The file is first extended to `size` (sparsely, where the file system
+    supports it) and each block of `block_size` bytes is written at its
+    offset as soon as it arrives, so at most `max_workers` blocks are held
+    in memory. `max_workers` defaults to the connection pool's
+    ``max_size``, as every read checks out a connection of the same server. Short reads are continued from where they stopped, and an
+    `IOError` is raised if a read returns nothing before `size` bytes.
+
+    Arguments
+    ---------
+    fetch: callable(offset, length) returning up to `length` bytes from
+        `offset`, e.g. ``path.read_range``
+    f: binary file opened for writing, with a ``fileno()``
+
+    Returns the `TransferStats`
+    '''
+    max_workers = _per_host(max_workers)
+    stats = TransferStats()
+    f.truncate(size)
+    fd, lock = f.fileno(), threading.Lock()
+
+    def fetch_block(offset):
+        length = min(block_size, size - offset)
+        done = 0
+        while done < length:  # servers may return less than requested
+            data = fetch(offset + done, length - done)
+            if not data:
+                raise IOError('Short read of {} bytes at {}, the file may '
+                              'have shrunk below {} bytes'.format(
+                                  done, offset, size))
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, data, offset + done)
+            else:
+                with lock:
+                    os.lseek(fd, offset + done, os.SEEK_SET)
+                    os.write(fd, data)
+            done += len(data)
+        return done
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        for n in executor.map(fetch_block, range(0, size, block_size)):
+            stats.bytes += n
+            stats.chunks += 1
+    stats.finished = time.time()
+    return stats
+
+
+def _copy_file(src, dst, chunk_size=DEFAULT_CHUNK_SIZE, makedirs=False):
+    if makedirs:
+        os.makedirs(str(dst.parent), exist_ok=True)
+    size = _size_hint(src)
+    if size is None or size > chunk_size:
+        return copy(src, dst, chunk_size)
+    # small files in a single request each way, without a reader thread
+    stats = TransferStats()
+    data = src.read_bytes()
+    dst.write_bytes(data)
+    stats.bytes, stats.chunks, stats.finished = len(data), 1, time.time()
+    return stats
+
+
+def _per_host(limit):
+    # transfers beyond the pool's max_size would only wait for a connection
+    return get_pool().max_size if limit is None else limit
+
+
+def _copy_many(pairs, max_workers, max_per_host, progress, **kwargs):
+    max_per_host = _per_host(max_per_host)
+    result = BatchResult()
+    pairs = iter(pairs)
+    active = defaultdict(int)  # transfers running per host
+    waiting = defaultdict(deque)  # transfers waiting for a busy host
+    backlog = 0
+    running = {}
+
+    def hosts(src, dst):
+        return [h for h in {_host(src), _host(dst)} if h is not None]
+
+    def ready(src, dst):
+        return all(active[h] < max_per_host for h in hosts(src, dst))
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        def start(src, dst):
+            for h in hosts(src, dst):
+                active[h] += 1
+            running[executor.submit(_copy_file, src, dst, **kwargs)] = \
+                (src, dst)
+
+        while True:
+            for key in list(waiting):
+                queued = waiting[key]
+                while (queued and len(running) < max_workers and
+                       ready(*queued[0])):
+                    start(*queued.popleft())
+                    backlog -= 1
+                if not queued:
+                    del waiting[key]
+            # read ahead lazily, e.g. from a listing of 500k files
+            while len(running) < max_workers and backlog < 4 * max_workers:
+                pair = next(pairs, None)
+                if pair is None:
+                    break
+                src, dst = _path(pair[0]), _path(pair[1])
+                if ready(src, dst):
+                    start(src, dst)
+                else:
+                    waiting[tuple(hosts(src, dst))].append((src, dst))
+                    backlog += 1
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                src, dst = running.pop(future)
+                for h in hosts(src, dst):
+                    active[h] -= 1
+                try:
+                    stats = future.result()
+                except Exception as err:
+                    result.errors.append((src, dst, err))
+                else:
+                    result.files += 1
+                    result.bytes += stats.bytes
+                    result.chunks += stats.chunks
+                if progress is not None:
+                    progress(result)
+    result.finished = time.time()
+    return result
+
+
+def upload_many(pairs, max_workers=DEFAULT_MAX_WORKERS,
+                max_per_host=DEFAULT_MAX_PER_HOST,
+                chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    '''Copy many files concurrently, e.g. local files to remote paths
+
+    `pairs` is an iterable of ``(src, dst)`` paths or URIs (local paths
+    may be plain file names) on any backends, which is consumed lazily.
+    Up to `max_workers` files are transferred at once, and at most
+    `max_per_host` per server (by default the connection pool's
+    ``max_size``) so that each server's connection pool and limits are
+    respected. Files which fit in one chunk are sent with a
+    single ``write_bytes()``; larger files are streamed with `copy()`,
+    except to WebDAV, whose files are spooled and sent by one PUT each.
+    The parent directories of remote files must exist (see `upload_dir`).
+
+    Returns a `BatchResult`; failed files are collected in its `errors`
+    rather than stopping the transfer. `progress` is called with the
+    `BatchResult` after each file.
+    '''
+    return _copy_many(pairs, max_workers, max_per_host, progress,
+                      chunk_size=chunk_size)
+
+
+def download_many(pairs, max_workers=DEFAULT_MAX_WORKERS,
+                  max_per_host=DEFAULT_MAX_PER_HOST,
+                  chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    '''Like `upload_many` for ``(remote, local)`` pairs, creating the
+    parent directories of the local files as needed'''
+    return _copy_many(pairs, max_workers, max_per_host, progress,
+                      chunk_size=chunk_size, makedirs=True)
+
+
+def upload_dir(src_dir, dst_dir, **kwargs):
+    '''Upload the local directory tree `src_dir` into the remote directory
+    `dst_dir`, creating remote directories as needed. Takes the keyword
+    arguments of `upload_many` and returns its `BatchResult`.'''
+    src_dir, dst_dir = str(src_dir), _path(dst_dir)
+
+    def pairs():
+        for dirpath, _, filenames in os.walk(src_dir):
+            relative = os.path.relpath(dirpath, src_dir).replace(os.sep, '/')
+            target = dst_dir if relative == '.' else \
+                dst_dir.joinpath(*relative.split('/'))
+            if filenames:
+                _makedirs(target)
+            for name in filenames:
+                yield os.path.join(dirpath, name), target.joinpath(name)
+
+    return upload_many(pairs(), **kwargs)
+
+
+def download_dir(src_dir, dst_dir, max_workers=DEFAULT_MAX_WORKERS,
+                 **kwargs):
+    '''Download the remote directory tree `src_dir` into the local
+    directory `dst_dir`. Takes the keyword arguments of `download_many`
+    and returns its `BatchResult`.
+
+    The tree is listed with ``glob('**/*')``, concurrently or as a single
+    flat listing of an object store, while the first files download. The
+    sizes from the listing let small files be fetched in one request.'''
+    src_dir, dst_dir = _path(src_dir), pathlib.Path(str(dst_dir))
+    base = src_dir.path.rstrip('/') + '/'
+
+    def pairs():
+        for path in src_dir.glob('**/*', max_workers):
+            if not path.is_dir():  # from the listing, no request
+                relative = path.path[len(base):].split('/')
+                yield path, dst_dir.joinpath(*relative)
+
+    return download_many(pairs(), max_workers=max_workers, **kwargs)
+
+
+def _makedirs(path):
+    if _is_local(path):
+        return os.makedirs(str(path), exist_ok=True)
+    try:
+        if not path.is_dir():
+            path.session.makedirs(path.path)
+    except NotImplementedError:
+        pass  # e.g. object stores without directories
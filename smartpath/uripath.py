@@ -6,70 +6,73 @@ import urllib.parse
 
 
 class UriPath(object):
+    def __new__(cls, uri):
+        path_class, kwargs = cls._pathClass(uri)
+        if path_class is not None:
+            # paths are compact, slotted objects, so are created directly
+            # rather than by changing the class of this object
+            return path_class(uri, **kwargs)
+        return super(UriPath, cls).__new__(cls)
+
     def __init__(self, uri):
         self.uri = uri
         self.createSession()
 
     def createSession(self, **kwargs):
-        '''Tries to create a new session appropriate to URI scheme'''
+        '''Tries to create a new session appropriate to URI scheme
+
+        Remote sessions are not created here; the resulting path checks
+        out a connection from the process-wide pool (see `smartpath.pool`)
+        on first use, so paths on the same server share their logins.'''
         uri = urllib.parse.urlparse(self.uri)
         scheme = uri.scheme
-        hostname = uri.hostname
-        if scheme is 'dav':
-            from .dav import WebDavClient, WebDavPath
-            self.session = WebDavClient(**kwargs)
-            self.__class__ = WebDavPath
-        elif scheme in ['ftp', 'ftps']:
-            from .ftp import FTPClient, FTPPath
-            self.session = FTPClient(**kwargs)
-            self.__class__ = FTPPath
-        elif scheme is 'sftp':
-            raise NotImplementedError
-        elif scheme is 'sshfs':
-            raise NotImplementedError
-        elif scheme is 'mogodb':
+        if scheme == 'mogodb':
             from .mongodb import GridFsClient
             self.session = GridFsClient(**kwargs)
-        elif scheme is 'nfs':
-            from .nfs import NFSClient, NFSPath
-            self.session = NFSClient(**kwargs)
-            self.__class__ = NFSPath
+        elif scheme == 'file':
+            import pathlib
+            self.__class__ = pathlib.Path
+            self.session = pathlib._NormalAccessor
+
+    @staticmethod
+    def _pathClass(uri, **kwargs):
+        '''Returns the path class for the URI scheme (or None) and the
+        keyword arguments to create it with'''
+        parsed = urllib.parse.urlparse(uri)
+        scheme = parsed.scheme
+        hostname = parsed.hostname or ''
+        path_class = None
+        if scheme == 'dav':
+            from .dav import WebDavPath as path_class
+        elif scheme in ['ftp', 'ftps']:
+            from .ftp import FTPPath as path_class
+        elif scheme == 'sftp':
+            from .ftp import SFTPPath as path_class
+        elif scheme == 'sshfs':
+            raise NotImplementedError
+        elif scheme == 'nfs':
+            from .nfs import NFSPath as path_class
         elif scheme in ['cifs', 'smb']:
-            from .smb import SmbClient, SmbPath
-            self.session = SmbClient(**kwargs)
-            self.__class__ = SmbPath
+            from .smb import SambaPath as path_class
         elif scheme in ['s3'] or hostname.endswith('s3.amazonaws.com'):
-            from .s3 import S3Client, S3Path
-            self.session = S3Client(**kwargs)
-            self.__class__ = S3Path
+            from .s3 import S3Path as path_class
         elif hostname.endswith('blob.core.windows.net'):
-            from .azure import AzureBlobStorageClient, AzurePath
-            self.session = AzureBlobStorageClient(**kwargs)
-            self.__class__ = AzurePath
+            from .azure import AzurePath as path_class
+            kwargs.setdefault('session', 'blob')
         elif hostname.endswith('file.core.windows.net'):
-            from .azure import AzureFileStorageClient, AzurePath
-            self.session = AzureFileStorageClient(**kwargs)
-            self.__class__ = AzurePath
+            from .azure import AzurePath as path_class
+            kwargs.setdefault('session', 'file')
         elif 'onedrive' in hostname:
             raise NotImplementedError('OneDrive not yet supported')
         elif hostname.startswith('drive.google.com'):
             raise NotImplementedError('Google Drive not yet supported')
-        elif 'amazon.co.uk/clouddrive' in self.uri:
+        elif 'amazon.co.uk/clouddrive' in uri:
             raise NotImplementedError('Amazon Drive not yet supported')
         elif hostname in ('icloud.com', 'www.icloud.com'):
             raise NotImplementedError('Apple iCloud not yet supported')
         elif hostname in ('box.com', 'www.box.com'):
             raise NotImplementedError('Box.com not yet supported')
-        elif scheme is 'file':
-            import pathlib
-            self.__class__ = pathlib.Path
-            self.session = pathlib._NormalAccessor
-        try:
-            # hack to change class
-            self.__init__(self.uri, self.session)
-        except TypeError:
-            # didn't alter class of Path
-            pass
+        return path_class, kwargs
 
     @classmethod
     def constructUri(cls, scheme='http', hostname='localhost', path='',
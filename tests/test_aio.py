@@ -0,0 +1,113 @@
+import asyncio
+import io
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from smartpath.aio import AsyncPath
+
+
+class MemoryPath(object):
+    '''Blocking path-like object backed by a dict of files'''
+    def __init__(self, files, path='/', delay=0):
+        self.files = files
+        self.path = path
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+
+    @property
+    def name(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    def joinpath(self, name):
+        child = MemoryPath(self.files, self.path.rstrip('/') + '/' + name)
+        return child
+
+    def read_bytes(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return self.files[self.path]
+
+    def iterdir(self):
+        for name in sorted(self.files):
+            if name.startswith(self.path):
+                yield self.joinpath(name[len(self.path):])
+
+    def open(self, mode='rb'):
+        if 'r' in mode:
+            return io.BytesIO(self.files[self.path])
+        files, path = self.files, self.path
+
+        class Writer(io.BytesIO):
+            def __exit__(self, exc_type, *args):
+                if exc_type is None:
+                    files[path] = self.getvalue()
+                return super(Writer, self).__exit__(exc_type, *args)
+        return Writer()
+
+    def copy_to(self, target):
+        self.files[target.path] = self.files[self.path]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncPath(unittest.TestCase):
+    def test_AsyncPath_bounded(self):
+        '''Test concurrent calls run on at most max_workers threads'''
+        path = MemoryPath({'/a': b'data'}, '/a', delay=0.02)
+        apath = AsyncPath(path, ThreadPoolExecutor(2))
+
+        async def main():
+            return await asyncio.gather(*[apath.read_bytes()
+                                          for _ in range(10)])
+        self.assertEqual(run(main()), [b'data'] * 10)
+        self.assertEqual(path.peak, 2)
+
+    def test_AsyncPath_iterdir(self):
+        '''Test iterdir() is an async generator of AsyncPaths'''
+        files = {'/d/{:03d}'.format(i): b'' for i in range(300)}
+        apath = AsyncPath(MemoryPath(files, '/d/'))
+
+        async def main():
+            return [child async for child in apath.iterdir()]
+        children = run(main())
+        self.assertEqual(len(children), 300)
+        self.assertIsInstance(children[0], AsyncPath)
+        self.assertEqual(children[0].name, '000')
+
+    def test_AsyncPath_open(self):
+        '''Test open() as an async context manager, and copy()'''
+        files = {}
+        apath = AsyncPath(MemoryPath(files, '/f'))
+
+        async def main():
+            async with apath.open('wb') as f:
+                await f.write(b'hello world')
+            async with apath.open('rb') as f:
+                await f.seek(6)
+                data = await f.read()
+            await apath.copy(MemoryPath(files, '/g'))
+            return data
+        self.assertEqual(run(main()), b'world')
+        self.assertEqual(files, {'/f': b'hello world', '/g': b'hello world'})
+
+    def test_AsyncPath_native(self):
+        '''Test native coroutines are awaited instead of using threads'''
+        class NativePath(MemoryPath):
+            async def read_bytes_async(self):
+                return b'native'
+        apath = AsyncPath(NativePath({}, '/n'))
+        self.assertEqual(run(apath.read_bytes()), b'native')
@@ -1,11 +1,215 @@
+import threading
 import unittest
 
+from smartpath import azure, metrics
 from smartpath.azure import (AzureBlobStorageClient,
                              AzureFileStorageClient,
                              AzurePath)
+from smartpath.base import BasePath
+from smartpath.cache import TTLCache
+
+
+class FakeItem(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakePage(list):
+    next_marker = None
+
+
+class FakeBlobService(object):
+    '''In-memory stand in for BlockBlobService recording list requests'''
+    def __init__(self, blobs):
+        self.blobs = sorted(blobs)
+        self.list_calls = []
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def delete_blob(self, container, blob_name):
+        with self.lock:
+            self.blobs.remove(blob_name)
+
+    def batch_delete_blobs(self, sub_requests):
+        with self.lock:
+            self.batches.append(len(sub_requests))
+        responses = []
+        for request in sub_requests:
+            self.delete_blob(request.container_name, request.blob_name)
+            responses.append(FakeItem('ok'))
+            responses[-1].is_successful = True
+        return responses
+
+    def exists(self, container, blob_name=None):
+        return not blob_name or blob_name in self.blobs
+
+    def list_blobs(self, container, prefix=None, num_results=None,
+                   delimiter=None, marker=None):
+        self.list_calls.append((prefix, delimiter, marker))
+        names = []
+        for name in self.blobs:
+            if prefix and not name.startswith(prefix):
+                continue
+            rest = name[len(prefix or ''):]
+            if delimiter and delimiter in rest:
+                name = name[:len(name) - len(rest)] + rest.split(delimiter)[0]
+                name += delimiter
+            if not names or names[-1] != name:
+                names.append(name)
+        # like the service, markers are the name to continue from
+        names = [n for n in names if marker is None or n >= marker]
+        page = FakePage(FakeItem(n) for n in names[:num_results])
+        if len(names) > num_results:
+            page.next_marker = names[num_results]
+        return page
+
+
+class FakeFileService(object):
+    '''Records the calls made to a FileService'''
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name,) + args)
+
+
+def blob_client(blobs):
+    client = AzureBlobStorageClient.__new__(AzureBlobStorageClient)
+    client._service = FakeBlobService(blobs)
+    client._known = TTLCache()
+    return client
+
+
+def file_client():
+    client = AzureFileStorageClient.__new__(AzureFileStorageClient)
+    client._service = FakeFileService()
+    client._known = TTLCache()
+    return client
+
+
+class TestAzureBlobStorageClient(unittest.TestCase):
+    def test_AzureBlobStorageClient_scandir(self):
+        '''Test scandir() lists immediate children only'''
+        client = blob_client(['a/1', 'a/b/2', 'a/b/3', 'a/c/4', 'z/5'])
+        entries = list(client.scandir('/container/a'))
+        self.assertEqual([e.name for e in entries], ['1', 'b', 'c'])
+        self.assertEqual([e.is_dir() for e in entries], [False, True, True])
+        self.assertEqual(entries[1].path, '/container/a/b')
+        self.assertEqual(client._service.list_calls, [('a/', '/', None)])
+        self.assertEqual(client.listdir('/container'), ['a', 'z'])
+
+    def test_AzureBlobStorageClient_scandir_paged(self):
+        '''Test scandir() follows continuation markers lazily'''
+        client = blob_client(['dir/{:03d}'.format(i) for i in range(25)])
+        client.LIST_PAGE_SIZE = 10
+        entries = client.scandir('/container/dir')
+        self.assertEqual(next(entries).name, '000')
+        self.assertEqual(len(client._service.list_calls), 1)
+        self.assertEqual(len(list(entries)), 24)
+        self.assertEqual(len(client._service.list_calls), 3)
+
+    def test_AzureBlobStorageClient_is_dir(self):
+        '''Test is_dir() for virtual directories'''
+        client = blob_client(['a/b/1'])
+        self.assertTrue(client.is_dir('/container/a'))
+        self.assertFalse(client.is_dir('/container/a/b/1'))
+        self.assertTrue(client.exists('/container/a/b/1'))
+
+    def test_AzureBlobStorageClient_glob(self):
+        '''Test recursive glob uses one flat listing below the literal
+        prefix'''
+        client = blob_client(['2026/10/01/a.parquet', '2026/10/02/b.parquet',
+                              '2026/10/02/c.csv', '2026/11/d.parquet'])
+        root = BasePath('ftp://localhost/container', client)
+        found = sorted(p.path for p in root.glob('2026/10/**/*.parquet'))
+        self.assertEqual(found, ['/container/2026/10/01/a.parquet',
+                                 '/container/2026/10/02/b.parquet'])
+        self.assertEqual(client._service.list_calls,
+                         [('2026/10/', None, None)])
+        found = sorted(p.path for p in root.glob('2026/**/0?'))
+        self.assertEqual(found, ['/container/2026/10/01',
+                                 '/container/2026/10/02'])
+
+    def test_AzureBlobStorageClient_rmtree(self):
+        '''Test rmtree() deletes in batches and reports progress'''
+        client = blob_client(['d/{:04d}'.format(i) for i in range(600)] +
+                             ['d/sub/x', 'keep'])
+        client.LIST_PAGE_SIZE = 100
+        counts = []
+        self.assertEqual(client.rmtree('/container/d', max_workers=2,
+                                       progress=counts.append), 601)
+        self.assertEqual(client._service.blobs, ['keep'])
+        self.assertEqual(sorted(client._service.batches), [89, 256, 256])
+        self.assertEqual(counts[-1], 601)
+
+    def test_AzureBlobStorageClient_rmtree_without_batches(self):
+        '''Test blobs are deleted one by one on SDKs without batches'''
+        client = blob_client(['d/{:04d}'.format(i) for i in range(300)])
+        batch_request = azure.BatchDeleteSubRequest
+        azure.BatchDeleteSubRequest = None
+        try:
+            self.assertEqual(client.rmtree('/container/d'), 300)
+        finally:
+            azure.BatchDeleteSubRequest = batch_request
+        self.assertEqual(client._service.blobs, [])
+        self.assertEqual(client._service.batches, [])
+
+
+class TestAzureFileStorageClient(unittest.TestCase):
+    def test_AzureFileStorageClient_mkdir(self):
+        '''Test mkdir() creates every level once'''
+        client = file_client()
+        client.mkdir('/share/a/b')
+        client.mkdir('/share/a/b')
+        client.mkdir('/share/a/c')
+        self.assertEqual(client._service.calls, [
+            ('create_share', 'share'),
+            ('create_directory', 'share', 'a'),
+            ('create_directory', 'share', 'a/b'),
+            ('create_directory', 'share', 'a/c')])
+
+    def test_AzureFileStorageClient_rmdir(self):
+        '''Test rmdir() forgets the directory and its children'''
+        client = file_client()
+        client.mkdir('/share/a/b')
+        client.rmdir('/share/a')
+        client.mkdir('/share/a/b')
+        created = [c for c in client._service.calls
+                   if c[0] == 'create_directory']
+        self.assertEqual(len(created), 4)
 
 
 class TestAzurePath(unittest.TestCase):
     def test_AzurePath___init__(self):
         '''Test AzurePath()'''
         self.fail('todo')
+
+    def test_AzurePath_derived_client(self):
+        '''Test paths derived from a file share path keep its client'''
+        uri = 'https://account.file.core.windows.net/share/dir/a.txt'
+        path = AzurePath(uri, session='file')
+        derived = [path.parent, path.joinpath('b'), path.with_name('c'),
+                   path.parent.parent]
+        for other in [path] + derived:
+            self.assertIs(other.SESSION_FACTORY, AzureFileStorageClient)
+            self.assertEqual(other._pool_key(), path._pool_key())
+        blob = AzurePath('https://account.blob.core.windows.net/c/a')
+        self.assertIs(blob.parent.SESSION_FACTORY, AzureBlobStorageClient)
+
+    def test_AzurePath_metrics(self):
+        '''Test Azure operations are labelled with the path's host'''
+        default, registry = metrics.get_registry(), metrics.MetricsRegistry()
+        metrics.set_registry(registry)
+        factory = AzureBlobStorageClient._factory
+        AzureBlobStorageClient._factory = staticmethod(
+            lambda **kwargs: FakeBlobService(['a/1']))
+        try:
+            path = AzurePath('https://metered.blob.core.windows.net/c/a/1')
+            self.assertTrue(path.exists())
+            self.assertEqual(path.metrics()['exists']['calls'], 1)
+        finally:
+            AzureBlobStorageClient._factory = factory
+            metrics.set_registry(default)
+        self.assertEqual(list(registry.snapshot()),
+                         [('https', 'metered.blob.core.windows.net',
+                           'exists')])
@@ -0,0 +1,56 @@
+import json
+import unittest
+
+from smartpath.bench import micro, suite
+
+
+class TestBench(unittest.TestCase):
+    def run_backend(self, name):
+        report = suite.run([name], small_files=5, small_size=10,
+                           large_size=3 << 20, repeat=1)
+        results = report['results'][name]
+        if 'skipped' in results:
+            self.skipTest(results['skipped'])
+        json.dumps(report)  # machine-readable
+        return results
+
+    def test_run(self):
+        '''Test the workloads run against the in-memory Azure stand-in'''
+        results = self.run_backend('azure')
+        self.assertEqual(results['small_files']['files'], 5)
+        self.assertGreater(results['large_file']['read_mb_s'], 0)
+        self.assertEqual(results['listing']['entries'], 5)
+        self.assertEqual(results['metadata']['operation'], 'exists')
+
+    def test_run_webdav(self):
+        '''Test the workloads run against a local WsgiDAV server'''
+        results = self.run_backend('webdav')
+        self.assertEqual(results['small_files']['files'], 5)
+        self.assertGreater(results['large_file']['write_mb_s'], 0)
+        self.assertEqual(results['listing']['entries'], 5)
+        self.assertEqual(results['metadata']['operation'], 'stat')
+
+    def test_unknown_backend(self):
+        '''Test a failing backend is reported rather than raised'''
+        report = suite.run(['other'], repeat=1)
+        self.assertIn('error', report['results']['other'])
+
+
+class TestMicro(unittest.TestCase):
+    def test_run(self):
+        '''Test operations are timed and their allocations traced'''
+        results = micro.run(['joinpath', 'parts'], number=10, repeat=1)
+        self.assertEqual(sorted(results), ['joinpath', 'parts'])
+        self.assertEqual(results['parts']['number'], 10)
+        self.assertGreater(results['joinpath']['ns'], 0)
+        self.assertGreater(results['joinpath']['peak_bytes'], 0)
+
+    def test_compare(self):
+        '''Test regressions beyond the threshold are reported'''
+        baseline = {'a': {'ns': 100, 'peak_bytes': 1000},
+                    'b': {'ns': 100, 'peak_bytes': 1000}}
+        results = {'a': {'ns': 120, 'peak_bytes': 1000},
+                   'b': {'ns': 100, 'peak_bytes': 2000},
+                   'c': {'ns': 999, 'peak_bytes': 0}}
+        self.assertEqual(micro.compare(results, baseline, 0.25),
+                         [('b', 'peak_bytes', 1000, 2000)])
@@ -0,0 +1,250 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from collections import namedtuple
+
+from smartpath.base import BasePath
+from smartpath.cache import CachingAccessor, ContentCache, TTLCache
+
+Stat = namedtuple('Stat', ['st_size', 'st_mtime'])
+
+
+class CountingClient(object):
+    '''In-memory client counting the calls which reach it'''
+    def __init__(self):
+        self.files = {'/dir/a': b'a'}
+        self.calls = 0
+
+    def exists(self, path):
+        self.calls += 1
+        return path in self.files or path == '/dir'
+
+    def listdir(self, path):
+        self.calls += 1
+        return iter([p for p in self.files if p.startswith(path + '/')])
+
+    def write_bytes(self, path, data):
+        self.files[path] = data
+
+    def open(self, path, mode='r'):
+        files = self.files
+
+        class Writer(io.BytesIO):
+            def close(self):
+                files[path] = self.getvalue()
+                super(Writer, self).close()
+        return Writer()
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_TTLCache_expiry(self):
+        '''Test entries expire after the ttl'''
+        cache = TTLCache(ttl=0.01)
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        time.sleep(0.02)
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_TTLCache_lru(self):
+        '''Test the least recently used entries are evicted'''
+        cache = TTLCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_TTLCache_invalidate(self):
+        '''Test TTLCache.invalidate() removes matching keys'''
+        cache = TTLCache(ttl=None)
+        for key in ('dir', 'dir/a', 'dir2'):
+            cache.add(key)
+        removed = cache.invalidate(lambda k: k == 'dir' or
+                                   k.startswith('dir/'))
+        self.assertEqual(removed, 2)
+        self.assertIn('dir2', cache)
+
+
+class TestCachingAccessor(unittest.TestCase):
+    def test_CachingAccessor_hits(self):
+        '''Test repeated metadata calls are served from the cache'''
+        client = CountingClient()
+        session = CachingAccessor(client)
+        for _ in range(3):
+            self.assertTrue(session.exists('/dir/a'))
+            self.assertEqual(session.listdir('/dir'), ['/dir/a'])
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(session.stats,
+                         {'hits': 4, 'misses': 2, 'size': 2})
+
+    def test_CachingAccessor_invalidate(self):
+        '''Test writes invalidate the path and its parent listing'''
+        session = CachingAccessor(CountingClient())
+        self.assertFalse(session.exists('/dir/b'))
+        session.listdir('/dir')
+        session.write_bytes('/dir/b', b'b')
+        self.assertTrue(session.exists('/dir/b'))
+        self.assertEqual(sorted(session.listdir('/dir')),
+                         ['/dir/a', '/dir/b'])
+        with session.open('/dir/c', 'wb') as f:
+            session.listdir('/dir')
+            f.write(b'c')
+        self.assertIn('/dir/c', session.listdir('/dir'))
+
+
+class RemoteFile(object):
+    '''Path-like remote file counting downloads and metadata requests'''
+    def __init__(self, uri, data, mtime=1):
+        self.uri = uri
+        self.data = data
+        self.mtime = mtime
+        self.downloads = 0
+        self.stats = 0
+
+    def __str__(self):
+        return self.uri
+
+    def stat(self):
+        self.stats += 1
+        return Stat(len(self.data), self.mtime)
+
+    def open(self, mode='rb'):
+        self.downloads += 1
+        return io.BytesIO(self.data)
+
+    def read_range(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_ContentCache_read(self):
+        '''Test whole and ranged reads are served from one download'''
+        cache = ContentCache(self.tmp)
+        remote = RemoteFile('ftp://host/ref.bin', b'0123456789')
+        self.assertEqual(cache.read_bytes(remote), b'0123456789')
+        self.assertEqual(cache.read_range(remote, 2, 3), b'234')
+        with cache.open(remote, 'r') as f:
+            self.assertEqual(f.read(), '0123456789')
+        self.assertEqual(remote.downloads, 1)
+        self.assertEqual(remote.stats, 1)  # the rest within max_age
+        self.assertEqual(cache.stats, {'hits': 2, 'misses': 1})
+        # a second process sharing the directory
+        self.assertEqual(ContentCache(self.tmp).read_bytes(remote),
+                         b'0123456789')
+        self.assertEqual(remote.downloads, 1)
+
+    def test_ContentCache_validate(self):
+        '''Test entries are revalidated and refetched once changed'''
+        cache = ContentCache(self.tmp, max_age=0)
+        remote = RemoteFile('ftp://host/ref.bin', b'old')
+        cache.read_bytes(remote)
+        cache.read_bytes(remote)
+        self.assertEqual(remote.downloads, 1)
+        remote.data, remote.mtime = b'new!', 2
+        self.assertEqual(cache.read_bytes(remote), b'new!')
+        self.assertEqual(remote.downloads, 2)
+
+    def test_ContentCache_evict(self):
+        '''Test least recently used entries are evicted by size'''
+        cache = ContentCache(self.tmp, max_bytes=25, max_file_bytes=10)
+        files = [RemoteFile('ftp://host/{}'.format(i), b'x' * 10)
+                 for i in range(3)]
+        for remote in files[:2]:
+            cache.read_bytes(remote)
+        past = time.time() - 100
+        os.utime(cache.filename(files[1]), (past, past))  # least recent
+        cache.read_bytes(files[2])
+        self.assertTrue(os.path.exists(cache._files(files[0])[0]))
+        self.assertFalse(os.path.exists(cache._files(files[1])[0]))
+        big = RemoteFile('ftp://host/big', b'x' * 11)
+        self.assertEqual(cache.read_range(big, 0, 2), b'xx')
+        self.assertIsNone(cache.filename(big))
+
+
+class MemoryClient(object):
+    '''In-memory client for paths read through a `ContentCache`'''
+    def __init__(self):
+        self.files = {}
+
+    def stat(self, path):
+        return Stat(len(self.files[path]), 1)  # the mtime never changes
+
+    def open(self, path, mode='r'):
+        if 'r' in mode:
+            return io.BytesIO(self.files[path])
+        files = self.files
+
+        class Writer(io.BytesIO):
+            def write(self, data):
+                if isinstance(data, str):
+                    data = data.encode('utf8')
+                return super(Writer, self).write(data)
+
+            def close(self):
+                files[path] = self.getvalue()
+                super(Writer, self).close()
+        return Writer()
+
+    def unlink(self, path):
+        del self.files[path]
+
+
+class TestContentCachePath(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.client = MemoryClient()
+        self.cache = ContentCache(self.tmp, max_age=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        path = BasePath('mem://host/' + name, session=self.client)
+        path.content_cache = self.cache
+        return path
+
+    def test_write_invalidates(self):
+        '''Test writes through the path drop the cached copy'''
+        path = self.path('a')
+        path.write_bytes(b'old')
+        self.assertEqual(path.read_bytes(), b'old')
+        path.write_bytes(b'new')
+        self.assertEqual(path.read_bytes(), b'new')
+        self.path('a').write_text('text')
+        self.assertEqual(path.read_bytes(), b'text')
+
+    def test_unlink_invalidates(self):
+        '''Test a removed file is not read from the cache'''
+        path = self.path('a')
+        path.write_bytes(b'old')
+        path.read_bytes()
+        path.unlink()
+        with self.assertRaises(KeyError):
+            path.read_bytes()
+
+    def test_move_invalidates(self):
+        '''Test copies and renames drop the cached copies of both paths'''
+        source, target = self.path('a'), self.path('b')
+        source.write_bytes(b'source')
+        target.write_bytes(b'target')
+        self.assertEqual(target.read_bytes(), b'target')
+        source.copy_to(target)
+        self.assertEqual(target.read_bytes(), b'source')
+        source.write_bytes(b'renamed')
+        source.read_bytes()
+        source.rename(target)
+        self.assertEqual(target.read_bytes(), b'renamed')
+        with self.assertRaises(KeyError):
+            source.read_bytes()
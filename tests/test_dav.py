@@ -1,8 +1,13 @@
+import io
+import os
+import shutil
 import subprocess
+import tempfile
 
 import unittest
 
 from smartpath.dav import WebDavClient, WebDavPath
+from smartpath.transfer import upload_many
 
 
 class TestDavClient(unittest.TestCase):
@@ -13,3 +18,70 @@ class TestDavClient(unittest.TestCase):
 
     def test_webdavpath(self):
         WebDavPath()
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class UploadingClient(WebDavClient):
+    '''WebDavClient recording uploads instead of sending requests'''
+    def __init__(self):
+        self.uploads = {}
+
+    def _send(self, method, path, expected_code, data=None, **kwargs):
+        if method == 'PUT':
+            self.uploads[path] = data.read()
+            return Response(201)
+        elif method == 'HEAD':
+            return Response(200 if path in self.uploads else 404)
+        raise NotImplementedError(method)
+
+
+class TestDavClientWrite(unittest.TestCase):
+    def test_open_write(self):
+        '''Test written files are uploaded once closed'''
+        client = UploadingClient()
+        with client.open('/dir/a.bin', 'wb', spool_size=16) as f:
+            f.write(b'0123456789' * 10)
+            self.assertEqual(client.uploads, {})
+        self.assertEqual(client.uploads['/dir/a.bin'], b'0123456789' * 10)
+        with client.open('/dir/b.txt', 'w') as f:
+            f.write('h\u00e9llo')
+        self.assertEqual(client.uploads['/dir/b.txt'], 'h\u00e9llo'.encode())
+
+    def test_open_modes(self):
+        '''Test unsupported modes fail before anything is sent'''
+        client = UploadingClient()
+        client.uploads['/a'] = b''
+        with self.assertRaises(FileExistsError):
+            client.open('/a', 'xb')
+        for mode in ('ab', 'r+b'):
+            with self.assertRaises(io.UnsupportedOperation):
+                client.open('/a', mode)
+        self.assertEqual(client.uploads, {'/a': b''})
+
+
+class TestDavUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_upload_many(self):
+        '''Test small and streamed uploads to WebDAV destinations'''
+        client = UploadingClient()
+        pairs = []
+        for name, size in (('small', 10), ('large', 100000)):
+            filename = os.path.join(self.tmp, name)
+            with open(filename, 'wb') as f:
+                f.write(b'x' * size)
+            pairs.append((filename, WebDavPath('dav://host/dir/' + name,
+                                               session=client)))
+        result = upload_many(pairs, chunk_size=4096)
+        self.assertEqual(result.errors, [])
+        self.assertEqual(result.files, 2)
+        self.assertEqual(client.uploads, {'/dir/small': b'x' * 10,
+                                          '/dir/large': b'x' * 100000})
@@ -0,0 +1,127 @@
+import io
+import unittest
+
+from contextlib import contextmanager
+
+from smartpath import metrics
+from smartpath.base import BaseClient, BasePath
+
+
+class Client(BaseClient):
+    def stat(self, path):
+        return path
+
+    def read_bytes(self, path):
+        return b'12345'
+
+    def open(self, path, mode='rb'):
+        if 'w' in mode:
+            return self._open_write(path)
+        return io.BytesIO(b'abc\ndef\n')
+
+    @contextmanager
+    def _open_write(self, path):
+        stream = io.BytesIO()
+        yield stream
+        self.makedirs('/')  # on upload, as the Azure file client does
+
+    def scandir(self, path):
+        yield 'a'
+        yield 'b'
+
+    def listdir(self, path):
+        return list(self.scandir(path))
+
+    def mkdir(self, path):
+        pass
+
+    def makedirs(self, path):
+        self.mkdir(path)
+
+    def unlink(self, path):
+        raise IOError('denied')
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.default = metrics.get_registry()
+        self.registry = metrics.MetricsRegistry()
+        metrics.set_registry(self.registry)
+        self.client = Client('ftp://example.com/')
+
+    def tearDown(self):
+        metrics.set_registry(self.default)
+
+    def get(self, operation):
+        return self.registry.snapshot()[('ftp', 'example.com', operation)]
+
+    def test_calls(self):
+        '''Test client calls, errors and bytes are recorded'''
+        self.client.stat('/a')
+        self.client.stat('/b')
+        self.assertEqual(self.client.read_bytes('/a'), b'12345')
+        with self.assertRaises(IOError):
+            self.client.unlink('/a')
+        self.assertEqual(self.get('stat')['calls'], 2)
+        self.assertEqual(sum(self.get('stat')['buckets']), 2)
+        self.assertEqual(self.get('read_bytes')['bytes_in'], 5)
+        self.assertEqual(self.get('unlink')['errors'], 1)
+        # stubs which are not implemented are not recorded
+        with self.assertRaises(NotImplementedError):
+            self.client.rename('/a', '/b')
+        self.assertNotIn(('ftp', 'example.com', 'rename'),
+                         self.registry.snapshot())
+
+    def test_streams(self):
+        '''Test generators and files are metered until consumed'''
+        self.assertEqual(list(self.client.scandir('/')), ['a', 'b'])
+        self.assertEqual(self.get('scandir')['calls'], 1)
+        with self.client.open('/a') as f:
+            self.assertEqual(f.readline(), b'abc\n')
+            self.assertEqual(f.read(), b'def\n')
+        self.assertEqual(self.get('open')['bytes_in'], 8)
+
+    def test_write_context(self):
+        '''Test the bytes written through a context returned by open()'''
+        with self.client.open('/a', 'wb') as f:
+            f.write(b'12345')
+        self.assertEqual(self.get('open')['bytes_out'], 5)
+        self.assertNotIn(('ftp', 'example.com', 'makedirs'),
+                         self.registry.snapshot())
+
+    def test_nested(self):
+        '''Test operations called by other operations are not recorded'''
+        self.assertEqual(self.client.listdir('/'), ['a', 'b'])
+        self.client.makedirs('/a/b')
+        snapshot = self.registry.snapshot()
+        self.assertEqual(sorted(key[2] for key in snapshot),
+                         ['listdir', 'makedirs'])
+        self.client.mkdir('/a')
+        self.assertEqual(self.get('mkdir')['calls'], 1)
+
+    def test_hooks(self):
+        '''Test hooks receive each call'''
+        events = []
+        self.registry.add_hook(events.append)
+        self.client.stat('/a')
+        self.registry.enabled = False
+        self.client.stat('/a')
+        self.assertEqual([(e.scheme, e.host, e.operation) for e in events],
+                         [('ftp', 'example.com', 'stat')])
+
+    def test_prometheus(self):
+        '''Test the Prometheus text format'''
+        self.client.stat('/a')
+        text = self.registry.prometheus()
+        labels = 'scheme="ftp",host="example.com",operation="stat"'
+        self.assertIn('smartpath_operations_total{%s} 1' % labels, text)
+        self.assertIn('smartpath_operation_duration_seconds_bucket{%s,'
+                      'le="+Inf"} 1' % labels, text)
+        self.assertIn('# TYPE smartpath_operation_duration_seconds '
+                      'histogram', text)
+
+    def test_BasePath_metrics(self):
+        '''Test paths report the metrics of their host'''
+        self.client.stat('/a')
+        path = BasePath('ftp://example.com/a', session=self.client)
+        self.assertEqual(path.metrics()['stat']['calls'], 1)
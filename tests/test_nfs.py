@@ -17,7 +17,32 @@ class TestNFSClient(unittest.TestCase):
         self.assertIsInstance(nfs.getpath('/to/somewhere'), NFSPath)
 
 
+class ListingSession(object):
+    '''Stands in for a pooled NFS session, counting stat requests'''
+    def __init__(self):
+        self.stats = []
+
+    def listdir(self, path):
+        return ['.', '..', 'a']
+
+    def stat(self, path):
+        self.stats.append(path)
+        time = {'sec': 1}
+        return {'size': 3, 'mtime': time, 'atime': time, 'ctime': time,
+                'mode': 0o100644, 'uid': 0, 'gid': 0}
+
+
 class TestNFSPath(unittest.TestCase):
     def test_NFSPath(self):
         '''Test NFSPath()'''
         self.fail('todo')
+
+    def test_NFSPath_iterdir(self):
+        '''Test children are stat'ed lazily through the path's session'''
+        session = ListingSession()
+        children = list(NFSPath('nfs://host/dir', session=session).iterdir())
+        self.assertEqual([child.path for child in children], ['/dir/a'])
+        self.assertEqual(session.stats, [])
+        self.assertEqual(children[0].stat().st_size, 3)
+        self.assertFalse(children[0].is_dir())
+        self.assertEqual(session.stats, ['/dir/a'])
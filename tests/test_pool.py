@@ -0,0 +1,239 @@
+import io
+import threading
+import time
+import unittest
+
+from smartpath.base import BasePath
+from smartpath.pool import ConnectionPool, PooledSession, PoolTimeout
+
+
+class DummyConnection(object):
+    instances = 0
+
+    def __init__(self):
+        DummyConnection.instances += 1
+        self.closed = False
+        self.pings = 0
+        self.cwd = '/home'
+
+    def keep_alive(self):
+        if self.closed:
+            raise EOFError('connection closed')
+        self.pings += 1
+
+    def stat(self, path):
+        return (path, id(self))
+
+    def scandir(self, path):
+        for name in ('a', 'b'):
+            yield path + '/' + name
+
+    def open(self, path, mode='r'):
+        return io.BytesIO(path.encode())
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        DummyConnection.instances = 0
+        self.pool = ConnectionPool(max_size=2, keepalive_interval=None)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_ConnectionPool_reuse(self):
+        '''Test ConnectionPool reuses returned connections'''
+        conn = self.pool.acquire('key', DummyConnection)
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire('key', DummyConnection), conn)
+        self.assertEqual(DummyConnection.instances, 1)
+
+    def test_ConnectionPool_max_size(self):
+        '''Test ConnectionPool blocks when a key is at max_size'''
+        self.pool.timeout = 0.05
+        self.pool.acquire('key', DummyConnection)
+        self.pool.acquire('key', DummyConnection)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire('key', DummyConnection)
+        # other hosts are unaffected
+        self.pool.acquire('other', DummyConnection)
+
+    def test_ConnectionPool_exclusive_checkout(self):
+        '''Test threads each get their own connection'''
+        seen = []
+        barrier = threading.Barrier(2)
+
+        def worker():
+            with self.pool.connection('key', DummyConnection) as conn:
+                barrier.wait()
+                seen.append(conn)
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNot(seen[0], seen[1])
+
+    def test_ConnectionPool_evict_idle(self):
+        '''Test ConnectionPool.evict_idle() closes idle connections'''
+        conn = self.pool.acquire('key', DummyConnection)
+        self.pool.release(conn)
+        time.sleep(0.01)
+        self.assertEqual(self.pool.evict_idle(max_idle=0), 1)
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_ConnectionPool_keepalive(self):
+        '''Test ConnectionPool.keepalive() drops dead connections'''
+        alive = self.pool.acquire('key', DummyConnection)
+        dead = self.pool.acquire('key', DummyConnection)
+        dead.closed = True
+        self.pool.release(alive)
+        self.pool.release(dead)
+        self.pool.keepalive()
+        self.assertEqual(alive.pings, 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_ConnectionPool_held_by_caller(self):
+        '''Test a thread holding every connection fails instead of waiting
+        for itself'''
+        self.pool.timeout = None
+        self.pool.acquire('key', DummyConnection)
+        self.pool.acquire('key', DummyConnection)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire('key', DummyConnection)
+
+    def test_ConnectionPool_discard_on_error(self):
+        '''Test connections failing with connection errors are discarded'''
+        with self.assertRaises(EOFError):
+            with self.pool.connection('key', DummyConnection):
+                raise EOFError('lost')
+        self.assertEqual(len(self.pool), 0)
+
+
+class TestPooledSession(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=1, keepalive_interval=None,
+                                   timeout=0.05)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_PooledSession_lazy(self):
+        '''Test PooledSession does not connect until first use'''
+        DummyConnection.instances = 0
+        session = self.pool.session('key', DummyConnection)
+        self.assertIsInstance(session, PooledSession)
+        self.assertEqual(DummyConnection.instances, 0)
+        self.assertEqual(session.stat('/a')[0], '/a')
+        self.assertEqual(session.cwd, '/home')
+        self.assertEqual(DummyConnection.instances, 1)
+
+    def test_PooledSession_generator(self):
+        '''Test generators return their connection between pages'''
+        session = self.pool.session('key', DummyConnection)
+        entries = session.scandir('/dir')
+        self.assertEqual(next(entries), '/dir/a')
+        session.stat('/a')  # the listing holds no connection
+        self.assertEqual(list(entries), ['/dir/b'])
+
+    def test_PooledSession_pages(self):
+        '''Test listings are read a page at a time rather than up front'''
+        self.pool.page_size = 3
+        session = self.pool.session('key', WideConnection)
+        entries = session.scandir('/dir')
+        self.assertEqual(next(entries), 0)
+        conn = session.connection_id()
+        self.assertEqual(WideConnection.produced[conn], 3)
+        self.assertEqual([next(entries), next(entries)], [1, 2])
+        self.assertEqual(WideConnection.produced[conn], 3)
+        self.assertEqual(next(entries), 3)
+        self.assertEqual(WideConnection.produced[conn], 6)
+        self.assertEqual(list(entries), list(range(4, 10)))
+        self.assertEqual(len(self.pool), 1)
+
+    def test_PooledSession_open(self):
+        '''Test open files hold their connection until closed'''
+        session = self.pool.session('key', DummyConnection)
+        with session.open('/a', 'rb') as f:
+            self.assertEqual(f.read(), b'/a')
+            with self.assertRaises(PoolTimeout):
+                session.stat('/a')
+        session.stat('/a')
+
+
+class WideConnection(DummyConnection):
+    '''Every directory has 10 entries, counting how many were read'''
+    produced = {}
+
+    def connection_id(self):
+        return id(self)
+
+    def scandir(self, path):
+        for i in range(10):
+            WideConnection.produced[id(self)] = i + 1
+            yield i
+
+
+class TreeConnection(DummyConnection):
+    '''Every directory has the subdirectories 'a' and 'b', 5 levels deep'''
+    def scandir(self, path):
+        if path.count('/') < 5:
+            for name in ('a', 'b'):
+                yield name
+
+    def is_dir(self, path):
+        return path.count('/') < 5
+
+
+class TreePath(BasePath):
+    SESSION_FACTORY = TreeConnection
+    __slots__ = ()
+
+    def _pool_key(self):
+        return 'tree'
+
+
+class TestPooledPath(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=4, keepalive_interval=None)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def path(self, uri):
+        return TreePath(uri, session=self.pool.session('tree', TreeConnection))
+
+    def test_nested_iterdir(self):
+        '''Test a recursive iterdir() deeper than max_size does not block'''
+        def walk(path):
+            for child in path.iterdir():
+                yield child
+                for grandchild in walk(child):
+                    yield grandchild
+
+        paths = list(walk(self.path('tree://host/dir')))
+        self.assertEqual(len(paths), 2 + 4 + 8 + 16)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_paged_iterdir(self):
+        '''Test nested listings of a single pooled connection are paged'''
+        self.pool.max_size = 1
+        self.pool.page_size = 1
+        root = self.path('tree://host/dir')
+        entries = root.iterdir()
+        first = next(entries)
+        self.assertEqual([p.name for p in first.iterdir()], ['a', 'b'])
+        self.assertEqual([p.name for p in entries], ['b'])
+        self.assertEqual(len(self.pool), 1)
+
+    def test_open_in_iterdir(self):
+        '''Test files opened while iterating a directory'''
+        root = self.path('tree://host/dir')
+        for child in root.iterdir():
+            for grandchild in child.iterdir():
+                with grandchild.open('rb') as f:
+                    self.assertEqual(f.read(), grandchild.path.encode())
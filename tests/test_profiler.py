@@ -0,0 +1,110 @@
+import ftplib
+import io
+import unittest
+
+from contextlib import contextmanager
+
+from smartpath import profile, profiler
+from smartpath.base import BaseClient, BasePath
+
+
+class Client(BaseClient):
+    '''Records a round trip per call, as a client library would'''
+    files = ['file{}'.format(i) for i in range(12)]
+
+    def scandir(self, path):
+        profiler.record('test', 'LIST', path, bytes_in=100, listing=True)
+        for name in self.files:
+            yield name
+
+    def stat(self, path):
+        profiler.record('test', 'STAT', path)
+        return path
+
+    @contextmanager
+    def open(self, path, mode='r'):
+        # like the Azure clients, a context manager yielding a stream
+        profiler.record('test', 'OPEN', path)
+        stream = io.BytesIO()
+        yield stream
+        profiler.record('test', 'PUT', path, bytes_out=len(stream.getvalue()))
+
+    def exists(self, path):
+        # backends without a native exists() list the parent
+        profiler.record('test', 'LIST', path.rpartition('/')[0],
+                        listing=True)
+        return True
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.top = BasePath('test://example.com/top',
+                            session=Client('test://example.com/'))
+
+    def test_attribution(self):
+        '''Test round trips are attributed to the outermost path method'''
+        with profile() as report:
+            paths = list(self.top.iterdir())
+            paths[0].stat()
+            profiler.record('test', 'NOOP', '')
+        summary = report.summary()
+        self.assertEqual(summary['iterdir'], dict(calls=1, round_trips=1,
+                                                  bytes_in=100, bytes_out=0))
+        self.assertEqual(summary['stat']['round_trips'], 1)
+        self.assertEqual(len(report.unattributed), 1)
+        self.assertEqual(report.patterns(), [])
+        # nothing is recorded afterwards
+        paths[0].stat()
+        self.assertEqual(report.summary()['stat']['calls'], 1)
+
+    def test_patterns(self):
+        '''Test per-entry calls after a listing are flagged as N+1'''
+        with profile(threshold=10) as report:
+            for path in self.top.iterdir():
+                path.stat()
+                path.exists()
+        patterns = dict((p.kind, p) for p in report.patterns())
+        per_entry = [p for p in report.patterns() if p.kind == 'per-entry']
+        self.assertEqual(sorted((p.method, p.directory, p.calls)
+                                for p in per_entry),
+                         [('exists', '/top', 12), ('stat', '/top', 12)])
+        self.assertIn('after iterdir()', per_entry[0].message)
+        self.assertEqual(patterns['listing-fallback'].method, 'exists')
+        self.assertIn('N+1 patterns', str(report))
+
+    def test_ftplib(self):
+        '''Test FTP commands are recorded, without passwords'''
+        sendcmd, voidcmd = ftplib.FTP.sendcmd, ftplib.FTP.voidcmd
+        ftp = ftplib.FTP()
+        ftp.putcmd = lambda cmd: None
+        ftp.getresp = lambda: '200 OK'
+        with profile() as report:
+            ftp.sendcmd('PASS secret')
+            ftp.sendcmd('NLST /top')
+            ftp.cwd('/top')
+            ftp.mkd('/top/new')
+        self.assertEqual([(rt.request, rt.target, rt.listing)
+                          for rt in report.unattributed],
+                         [('PASS', '****', False), ('NLST', '/top', True),
+                          ('CWD', '/top', False), ('MKD', '/top/new', False)])
+        self.assertIs(ftplib.FTP.sendcmd, sendcmd)
+        self.assertIs(ftplib.FTP.voidcmd, voidcmd)
+
+    def test_context_manager(self):
+        '''Test requests of context managers returned by open() are
+        attributed to it'''
+        path = self.top.joinpath('new')
+        with profile() as report:
+            with path.open('wb') as f:
+                f.write(b'data')
+        summary = report.summary()
+        self.assertEqual(summary['open'], dict(calls=1, round_trips=2,
+                                               bytes_in=0, bytes_out=4))
+        self.assertEqual(report.unattributed, [])
+
+    def test_nested(self):
+        '''Test only one profile records at a time'''
+        with profile():
+            with self.assertRaises(RuntimeError):
+                with profile():
+                    pass
@@ -0,0 +1,220 @@
+import io
+import threading
+import unittest
+
+from smartpath.streams import (BlockWriter, FileAdapter, RangedReader,
+                               ResumableReader, SpooledWriter, open_reader,
+                               open_stream, open_upload)
+
+DATA = bytes(bytearray(range(256))) * 64
+
+
+class RecordingSource(object):
+    '''Serves byte ranges from DATA, recording each request'''
+    def __init__(self):
+        self.requests = []
+        self.opened = []
+
+    def fetch(self, offset, length):
+        self.requests.append((offset, length))
+        return DATA[offset:offset + length]
+
+    def open_at(self, offset):
+        self.opened.append(offset)
+        return io.BytesIO(DATA[offset:])
+
+
+class NonSeekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+
+class TestRangedReader(unittest.TestCase):
+    def test_RangedReader_header(self):
+        '''Test reading a header only fetches the readahead'''
+        source = RecordingSource()
+        with open_reader(RangedReader(source.fetch), buffer_size=512) as f:
+            self.assertEqual(f.read(200), DATA[:200])
+        self.assertEqual(source.requests, [(0, 512)])
+
+    def test_RangedReader_seek(self):
+        '''Test seeking fetches only the requested range'''
+        source = RecordingSource()
+        raw = RangedReader(source.fetch, size=lambda: len(DATA))
+        with open_reader(raw, buffer_size=16) as f:
+            f.seek(-10, io.SEEK_END)
+            self.assertEqual(f.read(), DATA[-10:])
+            f.seek(1000)
+            self.assertEqual(f.read(4), DATA[1000:1004])
+        self.assertNotIn((0, 16), source.requests)
+
+    def test_RangedReader_readall(self):
+        '''Test read() fetches in chunks until end of file'''
+        source = RecordingSource()
+        raw = RangedReader(source.fetch, chunk_size=4096)
+        self.assertEqual(raw.readall(), DATA)
+        self.assertEqual(len(source.requests), len(DATA) // 4096 + 1)
+
+    def test_RangedReader_text(self):
+        '''Test text mode decodes lazily'''
+        text = 'hello\nworld\n'.encode('utf8')
+        raw = RangedReader(lambda o, n: text[o:o + n], size=len(text))
+        with open_reader(raw, 'r') as f:
+            self.assertEqual(f.readline(), 'hello\n')
+            self.assertEqual(f.read(), 'world\n')
+
+
+class TestResumableReader(unittest.TestCase):
+    def test_ResumableReader_sequential(self):
+        '''Test sequential reads reuse a single transfer'''
+        opened = []
+        raw = ResumableReader(lambda o: opened.append(o) or NonSeekable(DATA[o:]))
+        with open_reader(raw, buffer_size=100) as f:
+            self.assertEqual(f.read(300), DATA[:300])
+            self.assertEqual(f.read(), DATA[300:])
+        self.assertEqual(opened, [0])
+
+    def test_ResumableReader_reopen(self):
+        '''Test jumps reopen non-seekable transfers at the new offset'''
+        source = RecordingSource()
+
+        def open_at(offset):
+            source.opened.append(offset)
+            return NonSeekable(DATA[offset:])
+
+        with open_reader(ResumableReader(open_at), buffer_size=10) as f:
+            f.read(5)
+            f.seek(5000)
+            self.assertEqual(f.read(3), DATA[5000:5003])
+        self.assertEqual(source.opened, [0, 5000])
+
+    def test_ResumableReader_seekable(self):
+        '''Test jumps seek seekable transfers rather than reopening'''
+        source = RecordingSource()
+        with open_reader(ResumableReader(source.open_at),
+                         buffer_size=10) as f:
+            f.read(5)
+            f.seek(5000)
+            self.assertEqual(f.read(3), DATA[5000:5003])
+        self.assertEqual(source.opened, [0])
+
+
+class RecordingStore(object):
+    '''Collects uploaded blocks and the committed block list'''
+    def __init__(self, fail_on=None):
+        self.blocks = {}
+        self.committed = None
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def put_block(self, block_id, data):
+        if block_id == self.fail_on:
+            raise IOError('upload failed')
+        with self.lock:
+            self.blocks[block_id] = data
+
+    def commit(self, block_ids):
+        self.committed = b''.join(self.blocks[i] for i in block_ids)
+
+
+class TestBlockWriter(unittest.TestCase):
+    def test_BlockWriter_blocks(self):
+        '''Test writes are uploaded in blocks and committed in order'''
+        store = RecordingStore()
+        writer = BlockWriter(store.put_block, store.commit, block_size=1000)
+        with writer:
+            for i in range(0, len(DATA), 300):
+                writer.write(DATA[i:i + 300])
+            self.assertIsNone(store.committed)
+        self.assertEqual(store.committed, DATA)
+        self.assertEqual(len(store.blocks), len(DATA) // 1000 + 1)
+        self.assertTrue(all(len(b) <= 1000 for b in store.blocks.values()))
+
+    def test_BlockWriter_bounded(self):
+        '''Test writes wait while max_pending blocks are in flight'''
+        release = threading.Event()
+        store = RecordingStore()
+
+        def put_block(block_id, data):
+            release.wait()
+            store.put_block(block_id, data)
+
+        writer = BlockWriter(put_block, store.commit, block_size=10,
+                             max_workers=1, max_pending=2)
+        thread = threading.Thread(target=writer.write, args=(DATA[:50],))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        release.set()
+        thread.join()
+        writer.close()
+        self.assertEqual(store.committed, DATA[:50])
+
+    def test_BlockWriter_error(self):
+        '''Test failed uploads raise and are never committed'''
+        store = RecordingStore(fail_on='1')
+        writer = BlockWriter(store.put_block, store.commit, block_size=10)
+        writer.write(DATA[:100])
+        with self.assertRaises(IOError):
+            writer.close()
+        self.assertIsNone(store.committed)
+
+    def test_BlockWriter_abort(self):
+        '''Test abort() discards the upload'''
+        store = RecordingStore()
+        writer = BlockWriter(store.put_block, store.commit, block_size=10)
+        writer.write(DATA[:25])
+        writer.abort()
+        self.assertTrue(writer.closed)
+        self.assertIsNone(store.committed)
+
+
+class TestSpooledWriter(unittest.TestCase):
+    def test_SpooledWriter_upload(self):
+        '''Test the whole file is uploaded once closed, spooled to disk'''
+        uploads = []
+        raw = SpooledWriter(lambda f: uploads.append(f.read()), max_size=100)
+        with open_upload(raw, 'wb', 64) as f:
+            for i in range(0, len(DATA), 300):
+                f.write(DATA[i:i + 300])
+            self.assertEqual(uploads, [])
+        self.assertEqual(uploads, [DATA])
+
+    def test_SpooledWriter_abort(self):
+        '''Test abort() discards the upload'''
+        uploads = []
+        writer = SpooledWriter(uploads.append)
+        writer.write(DATA[:25])
+        writer.abort()
+        self.assertTrue(writer.closed)
+        self.assertEqual(uploads, [])
+
+    def test_open_upload_error(self):
+        '''Test nothing is uploaded when the with block raises'''
+        uploads = []
+        raw = SpooledWriter(lambda f: uploads.append(f.read()))
+        with self.assertRaises(IOError):
+            with open_upload(raw, 'w', 16) as f:
+                f.write('partial' * 10)
+                raise IOError('source lost')
+        self.assertTrue(raw.closed)
+        self.assertEqual(uploads, [])
+
+
+class TestFileAdapter(unittest.TestCase):
+    def test_FileAdapter_text_write(self):
+        '''Test library file objects can be written in text mode'''
+        remote = io.BytesIO()
+        remote.close = lambda: None  # keep the value readable
+        with open_stream(FileAdapter(remote, 'wb'), 'w', 16) as f:
+            f.write('h\u00e9llo ' * 10)
+        self.assertEqual(remote.getvalue().decode('utf8'), 'h\u00e9llo ' * 10)
+
+    def test_FileAdapter_read(self):
+        '''Test buffered reads and seeks pass through to the file'''
+        raw = FileAdapter(io.BytesIO(DATA), 'rb')
+        with open_stream(raw, 'rb', 64) as f:
+            f.seek(100)
+            self.assertEqual(f.read(10), DATA[100:110])
+            self.assertEqual(f.read(), DATA[110:])
+        self.assertTrue(raw.closed)
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from smartpath.sync import ManifestEntry, diff, manifest, sync
+
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        self.dst = os.path.join(self.tmp, 'dst')
+        write(os.path.join(self.src, 'a'), b'a')
+        write(os.path.join(self.src, 'sub', 'b'), b'b')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_diff(self):
+        '''Test diff() merge-joins sorted manifests'''
+        src = [ManifestEntry('a', 1, 0), ManifestEntry('b', 1, 0),
+               ManifestEntry('c', 2, 0)]
+        dst = [ManifestEntry('b', 1, 0), ManifestEntry('c', 1, 0),
+               ManifestEntry('d', 1, 0)]
+        self.assertEqual([(action, (s or d).path)
+                          for action, s, d in diff(src, dst)],
+                         [('new', 'a'), ('unchanged', 'b'), ('changed', 'c'),
+                          ('deleted', 'd')])
+
+    def test_sync(self):
+        '''Test sync() only copies new and changed files'''
+        report = sync(self.src, self.dst)
+        self.assertEqual(report.new, ['a', 'sub/b'])
+        self.assertEqual([e.path for e in manifest(self.dst)], ['a', 'sub/b'])
+
+        report = sync(self.src, self.dst)
+        self.assertEqual((report.new, report.changed, report.unchanged),
+                         ([], [], 2))
+        self.assertEqual(report.transfer.files, 0)
+
+        write(os.path.join(self.src, 'a'), b'longer')
+        report = sync(self.src, self.dst)
+        self.assertEqual(report.changed, ['a'])
+        with open(os.path.join(self.dst, 'a'), 'rb') as f:
+            self.assertEqual(f.read(), b'longer')
+
+    def test_sync_delete(self):
+        '''Test sync() deletes extra files, unless a dry run'''
+        sync(self.src, self.dst)
+        write(os.path.join(self.dst, 'extra'), b'x')
+        self.assertEqual(sync(self.src, self.dst).deleted, [])
+
+        report = sync(self.src, self.dst, delete=True, dry_run=True)
+        self.assertEqual(report.deleted, ['extra'])
+        self.assertTrue(os.path.exists(os.path.join(self.dst, 'extra')))
+
+        report = sync(self.src, self.dst, delete=True)
+        self.assertTrue(report.ok)
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'extra')))
@@ -0,0 +1,218 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from smartpath.base import BasePath, DirEntry, make_stat
+from smartpath.pool import ConnectionPool, set_pool
+from smartpath.transfer import (copy, download_dir, upload_dir,
+                                upload_many)
+
+DATA = bytes(bytearray(range(256))) * 1024
+
+
+class MemoryPath(object):
+    '''Path-like object backed by bytes, tracking concurrent chunks'''
+    def __init__(self, data=None, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.aborted = False
+
+    def open(self, mode='rb'):
+        if 'r' in mode:
+            return Reader(self.data, self.fail_after)
+        return Writer(self)
+
+
+class Reader(io.BytesIO):
+    def __init__(self, data, fail_after):
+        super(Reader, self).__init__(data)
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self, n=-1):
+        self.reads += 1
+        if self.fail_after is not None and self.reads > self.fail_after:
+            raise IOError('connection lost')
+        return super(Reader, self).read(n)
+
+
+class Writer(io.BytesIO):
+    def __init__(self, path):
+        super(Writer, self).__init__()
+        self.path = path
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.path.data = self.getvalue()
+        else:
+            self.path.aborted = True
+        return super(Writer, self).__exit__(exc_type, *args)
+
+
+class TestCopy(unittest.TestCase):
+    def test_copy(self):
+        '''Test copy() streams all chunks and reports progress'''
+        dst = MemoryPath()
+        seen = []
+        stats = copy(MemoryPath(DATA), dst, chunk_size=4096,
+                     progress=lambda s: seen.append(s.bytes))
+        self.assertEqual(dst.data, DATA)
+        self.assertEqual(stats.bytes, len(DATA))
+        self.assertEqual(stats.chunks, len(DATA) // 4096)
+        self.assertEqual(seen[-1], len(DATA))
+        self.assertGreater(stats.throughput, 0)
+
+    def test_copy_bounded(self):
+        '''Test the reader never runs more than max_chunks ahead'''
+        ahead = []
+        reader = Reader(DATA, None)
+        src = MemoryPath()
+        src.open = lambda mode: reader
+
+        def progress(stats):
+            time.sleep(0.001)  # slow writer
+            ahead.append(reader.reads - stats.chunks)
+
+        copy(src, MemoryPath(), chunk_size=1024, max_chunks=2,
+             progress=progress)
+        # the queued chunks plus one waiting to be put
+        self.assertLessEqual(max(ahead), 2 + 1)
+
+    def test_copy_read_error(self):
+        '''Test read errors are raised and abort the destination'''
+        dst = MemoryPath()
+        with self.assertRaises(IOError):
+            copy(MemoryPath(DATA, fail_after=3), dst, chunk_size=1024)
+        self.assertTrue(dst.aborted)
+        self.assertIsNone(dst.data)
+
+
+class Server(object):
+    '''In-memory server (and client session) tracking concurrent writes'''
+    def __init__(self, delay=0, fail=()):
+        self.files = {}
+        self.dirs = set()
+        self.delay = delay
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+
+    def write(self, path, data):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(self.delay)
+            if path in self.fail:
+                raise IOError('upload failed')
+            self.files[path] = data
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def makedirs(self, path):
+        self.dirs.add(path)
+
+    def scandir(self, path):
+        prefix = path.rstrip('/') + '/'
+        names = {f[len(prefix):].split('/')[0] for f in self.files
+                 if f.startswith(prefix)}
+        for name in sorted(names):
+            data = self.files.get(prefix + name)
+            yield DirEntry(name, prefix + name, data is None,
+                           make_stat(len(data or b''), is_dir=data is None))
+
+    def open(self, path, mode='rb'):
+        return io.BytesIO(self.files[path])
+
+
+class RemotePath(object):
+    '''Minimal remote path on a `Server`'''
+    scheme, port = 'mem', None
+
+    def __init__(self, server, path, hostname='host'):
+        self.session = server
+        self.path = path
+        self.hostname = hostname
+
+    def joinpath(self, *names):
+        return RemotePath(self.session, '/'.join((self.path,) + names),
+                          self.hostname)
+
+    def is_dir(self):
+        return self.path in self.session.dirs
+
+    def write_bytes(self, data):
+        self.session.write(self.path, data)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def local(self, name, data=b'data'):
+        path = os.path.join(self.tmp, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_upload_many(self):
+        '''Test uploads are limited per host and errors are collected'''
+        busy, other = Server(delay=0.01, fail=('/3',)), Server(delay=0.01)
+        src = self.local('a')
+        pairs = [(src, RemotePath(busy, '/{}'.format(i))) for i in range(10)]
+        pairs += [(src, RemotePath(other, '/o', hostname='other'))]
+        seen = []
+        result = upload_many(pairs, max_workers=8, max_per_host=2,
+                             progress=lambda r: seen.append(r.files))
+        self.assertEqual(busy.peak, 2)
+        self.assertEqual(result.files, 10)
+        self.assertEqual([str(e[1].path) for e in result.errors], ['/3'])
+        self.assertFalse(result.ok)
+        self.assertEqual(result.bytes, 40)
+        self.assertEqual(len(seen), 11)
+        self.assertEqual(other.files, {'/o': b'data'})
+
+    def test_upload_many_pool_size(self):
+        '''Test uploads per host default to the connection pool's max_size'''
+        server = Server(delay=0.01)
+        src = self.local('a')
+        pairs = [(src, RemotePath(server, '/{}'.format(i))) for i in range(10)]
+        pool = set_pool(ConnectionPool(max_size=3, keepalive_interval=None))
+        try:
+            result = upload_many(pairs, max_workers=8)
+        finally:
+            set_pool(None)
+        self.assertTrue(result.ok)
+        self.assertEqual(server.peak, pool.max_size)
+
+    def test_upload_dir(self):
+        '''Test upload_dir() mirrors the tree and creates directories'''
+        self.local('x/1', b'one')
+        self.local('x/sub/2', b'two')
+        server = Server()
+        result = upload_dir(os.path.join(self.tmp, 'x'),
+                            RemotePath(server, '/r'))
+        self.assertTrue(result.ok)
+        self.assertEqual(server.files, {'/r/1': b'one', '/r/sub/2': b'two'})
+        self.assertEqual(server.dirs, {'/r', '/r/sub'})
+
+    def test_download_dir(self):
+        '''Test download_dir() mirrors a remote tree locally'''
+        server = Server()
+        server.files = {'/r/1': b'one', '/r/sub/2': b'two' * 1000}
+        result = download_dir(BasePath('ftp://host/r', server),
+                              os.path.join(self.tmp, 'out'), chunk_size=100)
+        self.assertTrue(result.ok, result.errors)
+        with open(os.path.join(self.tmp, 'out', 'sub', '2'), 'rb') as f:
+            self.assertEqual(f.read(), b'two' * 1000)
+        self.assertEqual(result.files, 2)